@@ -0,0 +1,450 @@
+from array import array
+from pathlib import Path
+from typing import (
+    NoReturn,
+    Optional
+)
+
+import numpy as np
+
+from chip8 import (
+    Chip8,
+    CHIP8,
+    FONT_SET,
+    KEYPAD_SIZE,
+    QuirkProfile,
+    REGISTERS_COUNT,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    STACK_DEPTH,
+    SYSTEM_MEMORY,
+    key_mask
+)
+from decoder import InstructionDecoder
+
+
+class BatchChip8:
+    """
+    Many Chip8 machines stepped in lockstep. Every piece of state is a NumPy array
+    shaped (batch, ...); each step groups the machines by the handler their opcode
+    decodes to and runs every group with vectorized operations. Handlers share the
+    names and semantics of the Chip8 ones.
+
+    A machine touching memory out of bounds is marked in `fault` and stops, where
+    Chip8 would raise. Only CHIP-8 is supported: a machine reaching a SUPER-CHIP
+    instruction faults too.
+    """
+
+    # handler name of every opcode as an index into _handler_names
+    _opcode_handlers: Optional[np.ndarray] = None
+    _handler_names = []
+
+    @classmethod
+    def opcode_handlers(cls) -> np.ndarray:
+        if cls._opcode_handlers is None:
+            names = {}
+            handlers = [names.setdefault(name, len(names)) for name, _ in InstructionDecoder.decode_table()]
+            cls._handler_names = list(names)
+            cls._opcode_handlers = np.array(handlers, dtype=np.uint8)
+        return cls._opcode_handlers
+
+    def __init__(self, batch_size: int, seed: Optional[int] = None, quirks: QuirkProfile = CHIP8):
+        """
+        :param quirks: Interpreter behaviours of every machine in the batch
+        """
+        self.batch_size = batch_size
+        self.quirks = quirks
+        self.memory = np.zeros((batch_size, SYSTEM_MEMORY), dtype=np.uint8)
+        self.pc = np.zeros(batch_size, dtype=np.int32)
+        self.v = np.zeros((batch_size, REGISTERS_COUNT), dtype=np.uint8)
+        self.index_reg = np.zeros(batch_size, dtype=np.int32)
+        self.delay_reg = np.zeros(batch_size, dtype=np.uint8)
+        self.sound_reg = np.zeros(batch_size, dtype=np.uint8)
+        self.stack = np.zeros((batch_size, STACK_DEPTH), dtype=np.uint16)
+        self.sp = np.zeros(batch_size, dtype=np.int32)
+        # row bitmasks like Chip8.gfx, leftmost pixel in the highest bit
+        self.gfx = np.zeros((batch_size, SCREEN_HEIGHT), dtype=np.uint64)
+        # keypad state of each machine like Chip8.keys, bit n set while key n is held
+        self.keys = np.zeros(batch_size, dtype=np.int32)
+        self.draw_flag = np.zeros(batch_size, dtype=bool)
+        self.halt_execution = np.zeros(batch_size, dtype=bool)
+        self.fault = np.zeros(batch_size, dtype=bool)
+        self.rng = np.random.default_rng(seed)
+        self._handlers = None
+
+    def initialize(self) -> NoReturn:
+        """
+        Initialize registers and memory of every machine
+        """
+        self.pc[:] = self.quirks.load_address
+        self.memory[:, :len(FONT_SET)] = np.frombuffer(FONT_SET, dtype=np.uint8)
+
+    def load_game(self, game_path: Path) -> NoReturn:
+        """
+        Load the same game into every machine
+        :param game_path: Game to load
+        """
+        game = np.frombuffer(game_path.read_bytes(), dtype=np.uint8)
+        load_address = self.quirks.load_address
+        if len(game) > SYSTEM_MEMORY - load_address:
+            raise ValueError(f"Game size {len(game)} bytes does not fit in memory")
+
+        self.memory[:, load_address: load_address + len(game)] = game
+
+    @classmethod
+    def from_chip8(cls, chip8: Chip8, batch_size: int, seed: Optional[int] = None) -> 'BatchChip8':
+        """
+        Replicate the state of a single machine across a batch
+        """
+        batch = cls(batch_size, seed, chip8.quirks)
+        batch.memory[:] = np.frombuffer(chip8.memory, dtype=np.uint8)
+        batch.pc[:] = chip8.pc
+        batch.v[:] = np.frombuffer(chip8.v, dtype=np.uint8)
+        batch.index_reg[:] = chip8.index_reg
+        batch.delay_reg[:] = chip8.delay_reg
+        batch.sound_reg[:] = chip8.sound_reg
+        batch.stack[:] = np.array(chip8.stack, dtype=np.uint16)
+        batch.sp[:] = chip8.sp
+        batch.gfx[:] = np.array(chip8.gfx, dtype=np.uint64)
+        batch.keys[:] = chip8.keys
+        batch.draw_flag[:] = chip8.draw_flag
+        batch.halt_execution[:] = chip8.halt_execution
+        return batch
+
+    def instance(self, i: int) -> Chip8:
+        """
+        Copy the state of one machine of the batch into a Chip8
+        """
+        chip8 = Chip8(quirks=self.quirks)
+        chip8.initialize()
+        chip8.memory[:] = self.memory[i].tobytes()
+        chip8.pc = int(self.pc[i])
+        chip8.v[:] = self.v[i].tobytes()
+        chip8.index_reg = int(self.index_reg[i])
+        chip8.delay_reg = int(self.delay_reg[i])
+        chip8.sound_reg = int(self.sound_reg[i])
+        chip8.stack[:] = array('H', self.stack[i].tolist())
+        chip8.sp = int(self.sp[i])
+        chip8.gfx[:] = [int(row) for row in self.gfx[i]]
+        chip8.keys = int(self.keys[i])
+        chip8.draw_flag = bool(self.draw_flag[i])
+        chip8.halt_execution = bool(self.halt_execution[i])
+        return chip8
+
+    def key_press(self, i: int, keys: str) -> NoReturn:
+        """
+        Hold exactly the given keys on one machine, '' to release them all
+        """
+        self.keys[i] = key_mask(keys)
+
+    def _held(self, idx, op) -> np.ndarray:
+        # registers past the keypad select no key
+        key = np.minimum(self.v[idx, op >> 8 & 0xF], KEYPAD_SIZE).astype(np.int32)
+        return (self.keys[idx] >> key & 1).astype(bool)
+
+    def tick_timers(self) -> NoReturn:
+        self.delay_reg[self.delay_reg > 0] -= 1
+        self.sound_reg[self.sound_reg > 0] -= 1
+
+    def run(self, cycles: int) -> int:
+        """
+        Step every machine of the batch
+        :param cycles: Number of instructions each machine executes
+        :return: Number of instructions executed per machine
+        """
+        for _ in range(cycles):
+            self.step()
+        return cycles
+
+    def run_frames(self, frames: int, cycles_per_frame: int) -> int:
+        """
+        Emulate frames headless, ticking the timers once per frame like FrameScheduler
+        :return: Number of instructions executed per machine
+        """
+        for _ in range(frames):
+            self.run(cycles_per_frame)
+            self.tick_timers()
+        return frames * cycles_per_frame
+
+    def step(self) -> NoReturn:
+        if self._handlers is None:
+            opcode_handlers = self.opcode_handlers()
+            variants = self.quirks.handlers()
+            self._handlers = [getattr(self, variants.get(name, name), self._unsupported)
+                              for name in self._handler_names]
+        else:
+            opcode_handlers = self._opcode_handlers
+
+        # fetch
+        self.fault |= self.pc >= SYSTEM_MEMORY - 1
+        idx = np.flatnonzero(~self.fault)
+        if not len(idx):
+            return
+        pc = self.pc[idx]
+        opcodes = self.memory[idx, pc].astype(np.int32) << 8 | self.memory[idx, pc + 1]
+
+        # decode, one group per handler
+        handler_ids = opcode_handlers[opcodes]
+        order = np.argsort(handler_ids, kind='stable')
+        groups, starts = np.unique(handler_ids[order], return_index=True)
+        bounds = list(starts[1:]) + [len(order)]
+
+        # execute
+        for handler_id, start, end in zip(groups, starts, bounds):
+            group = order[start:end]
+            self._handlers[handler_id](idx[group], opcodes[group])
+
+        # update program counter
+        advance = idx[~self.halt_execution[idx] & ~self.fault[idx] & (self.pc[idx] + 2 < SYSTEM_MEMORY)]
+        self.pc[advance] += 2
+
+    # INSTRUCTIONS EXECUTION
+    # idx: machines running the instruction, op: their opcodes
+
+    def _skip(self, idx, condition) -> NoReturn:
+        self.pc[idx[condition]] += 2
+
+    def _set_flag_and_result(self, idx, x, flag, result) -> NoReturn:
+        # VF is written first, so VX wins when x is 0xF
+        self.v[idx, 0xF] = flag
+        self.v[idx, x] = result
+
+    def _unsupported(self, idx, op) -> NoReturn:
+        self.fault[idx] = True
+
+    def do_nothing(self, idx, op) -> NoReturn:
+        pass
+
+    def clear_display_00e0(self, idx, op) -> NoReturn:
+        self.gfx[idx] = 0
+        self.draw_flag[idx] = True
+
+    def return_subroutine_00ee(self, idx, op) -> NoReturn:
+        self.sp[idx] = (self.sp[idx] - 1) & (STACK_DEPTH - 1)
+        self.pc[idx] = self.stack[idx, self.sp[idx]]
+
+    def jump_to_1nnn(self, idx, op) -> NoReturn:
+        self.pc[idx] = (op & 0x0FFF) - 2
+
+    def call_subroutine_2nnn(self, idx, op) -> NoReturn:
+        self.stack[idx, self.sp[idx]] = self.pc[idx]
+        self.sp[idx] = (self.sp[idx] + 1) & (STACK_DEPTH - 1)
+        self.pc[idx] = (op & 0x0FFF) - 2
+
+    def skip_if_equal_value_3xkk(self, idx, op) -> NoReturn:
+        self._skip(idx, self.v[idx, op >> 8 & 0xF] == (op & 0xFF))
+
+    def skip_if_not_equal_value_4xkk(self, idx, op) -> NoReturn:
+        self._skip(idx, self.v[idx, op >> 8 & 0xF] != (op & 0xFF))
+
+    def skip_if_equal_reg_5xy0(self, idx, op) -> NoReturn:
+        self._skip(idx, self.v[idx, op >> 8 & 0xF] == self.v[idx, op >> 4 & 0xF])
+
+    def set_reg_value_6xkk(self, idx, op) -> NoReturn:
+        self.v[idx, op >> 8 & 0xF] = op & 0xFF
+
+    def add_value_7xkk(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        result = self.v[idx, x].astype(np.int32) + (op & 0xFF)
+        self._set_flag_and_result(idx, x, result > 0xFF, result & 0xFF)
+
+    def set_reg_reg_8xy0(self, idx, op) -> NoReturn:
+        self.v[idx, op >> 8 & 0xF] = self.v[idx, op >> 4 & 0xF]
+
+    def or_reg_reg_8xy1(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        self.v[idx, x] = self.v[idx, x] | self.v[idx, op >> 4 & 0xF]
+
+    def and_reg_reg_8xy2(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        self.v[idx, x] = self.v[idx, x] & self.v[idx, op >> 4 & 0xF]
+
+    def xor_reg_reg_8xy3(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        self.v[idx, x] = self.v[idx, x] ^ self.v[idx, op >> 4 & 0xF]
+
+    def add_reg_carry_8xy4(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        result = self.v[idx, x].astype(np.int32) + self.v[idx, op >> 4 & 0xF]
+        self._set_flag_and_result(idx, x, result > 0xFF, result & 0xFF)
+
+    def sub_reg_reg_8xy5(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        y = op >> 4 & 0xF
+        self.v[idx, 0xF] = self.v[idx, x] >= self.v[idx, y]
+        # operands are read again after VF, like the interpreter does
+        self.v[idx, x] = (self.v[idx, x].astype(np.int32) - self.v[idx, y]) & 0xFF
+
+    def shr_reg_8xy6(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        y = op >> 4 & 0xF
+        self.v[idx, 0xF] = self.v[idx, y] & 0x1
+        self.v[idx, x] = self.v[idx, y] >> 0x1
+
+    def shr_reg_8xy6_vx(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        self.v[idx, 0xF] = self.v[idx, x] & 0x1
+        self.v[idx, x] = self.v[idx, x] >> 0x1
+
+    def subn_reg_reg_8xy7(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        y = op >> 4 & 0xF
+        self.v[idx, 0xF] = self.v[idx, y] >= self.v[idx, x]
+        self.v[idx, x] = (self.v[idx, y].astype(np.int32) - self.v[idx, x]) & 0xFF
+
+    def shl_reg_8xye(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        y = op >> 4 & 0xF
+        self.v[idx, 0xF] = (self.v[idx, y] >> 7) & 0x01
+        self.v[idx, x] = (self.v[idx, y].astype(np.int32) << 1) & 0xFF
+
+    def shl_reg_8xye_vx(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        self.v[idx, 0xF] = (self.v[idx, x] >> 7) & 0x01
+        self.v[idx, x] = (self.v[idx, x].astype(np.int32) << 1) & 0xFF
+
+    def skip_if_not_equal_reg_9xy0(self, idx, op) -> NoReturn:
+        self._skip(idx, self.v[idx, op >> 8 & 0xF] != self.v[idx, op >> 4 & 0xF])
+
+    def set_index_value_annn(self, idx, op) -> NoReturn:
+        self.index_reg[idx] = op & 0x0FFF
+
+    def jump_value_offset_bnnn(self, idx, op) -> NoReturn:
+        self.pc[idx] = self.v[idx, 0].astype(np.int32) + (op & 0x0FFF) - 2
+
+    def jump_value_offset_bxnn(self, idx, op) -> NoReturn:
+        self.pc[idx] = self.v[idx, op >> 8 & 0xF].astype(np.int32) + (op & 0x0FFF) - 2
+
+    def set_random_and_value_cxkk(self, idx, op) -> NoReturn:
+        rnd = self.rng.integers(0, 256, size=len(idx), dtype=np.int32)
+        self.v[idx, op >> 8 & 0xF] = rnd & op & 0xFF
+
+    def display_sprite_dxyn(self, idx, op) -> NoReturn:
+        screen_x = self.v[idx, op >> 8 & 0xF].astype(np.int64)
+        screen_y = self.v[idx, op >> 4 & 0xF].astype(np.int64)
+        index = self.index_reg[idx]
+        # sprite rows overlapping the screen and the memory
+        sprite_h = np.clip(np.minimum(op & 0xF, SCREEN_HEIGHT - screen_y), 0, None)
+        sprite_h = np.minimum(sprite_h, np.clip(SYSTEM_MEMORY - index, 0, None))
+
+        # align each sprite byte with the screen row, clipping at the right edge
+        shift = SCREEN_WIDTH - 8 - screen_x
+        left = np.clip(shift, 0, 63).astype(np.uint64)
+        right = np.clip(-shift, 0, 63).astype(np.uint64)
+        collision = np.zeros(len(idx), dtype=np.uint64)
+        for row in range(int(sprite_h.max(initial=0))):
+            drawn = row < sprite_h
+            byte = self.memory[idx, np.where(drawn, index + row, 0)].astype(np.uint64)
+            sprite_row = np.where(shift >= 0, byte << left, byte >> right)
+            sprite_row[~drawn] = 0
+            screen_row = np.where(drawn, screen_y + row, 0)
+            line = self.gfx[idx, screen_row]
+            collision |= line & sprite_row
+            self.gfx[idx, screen_row] = line ^ sprite_row
+
+        self.v[idx, 0xF] = collision != 0
+        self.draw_flag[idx] = True
+
+    def display_sprite_dxyn_wrap(self, idx, op) -> NoReturn:
+        screen_x = (self.v[idx, op >> 8 & 0xF] % SCREEN_WIDTH).astype(np.uint64)
+        screen_y = self.v[idx, op >> 4 & 0xF].astype(np.int64) % SCREEN_HEIGHT
+        index = self.index_reg[idx]
+        sprite_h = np.minimum(op & 0xF, np.clip(SYSTEM_MEMORY - index, 0, None))
+
+        # rotate each sprite byte from the left edge to its column, wrapping at the right edge
+        left = (SCREEN_WIDTH - screen_x) % SCREEN_WIDTH
+        collision = np.zeros(len(idx), dtype=np.uint64)
+        for row in range(int(sprite_h.max(initial=0))):
+            drawn = row < sprite_h
+            byte = self.memory[idx, np.where(drawn, index + row, 0)].astype(np.uint64) << np.uint64(56)
+            sprite_row = byte >> screen_x | byte << left
+            sprite_row[~drawn] = 0
+            screen_row = (screen_y + row) % SCREEN_HEIGHT
+            line = self.gfx[idx, screen_row]
+            collision |= line & sprite_row
+            self.gfx[idx, screen_row] = line ^ sprite_row
+
+        self.v[idx, 0xF] = collision != 0
+        self.draw_flag[idx] = True
+
+    def skip_if_pressed_ex9e(self, idx, op) -> NoReturn:
+        self._skip(idx, self._held(idx, op))
+
+    def skip_if_not_pressed_exa1(self, idx, op) -> NoReturn:
+        self._skip(idx, ~self._held(idx, op))
+
+    def save_delay_fx07(self, idx, op) -> NoReturn:
+        self.v[idx, op >> 8 & 0xF] = self.delay_reg[idx]
+
+    def wait_for_keypress_fx0a(self, idx, op) -> NoReturn:
+        keys = self.keys[idx]
+        pressed = keys != 0
+        self.halt_execution[idx] = ~pressed
+        # the lowest key when several are held, its bit is an exact power of two
+        lowest = np.frexp(keys[pressed] & -keys[pressed])[1] - 1
+        self.v[idx[pressed], op[pressed] >> 8 & 0xF] = lowest
+
+    def set_delay_fx15(self, idx, op) -> NoReturn:
+        self.delay_reg[idx] = self.v[idx, op >> 8 & 0xF]
+
+    def set_sound_fx18(self, idx, op) -> NoReturn:
+        self.sound_reg[idx] = self.v[idx, op >> 8 & 0xF]
+
+    def add_index_fx1e(self, idx, op) -> NoReturn:
+        self.index_reg[idx] = (self.index_reg[idx] + self.v[idx, op >> 8 & 0xF]) & 0xFFFF
+
+    def set_sprite_loc_fx29(self, idx, op) -> NoReturn:
+        self.index_reg[idx] = self.v[idx, op >> 8 & 0xF].astype(np.int32) * 5
+
+    def bcd_repr_fx33(self, idx, op) -> NoReturn:
+        idx, op = self._in_memory(idx, op, 3)
+        value = self.v[idx, op >> 8 & 0xF]
+        index = self.index_reg[idx]
+        self.memory[idx, index] = value // 100
+        self.memory[idx, index + 1] = (value // 10) % 10
+        self.memory[idx, index + 2] = value % 10
+
+    def store_regs_fx55(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        idx, x = self._in_memory(idx, x, x + 1)
+        index = self.index_reg[idx]
+        for reg in range(int(x.max(initial=-1)) + 1):
+            stored = reg <= x
+            self.memory[idx[stored], index[stored] + reg] = self.v[idx[stored], reg]
+
+        self.index_reg[idx] += x + 1
+
+    def read_regs_fx65(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        idx, x = self._in_memory(idx, x, x + 1)
+        index = self.index_reg[idx]
+        for reg in range(int(x.max(initial=-1)) + 1):
+            read = reg <= x
+            self.v[idx[read], reg] = self.memory[idx[read], index[read] + reg]
+
+        self.index_reg[idx] += x + 1
+
+    def store_regs_fx55_keep_index(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        idx, x = self._in_memory(idx, x, x + 1)
+        index = self.index_reg[idx]
+        for reg in range(int(x.max(initial=-1)) + 1):
+            stored = reg <= x
+            self.memory[idx[stored], index[stored] + reg] = self.v[idx[stored], reg]
+
+    def read_regs_fx65_keep_index(self, idx, op) -> NoReturn:
+        x = op >> 8 & 0xF
+        idx, x = self._in_memory(idx, x, x + 1)
+        index = self.index_reg[idx]
+        for reg in range(int(x.max(initial=-1)) + 1):
+            read = reg <= x
+            self.v[idx[read], reg] = self.memory[idx[read], index[read] + reg]
+
+    def _in_memory(self, idx, values, size):
+        """
+        Fault the machines whose I based access leaves memory
+        :return: The machines and values still running
+        """
+        inside = self.index_reg[idx] + size <= SYSTEM_MEMORY
+        self.fault[idx[~inside]] = True
+        return idx[inside], values[inside]
@@ -0,0 +1,266 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Text
+)
+
+from chip8 import Chip8, MIN_PROGRAM_ADDR
+from decoder import InstructionDecoder
+from runner import ENGINES
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME
+
+# handler families as programs looping over the same kind of instructions
+MICRO_PROGRAMS = {
+    'alu_8xy': [0x6105, 0x6203, 0x8124, 0x8125, 0x8126, 0x812E, 0x8127, 0x8121, 0x8122, 0x8123],
+    'draw_dxyn': [0x600A, 0x610A, 0xA000, 0xD015, 0xD015, 0xD01F, 0xD01F],
+    'store_load_fx55_fx65': [0xA400, 0xF755, 0xA400, 0xF765, 0xA400, 0xFF55, 0xA400, 0xFF65],
+    'skips': [0x6001, 0x6102, 0x3001, 0x0000, 0x4002, 0x0000, 0x5010, 0x0000, 0x9010, 0x0000],
+}
+
+MACRO_ROMS = [
+    'Space Invaders [David Winter].ch8',
+    'Tetris [Fran Dachille, 1991].ch8',
+    'Blinky [Hans Christian Egeberg, 1991].ch8',
+    'Sierpinski [Sergey Naydenov, 2010].ch8',
+    'Particle Demo [zeroZshadow, 2008].ch8',
+]
+
+# short lived processes, {program} is the hex of a looping micro program
+STARTUP_SCRIPTS = {
+    # the interpreter alone, included in every other one
+    'python': 'pass',
+    'import_core': 'import chip8',
+    'headless_run': 'from chip8 import Chip8\n'
+                    'chip8 = Chip8()\n'
+                    'chip8.initialize()\n'
+                    'chip8.load_rom(bytes.fromhex({program!r}))\n'
+                    'chip8.run(10000)',
+    'headless_translator': 'from chip8 import Chip8\n'
+                           'from translator import BlockTranslator\n'
+                           'chip8 = Chip8()\n'
+                           'chip8.initialize()\n'
+                           'chip8.load_rom(bytes.fromhex({program!r}))\n'
+                           'BlockTranslator(chip8).run(10000)',
+    'import_frontend': 'import pygamechip8',
+}
+# optional module a startup script needs, it is skipped when the module is not installed
+STARTUP_REQUIRES = {
+    'import_frontend': 'pygame',
+}
+
+Result = Dict[Text, float]
+
+
+def _timed(func: Callable[[], int], repeat: int) -> float:
+    """
+    :return: Best operations per second of func, which returns its operations count
+    """
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operations = func()
+        elapsed = time.perf_counter() - start
+        best = max(best, operations / elapsed)
+    return best
+
+
+def _allocations(func: Callable[[], int]) -> Result:
+    """
+    CPython has no cumulative allocation counter, so report the peak traced
+    memory and the blocks still allocated afterwards, both per operation
+    """
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    operations = func()
+    retained = sys.getallocatedblocks() - blocks
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'peak_alloc_bytes_per_op': peak / operations, 'retained_blocks_per_op': retained / operations}
+
+
+def _machine(program: bytes) -> Chip8:
+    chip8 = Chip8()
+    chip8.initialize()
+    chip8.load_rom(program)
+    return chip8
+
+
+def _program(opcodes: List[int]) -> bytes:
+    loop = opcodes + [0x1000 | MIN_PROGRAM_ADDR]
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in loop)
+
+
+def bench_micro(cycles: int, repeat: int) -> Dict[Text, Result]:
+    results = {}
+    for family, opcodes in MICRO_PROGRAMS.items():
+        for engine_name, engine_factory in ENGINES.items():
+            engine = engine_factory(_machine(_program(opcodes)))
+            result = {'ips': _timed(lambda: engine.run(cycles), repeat)}
+            result.update(_allocations(lambda: engine.run(cycles)))
+            results[f'micro/{family}/{engine_name}'] = result
+
+    return results
+
+
+def bench_decoder(repeat: int) -> Dict[Text, Result]:
+    chip8 = Chip8()
+    InstructionDecoder.decode_table()
+
+    def decode_all() -> int:
+        for opcode in range(0x10000):
+            InstructionDecoder.decode_from(chip8, opcode)
+        return 0x10000
+
+    result = {'ops': _timed(decode_all, repeat)}
+    result.update(_allocations(decode_all))
+    return {'micro/decode_from': result}
+
+
+def bench_startup(repeat: int) -> Dict[Text, Result]:
+    """
+    Wall time of fresh processes importing and running the emulator, as launched by
+    CI jobs and worker pools
+    """
+    program = _program(MICRO_PROGRAMS['alu_8xy']).hex()
+    results = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        required = STARTUP_REQUIRES.get(name)
+        if required is not None and importlib.util.find_spec(required) is None:
+            continue
+        command = [sys.executable, '-c', script.format(program=program)]
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run(command, cwd=Path(__file__).parent, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, text=True)
+            elapsed = time.perf_counter() - start
+            if completed.returncode:
+                raise RuntimeError(f"Startup script {name} failed: {completed.stderr.strip()}")
+            best = elapsed if best is None else min(best, elapsed)
+        results[f'startup/{name}'] = {'ops': 1 / best, 'ms': best * 1000}
+
+    return results
+
+
+def bench_draw(frames: int, repeat: int) -> Dict[Text, Result]:
+    """
+    The work PyGameChip8.__draw does, full frames and single sprites
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame as pg
+        from renderer import DirtyRectRenderer
+    except ImportError:
+        return {}
+
+    pg.display.init()
+    screen = pg.display.set_mode((64 * 11 - 1, 32 * 11 - 1))
+    chip8 = _machine(_program(MICRO_PROGRAMS['draw_dxyn']))
+    renderer = DirtyRectRenderer(screen, 64, 32, 10, 1)
+
+    def full_frames() -> int:
+        for _ in range(frames):
+            chip8.clear_display_00e0()
+            renderer.render(chip8)
+        return frames
+
+    def sprite_frames() -> int:
+        for _ in range(frames):
+            chip8.run(7)
+            renderer.render(chip8)
+        return frames
+
+    results = {'micro/draw/full': {'fps': _timed(full_frames, repeat)},
+               'micro/draw/sprite': {'fps': _timed(sprite_frames, repeat)}}
+    pg.display.quit()
+    return results
+
+
+def bench_macro(roms_dir: Path, frames: int, cycles_per_frame: int, repeat: int) -> Dict[Text, Result]:
+    results = {}
+    for rom in MACRO_ROMS:
+        rom_path = roms_dir / rom
+        if not rom_path.exists():
+            continue
+        for engine_name, engine_factory in ENGINES.items():
+            # the same machine keeps running across repeats, so the first one warms the engine up
+            chip8 = _machine(rom_path.read_bytes())
+            scheduler = FrameScheduler(chip8, engine_factory(chip8), cycles_per_frame)
+
+            def run_frames() -> int:
+                scheduler.run_frames(frames)
+                return frames
+
+            fps = _timed(run_frames, repeat)
+            results[f'macro/{rom_path.stem}/{engine_name}'] = {'fps': fps, 'ips': fps * cycles_per_frame}
+
+    return results
+
+
+def compare(results: Dict[Text, Result], baseline: Dict[Text, Result], threshold: float) -> List[Text]:
+    """
+    :return: Description of every throughput drop larger than threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        for metric in ('ips', 'fps', 'ops'):
+            old = baseline.get(name, {}).get(metric)
+            new = result.get(metric)
+            if old and new is not None and new < old * (1 - threshold):
+                regressions.append(f'{name} {metric}: {old:,.0f} -> {new:,.0f} ({new / old - 1:+.1%})')
+    return regressions
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Chip8 throughput benchmarks')
+    parser.add_argument('--cycles', type=int, default=100_000, help='cycles per micro benchmark run')
+    parser.add_argument('--frames', type=int, default=600, help='frames per macro benchmark run')
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one is kept')
+    parser.add_argument('--roms-dir', default='ROMs')
+    parser.add_argument('--output', '-o', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help='previous results to flag regressions against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative drop counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    results.update(bench_micro(args.cycles, args.repeat))
+    results.update(bench_decoder(args.repeat))
+    results.update(bench_startup(args.repeat))
+    results.update(bench_draw(args.frames, args.repeat))
+    results.update(bench_macro(Path(args.roms_dir), args.frames, args.cycles_per_frame, args.repeat))
+
+    for name, result in results.items():
+        print(f'{name:60}', '  '.join(f'{metric}={value:,.2f}' for metric, value in result.items()))
+
+    report = {
+        'meta': {'time': time.time(), 'python': platform.python_version(), 'platform': platform.platform()},
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,22 @@
-from pathlib import Path
-from random import randint
+from array import array
+from random import Random
 from typing import (
+    TYPE_CHECKING,
+    Callable,
     List,
     Dict,
+    NamedTuple,
+    Optional,
     Text,
+    Tuple,
     NoReturn
 )
 
-from decoder import InstructionDecoder
+from decoder import InstructionDecoder, OPCODE_COUNT, disassemble
+
+if TYPE_CHECKING:
+    # pathlib costs more to import than the whole emulator, callers passing paths have it loaded
+    from pathlib import Path
 
 SYSTEM_MEMORY = 4096
 MIN_PROGRAM_ADDR = 0x200
@@ -19,6 +28,15 @@ STACK_DEPTH = 16
 SCREEN_WIDTH = 64
 SCREEN_HEIGHT = 32
 KEYPAD_SIZE = 16
+# each framebuffer row is an int bitmask, leftmost pixel in the highest bit
+BLANK_FRAME = [0] * SCREEN_HEIGHT
+ALL_ROWS = (1 << SCREEN_HEIGHT) - 1
+ALL_COLS = (1 << SCREEN_WIDTH) - 1
+# SUPER-CHIP extended screen mode
+HIRES_WIDTH = 128
+HIRES_HEIGHT = 64
+# SUPER-CHIP user flags saved by FX75 and restored by FX85
+RPL_FLAGS = 16
 
 KEY_1 = '1'
 KEY_2 = '2'
@@ -38,90 +56,435 @@ KEY_E = 'E'
 KEY_F = 'F'
 
 
+FONT_SET = bytes([0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0
+                  0x20, 0x60, 0x20, 0x20, 0x70,  # 1
+                  0xF0, 0x10, 0xF0, 0x80, 0xF0,  # 2
+                  0xF0, 0x10, 0xF0, 0x10, 0xF0,  # 3
+                  0x90, 0x90, 0xF0, 0x10, 0x10,  # 4
+                  0xF0, 0x80, 0xF0, 0x10, 0xF0,  # 5
+                  0xF0, 0x80, 0xF0, 0x90, 0xF0,  # 6
+                  0xF0, 0x10, 0x20, 0x40, 0x40,  # 7
+                  0xF0, 0x90, 0xF0, 0x90, 0xF0,  # 8
+                  0xF0, 0x90, 0xF0, 0x10, 0xF0,  # 9
+                  0xF0, 0x90, 0xF0, 0x90, 0x90,  # A
+                  0xE0, 0x90, 0xE0, 0x90, 0xE0,  # B
+                  0xF0, 0x80, 0x80, 0x80, 0xF0,  # C
+                  0xE0, 0x90, 0x90, 0x90, 0xE0,  # D
+                  0xF0, 0x80, 0xF0, 0x80, 0xF0,  # E
+                  0xF0, 0x80, 0xF0, 0x80, 0x80])  # F
+
+# SUPER-CHIP 8x10 digits, stored right after FONT_SET
+LARGE_FONT_SET = bytes([0xFF, 0xFF, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF,  # 0
+                        0x18, 0x78, 0x78, 0x18, 0x18, 0x18, 0x18, 0x18, 0xFF, 0xFF,  # 1
+                        0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # 2
+                        0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 3
+                        0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0x03, 0x03,  # 4
+                        0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 5
+                        0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 6
+                        0xFF, 0xFF, 0x03, 0x03, 0x06, 0x0C, 0x18, 0x18, 0x18, 0x18,  # 7
+                        0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 8
+                        0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 9
+                        0x7E, 0xFF, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3,  # A
+                        0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC,  # B
+                        0x3C, 0xFF, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0xFF, 0x3C,  # C
+                        0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC,  # D
+                        0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # E
+                        0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0])  # F
+LARGE_FONT_ADDR = len(FONT_SET)
+
+KEYPAD = {
+    KEY_1: 0x1, KEY_2: 0x2, KEY_3: 0x3, KEY_C: 0xC,
+    KEY_4: 0x4, KEY_5: 0x5, KEY_6: 0x6, KEY_D: 0xD,
+    KEY_7: 0x7, KEY_8: 0x8, KEY_9: 0x9, KEY_E: 0xE,
+    KEY_A: 0xA, KEY_0: 0x0, KEY_B: 0xB, KEY_F: 0xF
+}
+# bit of each key in the keypad state, bit n is held when key n is
+KEY_BITS = {name: 1 << value for name, value in KEYPAD.items()}
+KEY_NAMES = {value: name for name, value in KEYPAD.items()}
+
+
+def key_mask(keys: Text) -> int:
+    """
+    :param keys: Names of the held keys, '' when none is
+    :return: Keypad state with those keys held
+    """
+    mask = 0
+    for key in keys:
+        mask |= KEY_BITS[key]
+    return mask
+
+
+def key_names(mask: int) -> Text:
+    """
+    :return: Names of the keys held in a keypad state, inverse of key_mask
+    """
+    return ''.join(KEY_NAMES[value] for value in range(KEYPAD_SIZE) if mask >> value & 1)
+
+
+class QuirkProfile(NamedTuple):
+    """
+    Behaviours that differ between interpreters. A profile swaps the handlers of
+    the affected opcodes when its dispatch table is built, so they cost nothing
+    per instruction.
+    """
+    name: Text
+    # 8XY6 / 8XYE shift VX in place instead of storing VY shifted into VX
+    shift_vx: bool = False
+    # FX55 / FX65 leave I past the last register
+    load_store_increment: bool = True
+    # BXNN jumps to XNN + VX instead of BNNN jumping to NNN + V0
+    jump_vx: bool = False
+    # sprites wrap around the screen edges instead of being clipped
+    wrap_sprites: bool = False
+    # where roms are loaded and execution starts
+    load_address: int = MIN_PROGRAM_ADDR
+
+    def handlers(self) -> Dict[Text, Text]:
+        """
+        :return: Replacement of each default handler under this profile
+        """
+        handlers = {}
+        if self.shift_vx:
+            handlers.update(shr_reg_8xy6='shr_reg_8xy6_vx', shl_reg_8xye='shl_reg_8xye_vx')
+        if not self.load_store_increment:
+            handlers.update(store_regs_fx55='store_regs_fx55_keep_index', read_regs_fx65='read_regs_fx65_keep_index')
+        if self.jump_vx:
+            handlers.update(jump_value_offset_bnnn='jump_value_offset_bxnn')
+        if self.wrap_sprites:
+            handlers.update(display_sprite_dxyn='display_sprite_dxyn_wrap')
+        return handlers
+
+
+CHIP8 = QuirkProfile('chip8')
+SCHIP = QuirkProfile('schip', shift_vx=True, load_store_increment=False, jump_vx=True)
+XOCHIP = QuirkProfile('xochip', wrap_sprites=True)
+ETI660 = QuirkProfile('eti660', load_address=MIN_PROGRAM_ADDR_ETI)
+PROFILES = {profile.name: profile for profile in (CHIP8, SCHIP, XOCHIP, ETI660)}
+
+# roms.json quirk -> (profile field, field value when the quirk is on)
+ROM_QUIRKS = {
+    'shift': ('shift_vx', True),
+    'loadStore': ('load_store_increment', False),
+    'jump': ('jump_vx', True),
+    'wrap': ('wrap_sprites', True),
+}
+
+
+def profile_for(quirks: Dict[Text, bool], base: QuirkProfile = CHIP8) -> QuirkProfile:
+    """
+    Profile of a rom from its roms.json quirks
+    :param quirks: Quirk name -> whether the rom needs it
+    :param base: Profile the quirks apply to
+    """
+    changes = {}
+    applied = []
+    for quirk, enabled in sorted(quirks.items()):
+        if quirk not in ROM_QUIRKS:
+            continue
+        field, value = ROM_QUIRKS[quirk]
+        value = value if enabled else not value
+        if getattr(base, field) != value:
+            changes[field] = value
+            applied.append(quirk if enabled else f'no-{quirk}')
+    if not changes:
+        return base
+    name = '+'.join([base.name] + applied)
+    return base._replace(name=name, **changes)
+
+
+# called with (pc, opcode) before each instruction executes
+TraceHook = Callable[[int, int], None]
+
+
+def print_trace(pc: int, opcode: int) -> NoReturn:
+    print(hex(pc), hex(opcode), disassemble(opcode))
+
+
 class Chip8:
-    def __init__(self):
-        self.memory: List[int] = [0] * SYSTEM_MEMORY
+    # (unbound handler, operands) for every opcode per quirk profile, shared by all instances
+    _dispatch_tables: Dict[QuirkProfile, List[Tuple[Callable, Tuple[int, ...]]]] = {}
+
+    @classmethod
+    def dispatch_table(cls, quirks: QuirkProfile = CHIP8) -> List[Tuple[Callable, Tuple[int, ...]]]:
+        """
+        Handlers of every opcode under a profile, created once per profile on first use.
+        Entries start out as _decode_miss and are resolved the first time their opcode
+        executes, so a machine starts without decoding all the 65536 opcodes.
+        """
+        table = cls._dispatch_tables.get(quirks)
+        if table is None:
+            table = cls._dispatch_tables[quirks] = [(cls._decode_miss, ())] * OPCODE_COUNT
+        return table
+
+    __slots__ = ('memory', 'pc', 'v', 'index_reg', 'delay_reg', 'sound_reg', 'stack', 'sp', 'gfx',
+                 'dirty_rows', 'dirty_cols', 'keys', 'draw_flag', 'halt_execution', 'rng', 'trace',
+                 'quirks', 'screen_width', 'screen_height', 'rpl', '_dispatch')
+
+    def __init__(self, seed: Optional[int] = None, quirks: QuirkProfile = CHIP8):
+        """
+        :param seed: Seed of the machine random generator, for reproducible runs
+        :param quirks: Interpreter behaviours to emulate
+        """
+        self.memory: bytearray = bytearray(SYSTEM_MEMORY)
         self.pc: int = 0
-        self.v: List[int] = [0] * REGISTERS_COUNT
+        self.v: bytearray = bytearray(REGISTERS_COUNT)
         self.index_reg: int = 0
         self.delay_reg: int = 0
         self.sound_reg: int = 0
-        self.stack: List[int] = [0] * STACK_DEPTH
-        self.gfx: List[List[int]] = [[0 for _ in range(SCREEN_WIDTH)] for _ in range(SCREEN_HEIGHT)]
-        self.keypad: Dict[Text, int] = {}
-        self.key_pressed: Text = ''
-        self.font_set: List[int] = [0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0
-                                    0x20, 0x60, 0x20, 0x20, 0x70,  # 1
-                                    0xF0, 0x10, 0xF0, 0x80, 0xF0,  # 2
-                                    0xF0, 0x10, 0xF0, 0x10, 0xF0,  # 3
-                                    0x90, 0x90, 0xF0, 0x10, 0x10,  # 4
-                                    0xF0, 0x80, 0xF0, 0x10, 0xF0,  # 5
-                                    0xF0, 0x80, 0xF0, 0x90, 0xF0,  # 6
-                                    0xF0, 0x10, 0x20, 0x40, 0x40,  # 7
-                                    0xF0, 0x90, 0xF0, 0x90, 0xF0,  # 8
-                                    0xF0, 0x90, 0xF0, 0x10, 0xF0,  # 9
-                                    0xF0, 0x90, 0xF0, 0x90, 0x90,  # A
-                                    0xE0, 0x90, 0xE0, 0x90, 0xE0,  # B
-                                    0xF0, 0x80, 0x80, 0x80, 0xF0,  # C
-                                    0xE0, 0x90, 0x90, 0x90, 0xE0,  # D
-                                    0xF0, 0x80, 0xF0, 0x80, 0xF0,  # E
-                                    0xF0, 0x80, 0xF0, 0x80, 0x80]  # F
+        self.stack: array = array('H', bytes(2 * STACK_DEPTH))
+        self.sp: int = 0
+        self.gfx: List[int] = BLANK_FRAME.copy()
+        # current resolution, switched by the SUPER-CHIP 00FE / 00FF
+        self.screen_width: int = SCREEN_WIDTH
+        self.screen_height: int = SCREEN_HEIGHT
+        self.rpl: bytearray = bytearray(RPL_FLAGS)
+        # bitmasks of the rows and columns changed since the front end last drew
+        self.dirty_rows: int = ALL_ROWS
+        self.dirty_cols: int = ALL_COLS
+        # keypad state, bit n set while key n is held
+        self.keys: int = 0
         self.draw_flag: bool = False
         self.halt_execution: bool = False
+        self.rng: Random = Random(seed)
+        self.trace: Optional[TraceHook] = None
+        self.quirks: QuirkProfile = quirks
+        self._dispatch = self.dispatch_table(quirks)
+
+    def set_quirks(self, quirks: QuirkProfile) -> NoReturn:
+        """
+        Switch profile, before loading the rom so its load address applies
+        """
+        self.quirks = quirks
+        self._dispatch = self.dispatch_table(quirks)
 
     def initialize(self) -> NoReturn:
         """
         Initialize registers and memory
         """
-        self.pc = MIN_PROGRAM_ADDR
-
-        for i, font_byte in enumerate(self.font_set, 0):
-            self.memory[i] = font_byte
-
-        self.keypad = {
-            KEY_1: 0x1, KEY_2: 0x2, KEY_3: 0x3, KEY_C: 0xC,
-            KEY_4: 0x4, KEY_5: 0x5, KEY_6: 0x6, KEY_D: 0xD,
-            KEY_7: 0x7, KEY_8: 0x8, KEY_9: 0x9, KEY_E: 0xE,
-            KEY_A: 0xA, KEY_0: 0x0, KEY_B: 0xB, KEY_F: 0xF
-        }
+        self.pc = self.quirks.load_address
+        self.memory[:len(FONT_SET)] = FONT_SET
+        self.memory[LARGE_FONT_ADDR: LARGE_FONT_ADDR + len(LARGE_FONT_SET)] = LARGE_FONT_SET
 
-    def load_game(self, game_path: Path) -> NoReturn:
+    def load_game(self, game_path: 'Path') -> NoReturn:
         """
         Load a game into memory
         :param game_path: Game to load
         """
-        game_size = 0
-        with game_path.open(mode='rb') as game_file:
-            for i, byte in enumerate(game_file.read(), 0):
-                self.memory[MIN_PROGRAM_ADDR + i] = byte
-                game_size += 1
+        game_size = self.load_rom(game_path.read_bytes())
 
         print(f"Game size is {game_size} bytes")
 
+    def load_rom(self, rom: bytes) -> int:
+        """
+        Copy a rom image into memory, without any output
+        :param rom: Any bytes-like object
+        :return: Rom size in bytes
+        """
+        rom_size = len(rom)
+        load_address = self.quirks.load_address
+        if rom_size > SYSTEM_MEMORY - load_address:
+            raise ValueError(f"Game size {rom_size} bytes does not fit in memory")
+
+        self.memory[load_address: load_address + rom_size] = rom
+        return rom_size
+
+    def resolve(self, opcode: int) -> Tuple[Callable, Tuple[int, ...]]:
+        """
+        :return: Unbound handler of an opcode under the machine quirk profile and its operands
+        """
+        name, args = InstructionDecoder.decode(opcode)
+        return getattr(type(self), self.quirks.handlers().get(name, name)), args
+
+    def _decode_miss(self) -> NoReturn:
+        """
+        Resolve the opcode at pc into the dispatch table, then execute it
+        """
+        opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
+        handler, args = self._dispatch[opcode] = self.resolve(opcode)
+        handler(self, *args)
+
     def emulate_cycle(self) -> NoReturn:
         # fetch
         opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
         # decode
-        instruction = InstructionDecoder.decode_from(self, opcode)
+        handler, args = self._dispatch[opcode]
         # execute
-        print(hex(opcode), instruction.assembly)
-        instruction.run()
+        if self.trace is not None:
+            self.trace(self.pc, opcode)
+        handler(self, *args)
         # update program counter
         if not self.halt_execution and self.pc + 2 < SYSTEM_MEMORY:
             self.pc += 2
 
-    def key_press(self, key: Text) -> NoReturn:
-        self.key_pressed = key
+    def run(self, cycles: int) -> int:
+        """
+        Execute a batch of cycles without any I/O
+        :param cycles: Number of instructions to execute
+        :return: Number of instructions executed
+        """
+        if self.trace is not None:
+            for _ in range(cycles):
+                self.emulate_cycle()
+            return cycles
+
+        memory = self.memory
+        dispatch = self._dispatch
+        for _ in range(cycles):
+            pc = self.pc
+            handler, args = dispatch[memory[pc] << 8 | memory[pc + 1]]
+            handler(self, *args)
+            if not self.halt_execution and self.pc + 2 < SYSTEM_MEMORY:
+                self.pc += 2
+
+        return cycles
+
+    def run_until(self, predicate: Callable[['Chip8'], bool], max_cycles: Optional[int] = None) -> int:
+        """
+        Execute cycles until predicate(chip8) is true
+        :param predicate: Checked before every instruction
+        :param max_cycles: Optional upper bound of instructions to execute
+        :return: Number of instructions executed
+        """
+        cycles = 0
+        while (max_cycles is None or cycles < max_cycles) and not predicate(self):
+            self.emulate_cycle()
+            cycles += 1
+
+        return cycles
+
+    def idle_loop(self) -> Tuple[int, int]:
+        """
+        Recognize the loops a rom spins in while waiting: a key wait, a jump to itself,
+        the SUPER-CHIP exit, or a delay timer poll (FX07, 3Xkk or 4Xkk, jump back to the FX07)
+        :return: (cycles until the loop head, cycles per loop), (0, 0) when not idle
+        """
+        if self.halt_execution:
+            return (0, 1) if not self.keys else (0, 0)
+
+        memory = self.memory
+        pc = self.pc
+        if pc + 1 >= SYSTEM_MEMORY:
+            return 0, 0
+        opcode = memory[pc] << 8 | memory[pc + 1]
+        if opcode == 0x1000 | pc or opcode == 0x00FD:
+            return 0, 1
+
+        for offset in (0, 2, 4):
+            head = pc - offset
+            if self._timer_poll(head) is not None:
+                return (3 - offset // 2) % 3, 3
+
+        return 0, 0
+
+    def skip_idle(self, cycles: int) -> int:
+        """
+        Fast-forward through the whole idle loops fitting in cycles, leaving the
+        machine as running them one by one would. Nothing but the timers and the
+        keypad can end such a loop, and neither changes before the next frame.
+        :param cycles: Cycles left in the frame
+        :return: Number of cycles skipped
+        """
+        to_head, length = self.idle_loop()
+        if not length or to_head:
+            return 0
+        if length == 1:
+            return cycles
+
+        x, loops_while_equal, byte = self._timer_poll(self.pc)
+        if (self.delay_reg == byte) != loops_while_equal:
+            return 0
+        skipped = cycles - cycles % length
+        if skipped:
+            self.v[x] = self.delay_reg
+        return skipped
+
+    def _timer_poll(self, head: int) -> Optional[Tuple[int, bool, int]]:
+        """
+        :return: (x, loops while Vx == byte, byte) when a timer poll loop starts at head
+        """
+        if head < 0 or head + 5 >= SYSTEM_MEMORY:
+            return None
+
+        memory = self.memory
+        load = memory[head] << 8 | memory[head + 1]
+        skip = memory[head + 2] << 8 | memory[head + 3]
+        jump = memory[head + 4] << 8 | memory[head + 5]
+        x = (load & 0x0F00) >> 8
+        if load & 0xF0FF != 0xF007 or jump != 0x1000 | head or skip & 0x0F00 != load & 0x0F00:
+            return None
+        if skip & 0xF000 == 0x3000:
+            return x, False, skip & 0xFF
+        if skip & 0xF000 == 0x4000:
+            return x, True, skip & 0xFF
+        return None
+
+    def tick_timers(self) -> NoReturn:
+        """
+        Decrement the delay and sound timers, called once per 60 Hz frame
+        """
+        if self.delay_reg > 0:
+            self.delay_reg -= 1
+        if self.sound_reg > 0:
+            self.sound_reg -= 1
+
+    def memory_view(self) -> memoryview:
+        return memoryview(self.memory)
+
+    def registers_view(self) -> memoryview:
+        return memoryview(self.v)
+
+    def stack_view(self) -> memoryview:
+        return memoryview(self.stack)[:self.sp]
+
+    def frame_bytes(self) -> bytes:
+        """
+        Framebuffer packed one bit per pixel, row by row
+        """
+        row_size = self.screen_width // 8
+        return b''.join(row.to_bytes(row_size, 'big') for row in self.gfx)
+
+    def pixel(self, col: int, row: int) -> int:
+        return self.gfx[row] >> (self.screen_width - 1 - col) & 1
+
+    def set_resolution(self, width: int, height: int) -> NoReturn:
+        """
+        Switch the framebuffer to another resolution, clearing it
+        """
+        self.screen_width = width
+        self.screen_height = height
+        self.gfx[:] = [0] * height
+        self.dirty_rows = (1 << height) - 1
+        self.dirty_cols = (1 << width) - 1
+        self.draw_flag = True
+
+    def key_down(self, key: Text) -> NoReturn:
+        self.keys |= KEY_BITS[key]
+
+    def key_up(self, key: Text) -> NoReturn:
+        self.keys &= ~KEY_BITS[key]
+
+    def set_keys(self, mask: int) -> NoReturn:
+        """
+        :param mask: Keypad state, bit n set to hold key n
+        """
+        self.keys = mask & 0xFFFF
+
+    def key_press(self, keys: Text) -> NoReturn:
+        """
+        Hold exactly the given keys, releasing the others
+        :param keys: Names of the keys to hold, '' to release them all
+        """
+        self.keys = key_mask(keys)
 
     def dump_memory(self) -> NoReturn:
-        memory_pointer = MIN_PROGRAM_ADDR
+        """
+        Print the code reachable from the program start, data is left out
+        """
+        from disassembler import disassemble_rom
 
-        while memory_pointer < SYSTEM_MEMORY - 1:
-            opcode = self.memory[memory_pointer] << 8 | self.memory[memory_pointer + 1]
-            instruction = InstructionDecoder.decode_from(self, opcode)
-            if instruction.assembly != 'NOP':
-                print(hex(memory_pointer), instruction)
-            memory_pointer += 2
+        load_address = self.quirks.load_address
+        disassembly = disassemble_rom(bytes(self.memory[load_address:]), load_address)
+        print('\n'.join(disassembly.listing()))
 
     # INSTRUCTIONS EXECUTION
     # x, y, addr, byte : int
@@ -130,19 +493,52 @@ class Chip8:
         pass
 
     def clear_display_00e0(self) -> NoReturn:
-        for row in range(len(self.gfx)):
-            for pixel in range(len(self.gfx[0])):
-                self.gfx[row][pixel] = 0
+        self.gfx[:] = [0] * self.screen_height
+        self.dirty_rows = (1 << self.screen_height) - 1
+        self.dirty_cols = (1 << self.screen_width) - 1
+        self.draw_flag = True
+
+    def scroll_down_00cn(self, nibble) -> NoReturn:
+        height = self.screen_height
+        nibble = min(nibble, height)
+        self.gfx[:] = [0] * nibble + self.gfx[:height - nibble]
+        self.dirty_rows = (1 << height) - 1
+        self.dirty_cols = (1 << self.screen_width) - 1
+        self.draw_flag = True
+
+    def scroll_right_00fb(self) -> NoReturn:
+        self.gfx[:] = [row >> 4 for row in self.gfx]
+        self.dirty_rows = (1 << self.screen_height) - 1
+        self.dirty_cols = (1 << self.screen_width) - 1
+        self.draw_flag = True
+
+    def scroll_left_00fc(self) -> NoReturn:
+        all_cols = (1 << self.screen_width) - 1
+        self.gfx[:] = [(row << 4) & all_cols for row in self.gfx]
+        self.dirty_rows = (1 << self.screen_height) - 1
+        self.dirty_cols = all_cols
         self.draw_flag = True
 
+    def exit_00fd(self) -> NoReturn:
+        # stay on the exit instruction, like halting the interpreter
+        self.pc -= 2
+
+    def low_res_00fe(self) -> NoReturn:
+        self.set_resolution(SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def high_res_00ff(self) -> NoReturn:
+        self.set_resolution(HIRES_WIDTH, HIRES_HEIGHT)
+
     def return_subroutine_00ee(self) -> NoReturn:
-        self.pc = self.stack.pop()
+        self.sp = (self.sp - 1) & (STACK_DEPTH - 1)
+        self.pc = self.stack[self.sp]
 
     def jump_to_1nnn(self, addr):
         self.pc = addr - 2
 
     def call_subroutine_2nnn(self, addr) -> NoReturn:
-        self.stack.append(self.pc)
+        self.stack[self.sp] = self.pc
+        self.sp = (self.sp + 1) & (STACK_DEPTH - 1)
         self.pc = addr - 2
 
     def skip_if_equal_value_3xkk(self, x, byte) -> NoReturn:
@@ -196,23 +592,31 @@ class Chip8:
         else:
             self.v[0xF] = 0x00
 
-        self.v[x] -= self.v[y]
+        self.v[x] = (self.v[x] - self.v[y]) & 0xFF
 
     def shr_reg_8xy6(self, x, y) -> NoReturn:
         self.v[0xF] = self.v[y] & 0x1
         self.v[x] = self.v[y] >> 0x1
 
+    def shr_reg_8xy6_vx(self, x, y) -> NoReturn:
+        self.v[0xF] = self.v[x] & 0x1
+        self.v[x] = self.v[x] >> 0x1
+
     def subn_reg_reg_8xy7(self, x, y) -> NoReturn:
         if self.v[y] >= self.v[x]:
             self.v[0xF] = 0x01
         else:
             self.v[0xF] = 0x00
 
-        self.v[x] = self.v[y] - self.v[x]
+        self.v[x] = (self.v[y] - self.v[x]) & 0xFF
 
     def shl_reg_8xye(self, x, y) -> NoReturn:
         self.v[0xF] = (self.v[y] >> 7) & 0x01
-        self.v[x] = self.v[y] << 1
+        self.v[x] = (self.v[y] << 1) & 0xFF
+
+    def shl_reg_8xye_vx(self, x, y) -> NoReturn:
+        self.v[0xF] = (self.v[x] >> 7) & 0x01
+        self.v[x] = (self.v[x] << 1) & 0xFF
 
     def skip_if_not_equal_reg_9xy0(self, x, y) -> NoReturn:
         if self.v[x] != self.v[y]:
@@ -224,43 +628,98 @@ class Chip8:
     def jump_value_offset_bnnn(self, addr) -> NoReturn:
         self.pc = self.v[0] + addr - 2
 
+    def jump_value_offset_bxnn(self, addr) -> NoReturn:
+        self.pc = self.v[addr >> 8] + addr - 2
+
     def set_random_and_value_cxkk(self, x, byte) -> NoReturn:
-        rnd = randint(0, 255)
+        rnd = self.rng.randint(0, 255)
         self.v[x] = rnd & byte
 
     def display_sprite_dxyn(self, x, y, nibble) -> NoReturn:
-        sprite = self.memory[self.index_reg: self.index_reg + nibble]  # array of bytes
+        gfx = self.gfx
         screen_x = self.v[x]
         screen_y = self.v[y]
+        # sprite rows overlapping the screen, the ones below the bottom edge are clipped
+        sprite_h = max(0, min(nibble, self.screen_height - screen_y))
+        sprite = self.memory[self.index_reg: self.index_reg + sprite_h]  # array of bytes
+
+        # align each sprite byte with the screen row, clipping at the right edge
+        shift = self.screen_width - 8 - screen_x
+        collision = 0
+        for row, byte in enumerate(sprite, screen_y):
+            sprite_row = byte << shift if shift >= 0 else byte >> -shift
+            # collision detection
+            collision |= gfx[row] & sprite_row
+            # XOR pixels
+            gfx[row] ^= sprite_row
+
+        if sprite:
+            self.dirty_rows |= ((1 << len(sprite)) - 1) << screen_y
+            self.dirty_cols |= 0xFF << shift if shift >= 0 else 0xFF >> -shift
+        self.v[0xF] = 1 if collision else 0
+        self.draw_flag = True
 
-        # convert sprite to plain bitmap (tuple of tuples)
-        sprite_bitmap = tuple(tuple(int(bit) for bit in format(byte, '08b')) for byte in sprite)
-        sprite_h = len(sprite)
-
-        # iterate the sprite overlapping region with the screen (8X{sprite length in bytes})
-        for row in range(sprite_h):
-            if screen_y + row < SCREEN_HEIGHT:
-                for pixel_pos, pixel in enumerate(sprite_bitmap[row], 0):
-                    if screen_x + pixel_pos < SCREEN_WIDTH:
-                        screen_pixel = self.gfx[screen_y + row][screen_x + pixel_pos]
-                        # collision detection
-                        if screen_pixel == pixel:
-                            self.v[0xF] = 1
-                        # XOR pixels
-                        self.gfx[screen_y + row][screen_x + pixel_pos] = screen_pixel ^ pixel
+    def display_sprite_dxyn_wrap(self, x, y, nibble) -> NoReturn:
+        gfx = self.gfx
+        width = self.screen_width
+        height = self.screen_height
+        all_cols = (1 << width) - 1
+        screen_x = self.v[x] % width
+        screen_y = self.v[y] % height
+        sprite = self.memory[self.index_reg: self.index_reg + nibble]
+
+        # pixels past the right edge come back on the left
+        shift = width - 8 - screen_x
+        if shift >= 0:
+            columns = 0xFF << shift
+        else:
+            columns = 0xFF >> -shift | (0xFF << (width + shift)) & all_cols
+        collision = 0
+        for offset, byte in enumerate(sprite):
+            row = (screen_y + offset) % height
+            if shift >= 0:
+                sprite_row = byte << shift
+            else:
+                sprite_row = byte >> -shift | (byte << (width + shift)) & all_cols
+            collision |= gfx[row] & sprite_row
+            gfx[row] ^= sprite_row
+            self.dirty_rows |= 1 << row
+
+        if sprite:
+            self.dirty_cols |= columns
+        self.v[0xF] = 1 if collision else 0
+        self.draw_flag = True
 
+    def display_large_sprite_dxy0(self, x, y) -> NoReturn:
+        gfx = self.gfx
+        screen_x = self.v[x]
+        screen_y = self.v[y]
+        # 16x16 sprite, two bytes per row, rows below the bottom edge are clipped
+        sprite_h = max(0, min(16, self.screen_height - screen_y))
+        sprite = self.memory[self.index_reg: self.index_reg + 2 * sprite_h]
+
+        shift = self.screen_width - 16 - screen_x
+        collision = 0
+        row = screen_y
+        for offset in range(0, len(sprite) - 1, 2):
+            word = sprite[offset] << 8 | sprite[offset + 1]
+            sprite_row = word << shift if shift >= 0 else word >> -shift
+            collision |= gfx[row] & sprite_row
+            gfx[row] ^= sprite_row
+            row += 1
+
+        if row > screen_y:
+            self.dirty_rows |= ((1 << (row - screen_y)) - 1) << screen_y
+            self.dirty_cols |= 0xFFFF << shift if shift >= 0 else 0xFFFF >> -shift
+        self.v[0xF] = 1 if collision else 0
         self.draw_flag = True
 
     def skip_if_pressed_ex9e(self, x) -> NoReturn:
-        if self.key_pressed:
-            if self.v[x] == self.keypad[self.key_pressed]:
-                self.pc += 2
+        if self.keys >> self.v[x] & 1:
+            self.pc += 2
 
     def skip_if_not_pressed_exa1(self, x) -> NoReturn:
-        if self.key_pressed:
-            if self.v[x] != self.keypad[self.key_pressed]:
-                self.pc += 2
-        else:
+        if not self.keys >> self.v[x] & 1:
             self.pc += 2
 
     def save_delay_fx07(self, x) -> NoReturn:
@@ -268,9 +727,11 @@ class Chip8:
 
     def wait_for_keypress_fx0a(self, x) -> NoReturn:
         self.halt_execution = True
-        if self.key_pressed:
+        keys = self.keys
+        if keys:
             self.halt_execution = False
-            self.v[x] = self.keypad[self.key_pressed]
+            # the lowest key when several are held
+            self.v[x] = (keys & -keys).bit_length() - 1
 
     def set_delay_fx15(self, x) -> NoReturn:
         self.delay_reg = self.v[x]
@@ -279,7 +740,7 @@ class Chip8:
         self.sound_reg = self.v[x]
 
     def add_index_fx1e(self, x) -> NoReturn:
-        self.index_reg = self.index_reg + self.v[x]
+        self.index_reg = (self.index_reg + self.v[x]) & 0xFFFF
 
     def set_sprite_loc_fx29(self, x) -> NoReturn:
         self.index_reg = self.v[x] * 5
@@ -303,4 +764,21 @@ class Chip8:
         for reg in range(x + 1):
             self.v[reg] = self.memory[self.index_reg + reg]
 
-        self.index_reg += x + 1
\ No newline at end of file
+        self.index_reg += x + 1
+
+    def store_regs_fx55_keep_index(self, x) -> NoReturn:
+        for reg in range(x + 1):
+            self.memory[self.index_reg + reg] = self.v[reg]
+
+    def read_regs_fx65_keep_index(self, x) -> NoReturn:
+        for reg in range(x + 1):
+            self.v[reg] = self.memory[self.index_reg + reg]
+
+    def set_large_sprite_loc_fx30(self, x) -> NoReturn:
+        self.index_reg = LARGE_FONT_ADDR + (self.v[x] & 0xF) * 10
+
+    def save_flags_fx75(self, x) -> NoReturn:
+        self.rpl[:x + 1] = self.v[:x + 1]
+
+    def load_flags_fx85(self, x) -> NoReturn:
+        self.v[:x + 1] = self.rpl[:x + 1]
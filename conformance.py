@@ -0,0 +1,495 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from random import Random
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Text,
+    Tuple
+)
+
+from chip8 import Chip8, QuirkProfile, key_mask
+from decoder import disassemble
+from library import RomLibrary
+from runner import ENGINES
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME
+from sinks import Frame, HashSink
+from snapshot import capture, fork, restore
+from translator import BlockTranslator
+
+GOLDEN_FILE = Path('res') / 'golden.json'
+GOLDEN_VERSION = 1
+DEFAULT_FRAMES = 600
+# recorded far above the frontends' pace, so the roms get well past their title screens
+GOLDEN_CYCLES_PER_FRAME = 500
+DEFAULT_SEED = 0
+
+# [frame, keys] events driving the test roms, holding exactly the named keys from that frame on
+TEST_INPUTS = {
+    'test_opcode.ch8': [],
+    'Delay Timer Test [Matthew Mikolay, 2010].ch8': [[60, '2'], [100, ''], [120, '8'], [130, ''], [150, '5'],
+                                                     [160, '']],
+    'Division Test [Sergey Naydenov, 2010].ch8': [],
+    'SQRT Test [Sergey Naydenov, 2010].ch8': [],
+    'Random Number Test [Matthew Mikolay, 2010].ch8': [[60, '1'], [70, ''], [120, 'A'], [130, ''], [180, 'F'],
+                                                       [190, '']],
+    'Keypad Test [Hap, 2006].ch8': [[60, '5'], [90, ''], [120, '0F'], [150, '']],
+}
+
+# state compared between machines and how its values print
+STATE_FIELDS = {
+    'pc': '03x',
+    'index_reg': '03x',
+    'delay_reg': 'd',
+    'sound_reg': 'd',
+    'sp': 'd',
+    'keys': '04x',
+    'draw_flag': 'd',
+    'halt_execution': 'd',
+    'screen_width': 'd',
+}
+# differing memory addresses listed per divergence
+MAX_LISTED = 8
+
+
+class Divergence(NamedTuple):
+    candidate: Text
+    # first cycle after which the machines differ, counted from the start of the run. Engines
+    # running whole blocks are only seen at block ends, the culprit may be earlier in the block.
+    cycle: int
+    frame: int
+    # (pc, opcode) of the last instructions the reference executed up to that cycle
+    instructions: List[Tuple[int, int]]
+    differences: List[Text]
+    expected: Text
+    actual: Text
+
+
+def registers(chip8: Chip8) -> Text:
+    """
+    Register dump in the format of the debugger regs command
+    """
+    stack = ' '.join(f'{addr:03x}' for addr in chip8.stack[:chip8.sp])
+    return (' '.join(f'V{reg:X}={value:02x}' for reg, value in enumerate(chip8.v)) + '\n'
+            + f'PC={chip8.pc:03x} I={chip8.index_reg:03x} DT={chip8.delay_reg} ST={chip8.sound_reg} '
+              f'SP={chip8.sp} stack=[{stack}]')
+
+
+def _listed(addrs: List[int]) -> Text:
+    shown = ' '.join(f'{addr:03x}' for addr in addrs[:MAX_LISTED])
+    return shown + (f' and {len(addrs) - MAX_LISTED} more' if len(addrs) > MAX_LISTED else '')
+
+
+def compare(expected: Chip8, actual: Chip8) -> List[Text]:
+    """
+    :return: One line per piece of state that differs, empty when the machines match
+    """
+    differences = []
+    for name, spec in STATE_FIELDS.items():
+        want, got = getattr(expected, name), getattr(actual, name)
+        if want != got:
+            differences.append(f'{name}: {want:{spec}} != {got:{spec}}')
+    for reg, (want, got) in enumerate(zip(expected.v, actual.v)):
+        if want != got:
+            differences.append(f'V{reg:X}: {want:02x} != {got:02x}')
+    if expected.stack != actual.stack:
+        differences.append(f'stack: {list(expected.stack)} != {list(actual.stack)}')
+    if expected.memory != actual.memory:
+        addrs = [addr for addr, (want, got) in enumerate(zip(expected.memory, actual.memory)) if want != got]
+        differences.append(f'memory at {_listed(addrs)}')
+    if expected.rpl != actual.rpl:
+        differences.append(f'rpl: {bytes(expected.rpl).hex()} != {bytes(actual.rpl).hex()}')
+    if expected.gfx != actual.gfx:
+        rows = [row for row, (want, got) in enumerate(zip(expected.gfx, actual.gfx)) if want != got]
+        differences.append(f'gfx rows {_listed(rows)}' if rows else 'gfx height')
+    return differences
+
+
+class ReferenceStopped(Exception):
+    """
+    The reference machine raised while running next to a candidate
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(f'{type(error).__name__}: {error}')
+        self.error = error
+
+
+def _step(chip8: Chip8, cycles: int) -> NoReturn:
+    """
+    Run the reference machine, telling its errors apart from the candidate's
+    """
+    try:
+        for _ in range(cycles):
+            chip8.emulate_cycle()
+    except Exception as error:
+        raise ReferenceStopped(error) from error
+
+
+class Candidate:
+    """
+    An engine or state representation checked against the reference interpreter.
+    It starts from a snapshot of the reference machine and is compared through a
+    Chip8 holding its state. This base runs the interpreter batch loop, Chip8.run.
+    """
+
+    def __init__(self, quirks: QuirkProfile):
+        self.chip8 = Chip8(quirks=quirks)
+        self.chip8.initialize()
+
+    def load(self, snapshot: bytes) -> NoReturn:
+        restore(self.chip8, snapshot)
+
+    def run(self, cycles: int) -> NoReturn:
+        self.chip8.run(cycles)
+
+    def set_keys(self, mask: int) -> NoReturn:
+        self.chip8.set_keys(mask)
+
+    def tick_timers(self) -> NoReturn:
+        self.chip8.tick_timers()
+
+    def state(self) -> Chip8:
+        return self.chip8
+
+
+class TranslatorCandidate(Candidate):
+    """
+    Compiled basic blocks
+    """
+
+    def __init__(self, quirks: QuirkProfile):
+        super().__init__(quirks)
+        self.translator = BlockTranslator(self.chip8)
+
+    def load(self, snapshot: bytes) -> NoReturn:
+        super().load(snapshot)
+        self.translator.flush()
+
+    def run(self, cycles: int) -> NoReturn:
+        self.translator.run(cycles)
+
+
+class IdleSkipCandidate(TranslatorCandidate):
+    """
+    Compiled blocks with the idle loops fast-forwarded, as the server and the pygame front end run
+    """
+
+    def __init__(self, quirks: QuirkProfile):
+        super().__init__(quirks)
+        self.scheduler = FrameScheduler(self.chip8, self.translator, skip_idle=True)
+
+    def run(self, cycles: int) -> NoReturn:
+        # the cycles of a frame without its timers tick
+        self.scheduler.run_cycles(cycles)
+
+
+class SnapshotCandidate(Candidate):
+    """
+    The interpreter, moved to a fresh machine through capture and restore before every run.
+    State the snapshots miss is lost on the way and shows up as a divergence.
+    """
+
+    def run(self, cycles: int) -> NoReturn:
+        self.chip8 = fork(self.chip8)
+        self.chip8.run(cycles)
+
+
+class _ReferenceRandom:
+    """
+    Stands in for the NumPy generator of a batch, drawing CXKK values like Chip8 does
+    """
+
+    def __init__(self, rng: Random):
+        self.rng = rng
+
+    def integers(self, low: int, high: int, size: int, dtype):
+        import numpy as np
+        return np.array([self.rng.randint(low, high - 1) for _ in range(size)], dtype=dtype)
+
+
+class BatchCandidate(Candidate):
+    """
+    A single machine of a NumPy batch. The batch draws its random numbers from the
+    reference generator, so CXKK compares too.
+    """
+
+    def __init__(self, quirks: QuirkProfile):
+        # numpy is only needed when a batch is compared
+        from batch import BatchChip8
+
+        super().__init__(quirks)
+        self._batch_type = BatchChip8
+        self.batch: Optional[BatchChip8] = None
+
+    def load(self, snapshot: bytes) -> NoReturn:
+        super().load(snapshot)
+        self.batch = self._batch_type.from_chip8(self.chip8, 1)
+        self.batch.rng = _ReferenceRandom(self.chip8.rng)
+
+    def run(self, cycles: int) -> NoReturn:
+        self.batch.run(cycles)
+        if self.batch.fault[0]:
+            raise RuntimeError("Batch machine faulted")
+
+    def set_keys(self, mask: int) -> NoReturn:
+        self.batch.keys[0] = mask
+
+    def tick_timers(self) -> NoReturn:
+        self.batch.tick_timers()
+
+    def state(self) -> Chip8:
+        return self.batch.instance(0)
+
+
+CANDIDATES = {
+    'interpreter': Candidate,
+    'translator': TranslatorCandidate,
+    'idle': IdleSkipCandidate,
+    'snapshot': SnapshotCandidate,
+    'batch': BatchCandidate,
+}
+
+
+def _replay(chip8: Chip8, candidate: Candidate, start: bytes, cycles: int) -> List[Text]:
+    """
+    Run both machines from the same snapshot
+    :return: Differences after the cycles
+    """
+    restore(chip8, start)
+    candidate.load(start)
+    _step(chip8, cycles)
+    try:
+        candidate.run(cycles)
+    except Exception as error:
+        return [f'{type(error).__name__}: {error}']
+    return compare(chip8, candidate.state())
+
+
+def lockstep(chip8: Chip8, name: Text, frames: int, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME,
+             inputs: Optional[Dict[int, Text]] = None, chunk: Optional[int] = None) -> Optional[Divergence]:
+    """
+    Run a candidate next to the reference Chip8.emulate_cycle, comparing the whole
+    state after every chunk of cycles. A chunk that diverges is replayed from its
+    start, halving it down to the shortest run that still differs.
+    :param chip8: Reference machine with the rom loaded, left at the divergence
+    :param name: Candidate name, a key of CANDIDATES
+    :param inputs: Frame -> keys held from that frame on
+    :param chunk: Cycles between comparisons, a frame by default. Blocks longer
+        than a chunk are interpreted by the translator, so small chunks test less of it.
+    :return: The first divergence, None when the candidate matched the whole run
+    :raises ReferenceStopped: When the reference machine raised, any other error comes from the candidate
+    """
+    inputs = inputs or {}
+    chunk = chunk or cycles_per_frame
+    candidate = CANDIDATES[name](chip8.quirks)
+    candidate.load(capture(chip8))
+
+    cycle = 0
+    for frame in range(frames):
+        if frame in inputs:
+            chip8.key_press(inputs[frame])
+            candidate.set_keys(key_mask(inputs[frame]))
+
+        done = 0
+        while done < cycles_per_frame:
+            cycles = min(chunk, cycles_per_frame - done)
+            start = capture(chip8)
+            _step(chip8, cycles)
+            try:
+                candidate.run(cycles)
+                differences = compare(chip8, candidate.state())
+            except Exception as error:
+                differences = [f'{type(error).__name__}: {error}']
+
+            if differences:
+                # the last cycle count still matching and the first one differing
+                matching, differing = 0, cycles
+                while differing - matching > 1:
+                    middle = (matching + differing) // 2
+                    if _replay(chip8, candidate, start, middle):
+                        differing = middle
+                    else:
+                        matching = middle
+
+                executed = []
+                chip8.trace = lambda pc, opcode: executed.append((pc, opcode))
+                try:
+                    # a translator starting over from a cold cache may take another path, keep what was seen first
+                    differences = _replay(chip8, candidate, start, differing) or differences
+                finally:
+                    chip8.trace = None
+                return Divergence(name, cycle + done + differing - 1, frame, executed[-MAX_LISTED:], differences,
+                                  registers(chip8), registers(candidate.state()))
+
+            done += cycles
+        cycle += cycles_per_frame
+        chip8.tick_timers()
+        candidate.tick_timers()
+
+    return None
+
+
+def frame_hash(chip8: Chip8, engine: Text, frames: int, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME,
+               inputs: Optional[Dict[int, Text]] = None) -> Text:
+    """
+    Run a machine headless
+    :param engine: Engine name, a key of runner.ENGINES
+    :return: Rolling hash of every frame, as HashSink computes it
+    """
+    inputs = inputs or {}
+    hashes = HashSink()
+    scheduler = FrameScheduler(chip8, ENGINES[engine](chip8), cycles_per_frame)
+    scheduler.frame_listeners.append(
+        lambda machine, index: hashes.write(Frame(index, machine.screen_width, machine.screen_height,
+                                                  machine.frame_bytes())))
+    for frame in range(frames):
+        if frame in inputs:
+            chip8.key_press(inputs[frame])
+        scheduler.run_frame()
+    return hashes.hexdigest
+
+
+def load_golden(path: Path) -> Dict:
+    golden = json.loads(path.read_text())
+    if golden.get('version') != GOLDEN_VERSION:
+        raise ValueError(f"Unsupported golden file version {golden.get('version')}")
+    return golden
+
+
+def _start(library: RomLibrary, rom: Text, seed: int) -> Chip8:
+    chip8 = Chip8(seed)
+    chip8.initialize()
+    library.load(chip8, rom)
+    return chip8
+
+
+def update_golden(library: RomLibrary, roms: List[Text], frames: int, cycles_per_frame: int,
+                  seed: int) -> Dict:
+    """
+    Record the reference results of roms, with the inputs of TEST_INPUTS
+    """
+    entries = {}
+    for rom in roms:
+        inputs = TEST_INPUTS.get(rom, [])
+        entry = dict(sha1=library.find(rom).sha1, inputs=inputs, hash=None, error=None)
+        try:
+            entry['hash'] = frame_hash(_start(library, rom, seed), 'interpreter', frames, cycles_per_frame,
+                                       dict(inputs))
+        except Exception as error:
+            entry['error'] = f'{type(error).__name__}: {error}'
+        entries[rom] = entry
+    return dict(version=GOLDEN_VERSION, frames=frames, cycles_per_frame=cycles_per_frame, seed=seed, roms=entries)
+
+
+def check_rom(library: RomLibrary, golden: Dict, rom: Text, engine: Text, candidates: List[Text],
+              chunk: Optional[int] = None) -> List[Text]:
+    """
+    Compare a rom against its golden hash, then every candidate against the reference
+    :return: Failure descriptions, empty when the rom passed
+    """
+    entry = golden['roms'].get(rom)
+    if entry is None:
+        return ['no golden result, run with --update']
+    if library.find(rom).sha1 != entry['sha1']:
+        return ['rom changed since the golden result was recorded']
+
+    frames, cycles_per_frame, seed = golden['frames'], golden['cycles_per_frame'], golden['seed']
+    inputs = dict(entry['inputs'])
+    failures = []
+    try:
+        actual = frame_hash(_start(library, rom, seed), engine, frames, cycles_per_frame, inputs)
+        if entry['error'] is not None:
+            failures.append(f"expected {entry['error']}, ran through")
+        elif actual != entry['hash']:
+            failures.append(f"frame hash {actual} != golden {entry['hash']}")
+    except Exception as error:
+        if f'{type(error).__name__}: {error}' != entry['error']:
+            failures.append(f'{type(error).__name__}: {error}')
+
+    for name in candidates:
+        try:
+            chip8 = _start(library, rom, seed)
+        except Exception:
+            # the rom not loading is the golden check's business
+            break
+        try:
+            divergence = lockstep(chip8, name, frames, cycles_per_frame, inputs, chunk)
+        except ReferenceStopped as error:
+            # the reference stopping where the golden result did is the golden check's business
+            if entry['error'] is None:
+                failures.append(f'{name}: reference stopped, {error}')
+            continue
+        except Exception as error:
+            failures.append(f'{name}: {type(error).__name__}: {error}')
+            continue
+        if divergence is not None:
+            failures.append(format_divergence(divergence))
+    return failures
+
+
+def format_divergence(divergence: Divergence) -> Text:
+    lines = [f'{divergence.candidate} diverged after cycle {divergence.cycle} (frame {divergence.frame})']
+    lines += [f'  {difference}' for difference in divergence.differences]
+    lines += ['  last instructions:'] + [f'    {pc:03x}: {opcode:04x} {disassemble(opcode)}'
+                                         for pc, opcode in divergence.instructions]
+    lines += ['  reference:'] + [f'    {line}' for line in divergence.expected.splitlines()]
+    lines += [f'  {divergence.candidate}:'] + [f'    {line}' for line in divergence.actual.splitlines()]
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Check roms against golden frame hashes and the engines '
+                                                 'against the reference interpreter')
+    parser.add_argument('roms', nargs='*', help='rom file names, every rom of the golden file by default')
+    parser.add_argument('--roms-dir', default='ROMs')
+    parser.add_argument('--golden', default=str(GOLDEN_FILE))
+    parser.add_argument('--update', action='store_true', help='record the golden results instead of checking')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames to record with --update')
+    parser.add_argument('--cycles-per-frame', type=int, default=GOLDEN_CYCLES_PER_FRAME,
+                        help='cycles per frame to record with --update')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed to record with --update')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='interpreter',
+                        help='engine checked against the golden hashes')
+    parser.add_argument('--diff', nargs='*', choices=sorted(CANDIDATES), default=['translator', 'idle', 'snapshot'],
+                        help='candidates run in lockstep with the reference interpreter, all of them when '
+                             'none is named')
+    parser.add_argument('--chunk', type=int, default=None, help='cycles between lockstep comparisons')
+    args = parser.parse_args(argv)
+
+    library = RomLibrary(Path(args.roms_dir), index_path=None)
+    golden_path = Path(args.golden)
+    if args.update:
+        if args.roms and golden_path.exists():
+            # only the named roms are recorded again, with the settings of the others
+            golden = load_golden(golden_path)
+            recorded = update_golden(library, args.roms, golden['frames'], golden['cycles_per_frame'],
+                                     golden['seed'])
+            golden['roms'] = dict(sorted({**golden['roms'], **recorded['roms']}.items()))
+        else:
+            roms = args.roms or sorted(entry.file for entry in library.entries.values())
+            golden = update_golden(library, roms, args.frames, args.cycles_per_frame, args.seed)
+        golden_path.write_text(json.dumps(golden, indent=2) + '\n')
+        print(f"{len(golden['roms'])} roms recorded to {golden_path}")
+        return 0
+
+    golden = load_golden(golden_path)
+    candidates = args.diff or sorted(CANDIDATES)
+    failed = 0
+    for rom in args.roms or list(golden['roms']):
+        failures = check_rom(library, golden, rom, args.engine, candidates, args.chunk)
+        print(f"{'FAIL' if failures else 'ok  '} {rom}")
+        for failure in failures:
+            print('  ' + failure.replace('\n', '\n  '))
+        failed += bool(failures)
+    print(f'{failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,377 @@
+import argparse
+import cmd
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Text,
+    Tuple
+)
+
+from chip8 import Chip8, KEYPAD, PROFILES, SYSTEM_MEMORY, key_mask
+from decoder import InstructionDecoder, disassemble
+from library import rom_profile
+from scheduler import DEFAULT_CYCLES_PER_FRAME
+from utils import snapshot_frame
+
+# opcodes writing memory at I, by the bytes they write
+MEMORY_WRITES = {0xF033 | x << 8: 3 for x in range(16)}
+MEMORY_WRITES.update({0xF055 | x << 8: x + 1 for x in range(16)})
+
+
+# names a breakpoint condition can use, see _registers
+CONDITION_NAMES = frozenset([f'v{reg:x}' for reg in range(16)] + ['i', 'pc', 'sp', 'dt', 'st', 'keys', 'mem'])
+
+
+class Stop(NamedTuple):
+    # 'breakpoint', 'watchpoint', 'step', 'key wait' or 'limit'
+    reason: Text
+    pc: int
+    detail: Text = ''
+
+
+class _Stopped(Exception):
+    def __init__(self, stop: Stop):
+        super().__init__(stop.reason)
+        self.stop = stop
+
+
+def _registers(chip8: Chip8) -> Dict[Text, int]:
+    """
+    Names a breakpoint condition can use
+    """
+    names = {f'v{reg:x}': value for reg, value in enumerate(chip8.v)}
+    names.update(i=chip8.index_reg, pc=chip8.pc, sp=chip8.sp, dt=chip8.delay_reg, st=chip8.sound_reg,
+                 keys=chip8.keys, mem=chip8.memory)
+    return names
+
+
+class Debugger:
+    """
+    Breakpoints and watchpoints enforced through the machine dispatch table: the
+    opcodes found at breakpoint addresses and the FX33 / FX55 memory writes are
+    swapped for traps in a private copy of the table, every other opcode runs the
+    plain handler. With nothing set the machine is back on the shared table and
+    runs at full interpreter speed.
+
+    Breakpoints trap the opcode at their address when the machine is resumed, code
+    rewritten while it runs is not caught until the next stop.
+    """
+
+    def __init__(self, chip8: Chip8, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME):
+        """
+        :param chip8: Machine to debug with its interpreter
+        :param cycles_per_frame: Cycles between two timer ticks
+        """
+        self.chip8 = chip8
+        self.cycles_per_frame = cycles_per_frame
+        # address -> condition text, None to always stop
+        self.breakpoints: Dict[int, Optional[Text]] = {}
+        # (first address, last address + 1)
+        self.watchpoints: List[Tuple[int, int]] = []
+        self._conditions: Dict[int, Callable[[Chip8], bool]] = {}
+        # pc the machine resumes at, its breakpoint must not stop it again
+        self._resume_pc: Optional[int] = None
+        # (return address, stack depth) a step over runs to
+        self._return_to: Optional[Tuple[int, int]] = None
+
+    def add_breakpoint(self, addr: int, condition: Optional[Text] = None) -> NoReturn:
+        """
+        :param addr: Address of the instruction to stop before
+        :param condition: Python expression over v0..vf, i, pc, sp, dt, st, keys and mem,
+            the breakpoint only stops when it is true
+        """
+        if condition is None:
+            self._conditions.pop(addr, None)
+        else:
+            code = compile(condition, f'<breakpoint {addr:#05x}>', 'eval')
+            unknown = set(code.co_names) - CONDITION_NAMES
+            if unknown:
+                raise ValueError(f"Unknown names in condition: {', '.join(sorted(unknown))}")
+            self._conditions[addr] = lambda chip8: bool(eval(code, {}, _registers(chip8)))
+        self.breakpoints[addr] = condition
+
+    def remove_breakpoint(self, addr: int) -> NoReturn:
+        del self.breakpoints[addr]
+        self._conditions.pop(addr, None)
+
+    def add_watchpoint(self, addr: int, length: int = 1) -> NoReturn:
+        """
+        Stop after an instruction writes memory in addr..addr + length - 1
+        """
+        self.watchpoints.append((addr, addr + length))
+
+    def remove_watchpoint(self, addr: int) -> NoReturn:
+        self.watchpoints = [watch for watch in self.watchpoints if watch[0] != addr]
+
+    def step(self) -> Stop:
+        """
+        Execute a single instruction, stepping into calls
+        """
+        self._arm()
+        try:
+            self._execute_one()
+        except _Stopped as stopped:
+            return stopped.stop
+        finally:
+            self._disarm()
+        return Stop('step', self.chip8.pc)
+
+    def step_over(self, max_frames: Optional[int] = None) -> Stop:
+        """
+        Execute a single instruction, running a 2NNN call until it returns
+        """
+        chip8 = self.chip8
+        opcode = chip8.memory[chip8.pc] << 8 | chip8.memory[chip8.pc + 1]
+        if InstructionDecoder.decode(opcode)[0] != 'call_subroutine_2nnn':
+            return self.step()
+
+        # the stack depth tells the return apart from recursive calls reaching the same address
+        self._return_to = (chip8.pc + 2, chip8.sp)
+        try:
+            return self.cont(max_frames)
+        finally:
+            self._return_to = None
+
+    def cont(self, max_frames: Optional[int] = None) -> Stop:
+        """
+        Run until a breakpoint or watchpoint stops the machine, or it waits for a key
+        none is holding. The timers tick every cycles_per_frame cycles, counted again
+        from each resume.
+        :param max_frames: Frames to run at most, None to run until a stop
+        """
+        chip8 = self.chip8
+        self._arm()
+        try:
+            self._execute_one()
+            frames = 0
+            while max_frames is None or frames < max_frames:
+                if chip8.halt_execution and not chip8.keys:
+                    return Stop('key wait', chip8.pc)
+                chip8.run(self.cycles_per_frame)
+                chip8.tick_timers()
+                frames += 1
+        except _Stopped as stopped:
+            return stopped.stop
+        finally:
+            self._disarm()
+        return Stop('limit', chip8.pc)
+
+    def _execute_one(self) -> NoReturn:
+        self._resume_pc = self.chip8.pc
+        try:
+            self.chip8.emulate_cycle()
+        finally:
+            self._resume_pc = None
+
+    def _arm(self) -> NoReturn:
+        """
+        Install the traps, on a copy of the dispatch table only when there is one to install
+        """
+        chip8 = self.chip8
+        shared = Chip8.dispatch_table(chip8.quirks)
+        if not (self.breakpoints or self.watchpoints or self._return_to):
+            chip8._dispatch = shared
+            return
+
+        table = shared.copy()
+        if self.watchpoints:
+            for opcode, length in MEMORY_WRITES.items():
+                table[opcode] = (self._watch_trap, (chip8.resolve(opcode), length))
+
+        addrs = set(self.breakpoints)
+        if self._return_to is not None:
+            addrs.add(self._return_to[0])
+        trapped = set()
+        for addr in addrs:
+            if addr + 1 >= SYSTEM_MEMORY:
+                continue
+            opcode = chip8.memory[addr] << 8 | chip8.memory[addr + 1]
+            if opcode in trapped:
+                continue
+            trapped.add(opcode)
+            # wraps the watch trap of a memory write
+            entry = table[opcode] if opcode in MEMORY_WRITES and self.watchpoints else chip8.resolve(opcode)
+            table[opcode] = (self._break_trap, (entry,))
+        chip8._dispatch = table
+
+    def _disarm(self) -> NoReturn:
+        self.chip8._dispatch = Chip8.dispatch_table(self.chip8.quirks)
+
+    def _break_trap(self, chip8: Chip8, entry: Tuple[Callable, Tuple]) -> NoReturn:
+        pc = chip8.pc
+        if pc != self._resume_pc:
+            if self._return_to == (pc, chip8.sp):
+                raise _Stopped(Stop('step', pc))
+            if pc in self.breakpoints:
+                condition = self._conditions.get(pc)
+                try:
+                    hit = condition is None or condition(chip8)
+                except Exception as error:
+                    # e.g. mem[i + 4096], stop so the condition can be fixed
+                    raise _Stopped(Stop('breakpoint', pc, f'condition error: {type(error).__name__}: {error}'))
+                if hit:
+                    raise _Stopped(Stop('breakpoint', pc, self.breakpoints[pc] or ''))
+
+        handler, args = entry
+        handler(chip8, *args)
+
+    def _watch_trap(self, chip8: Chip8, entry: Tuple[Callable, Tuple], length: int) -> NoReturn:
+        pc = chip8.pc
+        start = chip8.index_reg
+        end = start + length
+        handler, args = entry
+        handler(chip8, *args)
+
+        for watch_start, watch_end in self.watchpoints:
+            if start < watch_end and watch_start < end:
+                # the instruction completed, the run loop never gets to move past it
+                if not chip8.halt_execution and chip8.pc + 2 < SYSTEM_MEMORY:
+                    chip8.pc += 2
+                written = ' '.join(f'{byte:02x}' for byte in chip8.memory[start: end])
+                raise _Stopped(Stop('watchpoint', pc, f'{start:#05x}..{end - 1:#05x} = {written}'))
+
+
+def _parse_addr(text: Text) -> int:
+    return int(text, 16)
+
+
+class DebuggerShell(cmd.Cmd):
+    """
+    Terminal front end of the debugger, addresses are hexadecimal
+    """
+    prompt = '(chip8) '
+
+    def __init__(self, debugger: Debugger):
+        super().__init__()
+        self.debugger = debugger
+        self.chip8 = debugger.chip8
+
+    def preloop(self) -> NoReturn:
+        self.do_list('')
+
+    def onecmd(self, line: Text) -> bool:
+        try:
+            return super().onecmd(line)
+        except (ValueError, KeyError, IndexError, SyntaxError) as error:
+            print(f'{type(error).__name__}: {error}')
+            return False
+
+    def emptyline(self) -> bool:
+        # unlike cmd, do not repeat the last command
+        return False
+
+    def do_break(self, arg: Text) -> NoReturn:
+        """break ADDR [if CONDITION]: stop before ADDR, when CONDITION (e.g. v3 == 5) holds"""
+        addr, _, condition = arg.partition(' if ')
+        self.debugger.add_breakpoint(_parse_addr(addr), condition.strip() or None)
+
+    def do_delete(self, arg: Text) -> NoReturn:
+        """delete ADDR: remove the breakpoint at ADDR"""
+        self.debugger.remove_breakpoint(_parse_addr(arg))
+
+    def do_watch(self, arg: Text) -> NoReturn:
+        """watch ADDR [LENGTH]: stop after FX33 / FX55 write memory in ADDR..ADDR+LENGTH-1"""
+        addr, *length = arg.split()
+        self.debugger.add_watchpoint(_parse_addr(addr), int(length[0]) if length else 1)
+
+    def do_unwatch(self, arg: Text) -> NoReturn:
+        """unwatch ADDR: remove the watchpoints starting at ADDR"""
+        self.debugger.remove_watchpoint(_parse_addr(arg))
+
+    def do_info(self, arg: Text) -> NoReturn:
+        """info: list the breakpoints and watchpoints"""
+        for addr, condition in sorted(self.debugger.breakpoints.items()):
+            print(f'break {addr:03x}' + (f' if {condition}' if condition else ''))
+        for start, end in self.debugger.watchpoints:
+            print(f'watch {start:03x} {end - start}')
+
+    def do_step(self, arg: Text) -> NoReturn:
+        """step: execute one instruction"""
+        self.__report(self.debugger.step())
+
+    def do_next(self, arg: Text) -> NoReturn:
+        """next: execute one instruction, running calls until they return"""
+        self.__report(self.debugger.step_over())
+
+    def do_continue(self, arg: Text) -> NoReturn:
+        """continue [FRAMES]: run until a stop, or for FRAMES frames"""
+        self.__report(self.debugger.cont(int(arg) if arg else None))
+
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_b = do_break
+
+    def do_regs(self, arg: Text) -> NoReturn:
+        """regs: print the registers"""
+        chip8 = self.chip8
+        print(' '.join(f'V{reg:X}={value:02x}' for reg, value in enumerate(chip8.v)))
+        stack = ' '.join(f'{addr:03x}' for addr in chip8.stack[:chip8.sp])
+        print(f'PC={chip8.pc:03x} I={chip8.index_reg:03x} DT={chip8.delay_reg} ST={chip8.sound_reg} '
+              f'SP={chip8.sp} stack=[{stack}]')
+
+    def do_x(self, arg: Text) -> NoReturn:
+        """x ADDR [LENGTH]: dump LENGTH bytes of memory from ADDR"""
+        addr, *length = arg.split()
+        start = _parse_addr(addr)
+        end = min(start + (int(length[0]) if length else 16), SYSTEM_MEMORY)
+        for row in range(start, end, 16):
+            print(f'{row:03x}:', ' '.join(f'{byte:02x}' for byte in self.chip8.memory[row: min(row + 16, end)]))
+
+    def do_list(self, arg: Text) -> NoReturn:
+        """list [ADDR]: disassemble around ADDR, the pc by default"""
+        center = _parse_addr(arg) if arg else self.chip8.pc
+        memory = self.chip8.memory
+        for addr in range(max(center - 8, 0), min(center + 10, SYSTEM_MEMORY - 1), 2):
+            opcode = memory[addr] << 8 | memory[addr + 1]
+            marker = '>' if addr == self.chip8.pc else ('*' if addr in self.debugger.breakpoints else ' ')
+            print(f'{marker} {addr:03x}  {opcode:04x}  {disassemble(opcode)}')
+
+    def do_screen(self, arg: Text) -> NoReturn:
+        """screen: print the framebuffer"""
+        snapshot_frame(self.chip8.gfx, self.chip8.screen_width)
+
+    def do_keys(self, arg: Text) -> NoReturn:
+        """keys [NAMES]: hold exactly the named keys, none to release them all"""
+        unknown = ''.join(key for key in arg.strip() if key not in KEYPAD)
+        if unknown:
+            raise KeyError(f"Unknown key {unknown!r}")
+        self.chip8.keys = key_mask(arg.strip())
+
+    def do_quit(self, arg: Text) -> bool:
+        """quit: leave the debugger"""
+        return True
+
+    do_EOF = do_quit
+
+    def __report(self, stop: Stop) -> NoReturn:
+        if stop.reason != 'step':
+            print(f'{stop.reason} at {stop.pc:03x}' + (f': {stop.detail}' if stop.detail else ''))
+        self.do_list('')
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Debug a rom in the terminal')
+    parser.add_argument('rom')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8')
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--break', dest='breakpoints', nargs='*', default=[], help='initial breakpoint addresses')
+    args = parser.parse_args(argv)
+
+    chip8 = Chip8(args.seed, rom_profile(Path(args.rom), PROFILES[args.quirks]))
+    chip8.initialize()
+    chip8.load_rom(Path(args.rom).read_bytes())
+    debugger = Debugger(chip8, args.cycles_per_frame)
+    for addr in args.breakpoints:
+        debugger.add_breakpoint(_parse_addr(addr))
+    DebuggerShell(debugger).cmdloop()
+
+
+if __name__ == '__main__':
+    main()
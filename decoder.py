@@ -1,12 +1,188 @@
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Text,
+    Tuple
+)
+
+OPCODE_COUNT = 0x10000
+
+# handler name on Chip8 and its pre-extracted operands
+Operation = Tuple[Text, Tuple[int, ...]]
+
+# masked opcode: (handler name, operand fields, mnemonic template)
+SINGLE_OPCODES = {
+    0x1000: ('jump_to_1nnn', ('nnn',), 'JP ${nnn}'),
+    0x2000: ('call_subroutine_2nnn', ('nnn',), 'CALL ${nnn}'),
+    0x3000: ('skip_if_equal_value_3xkk', ('x', 'kk'), 'SE V{x}, {kk}'),
+    0x4000: ('skip_if_not_equal_value_4xkk', ('x', 'kk'), 'SNE V{x}, {kk}'),
+    0x5000: ('skip_if_equal_reg_5xy0', ('x', 'y'), 'SE V{x}, V{y}'),
+    0x6000: ('set_reg_value_6xkk', ('x', 'kk'), 'LD V{x}, {kk}'),
+    0x7000: ('add_value_7xkk', ('x', 'kk'), 'ADD V{x}, {kk} '),
+    0x9000: ('skip_if_not_equal_reg_9xy0', ('x', 'y'), 'SNE V{x}, V{y}'),
+    0xA000: ('set_index_value_annn', ('nnn',), 'LD I, ${nnn}'),
+    0xB000: ('jump_value_offset_bnnn', ('nnn',), 'JP V0,${nnn}'),
+    0xC000: ('set_random_and_value_cxkk', ('x', 'kk'), 'RND V{x}, {kk}'),
+    0xD000: ('display_sprite_dxyn', ('x', 'y', 'n'), 'DRW V{x}, V{y}, {n}'),
+}
+
+MULTIPLE_OPCODES_0 = {
+    0x00E0: ('clear_display_00e0', (), 'CLS'),
+    0x00EE: ('return_subroutine_00ee', (), 'RET'),
+    # SUPER-CHIP
+    0x00FB: ('scroll_right_00fb', (), 'SCR'),
+    0x00FC: ('scroll_left_00fc', (), 'SCL'),
+    0x00FD: ('exit_00fd', (), 'EXIT'),
+    0x00FE: ('low_res_00fe', (), 'LOW'),
+    0x00FF: ('high_res_00ff', (), 'HIGH'),
+}
+
+# SUPER-CHIP, keyed on opcode & 0xFFF0
+MULTIPLE_OPCODES_00C = {
+    0x00C0: ('scroll_down_00cn', ('n',), 'SCD {n}'),
+}
+
+# SUPER-CHIP, keyed on opcode & 0xF00F
+MULTIPLE_OPCODES_D = {
+    0xD000: ('display_large_sprite_dxy0', ('x', 'y'), 'DRW V{x}, V{y}, 0'),
+}
+
+MULTIPLE_OPCODES_8 = {
+    0x8000: ('set_reg_reg_8xy0', ('x', 'y'), 'LD V{x}, V{y}'),
+    0x8001: ('or_reg_reg_8xy1', ('x', 'y'), 'OR V{x}, V{y}'),
+    0x8002: ('and_reg_reg_8xy2', ('x', 'y'), 'AND V{x}, V{y}'),
+    0x8003: ('xor_reg_reg_8xy3', ('x', 'y'), 'XOR V{x}, V{y}'),
+    0x8004: ('add_reg_carry_8xy4', ('x', 'y'), 'ADD V{x}, V{y}'),
+    0x8005: ('sub_reg_reg_8xy5', ('x', 'y'), 'SUB V{x}, V{y}'),
+    0x8006: ('shr_reg_8xy6', ('x', 'y'), 'SHR V{x}, V{y}'),
+    0x8007: ('subn_reg_reg_8xy7', ('x', 'y'), 'SUBN V{x}, V{y}'),
+    0x800E: ('shl_reg_8xye', ('x', 'y'), 'SHL V{x}, V{y}'),
+}
+
+MULTIPLE_OPCODES_EF = {
+    0xE09E: ('skip_if_pressed_ex9e', ('x',), 'SKP V{x}'),
+    0xE0A1: ('skip_if_not_pressed_exa1', ('x',), 'SKNP V{x}'),
+    0xF007: ('save_delay_fx07', ('x',), 'LD V{x}, DT'),
+    0xF00A: ('wait_for_keypress_fx0a', ('x',), 'LD V{x}*'),
+    0xF015: ('set_delay_fx15', ('x',), 'LD DT, V{x}'),
+    0xF018: ('set_sound_fx18', ('x',), 'LD ST, V{x}'),
+    0xF01E: ('add_index_fx1e', ('x',), 'ADD I, V{x}'),
+    0xF029: ('set_sprite_loc_fx29', ('x',), 'LD F, V{x}'),
+    0xF033: ('bcd_repr_fx33', ('x',), 'LD B, V{x}'),
+    0xF055: ('store_regs_fx55', ('x',), 'LD [I], V{x}'),
+    0xF065: ('read_regs_fx65', ('x',), 'LD V{x}, [I]'),
+    # SUPER-CHIP
+    0xF030: ('set_large_sprite_loc_fx30', ('x',), 'LD HF, V{x}'),
+    0xF075: ('save_flags_fx75', ('x',), 'LD R, V{x}'),
+    0xF085: ('load_flags_fx85', ('x',), 'LD V{x}, R'),
+}
+
+NOP = ('do_nothing', (), 'NOP')
+
+# operand field: (shift, mask)
+FIELD_BITS = {
+    'nnn': (0, 0x0FFF),  # addr
+    'kk': (0, 0x00FF),  # byte
+    'n': (0, 0x000F),  # nibble
+    'x': (8, 0x000F),  # register x
+    'y': (4, 0x000F),  # register y
+}
+
+# opcode tables and the bits of their keys, lowest priority first
+_TABLE_MASKS = (
+    (MULTIPLE_OPCODES_EF, 0xF0FF),
+    (MULTIPLE_OPCODES_8, 0xF00F),
+    (MULTIPLE_OPCODES_00C, 0xFFF0),
+    (MULTIPLE_OPCODES_0, 0xFFFF),
+    (SINGLE_OPCODES, 0xF000),
+    (MULTIPLE_OPCODES_D, 0xF00F),
+)
+
+
+def _lookup(opcode: int) -> Optional[Tuple[Text, Tuple[Text, ...], Text]]:
+    if opcode == 0x0000:
+        return NOP
+
+    return (MULTIPLE_OPCODES_D.get(opcode & 0xF00F)
+            or SINGLE_OPCODES.get(opcode & 0xF000)
+            or MULTIPLE_OPCODES_0.get(opcode)
+            or MULTIPLE_OPCODES_00C.get(opcode & 0xFFF0)
+            or MULTIPLE_OPCODES_8.get(opcode & 0xF00F)
+            or MULTIPLE_OPCODES_EF.get(opcode & 0xF0FF))
+
+
+def _fields(opcode: int) -> Dict[Text, int]:
+    return {
+        'nnn': opcode & 0x0FFF,  # addr
+        'kk': opcode & 0x00FF,  # byte
+        'n': opcode & 0x000F,  # nibble
+        'x': (opcode & 0x0F00) >> 8,  # register x
+        'y': (opcode & 0x00F0) >> 4,  # register y
+    }
+
+
+def decode_operation(opcode: int) -> Operation:
+    """
+    Decode an opcode into the name of its Chip8 handler and its operands
+    :param opcode: 16 bits opcode
+    """
+    entry = _lookup(opcode)
+    if entry is None:
+        return NOP[0], ()
+
+    handler, operands, _ = entry
+    return handler, tuple([opcode >> FIELD_BITS[operand][0] & FIELD_BITS[operand][1] for operand in operands])
+
+
+def _build_decode_table() -> List[Operation]:
+    """
+    decode_operation for every opcode, filled one table entry at a time instead of
+    looking every opcode up, the operands are extracted once per opcode
+    """
+    table = [(NOP[0], ())] * OPCODE_COUNT
+    for opcodes, mask in _TABLE_MASKS:
+        # every value of the bits outside the key
+        free = ~mask & 0xFFFF
+        lows = [free]
+        while lows[-1]:
+            lows.append((lows[-1] - 1) & free)
+
+        for key, (handler, operands, _) in opcodes.items():
+            bits = [FIELD_BITS[operand] for operand in operands]
+            for opcode in [key | low for low in lows]:
+                table[opcode] = (handler, tuple([opcode >> shift & field for shift, field in bits]))
+    table[0x0000] = (NOP[0], ())
+    return table
+
+
+def disassemble(opcode: int) -> Text:
+    """
+    Assembly text for an opcode, only built when asked for
+    :param opcode: 16 bits opcode
+    """
+    entry = _lookup(opcode)
+    if entry is None:
+        return f"Invalid opcode {hex(opcode)}"
+
+    fields = _fields(opcode)
+    return entry[2].format(x=fields['x'], y=fields['y'], nnn=hex(fields['nnn']),
+                           kk=hex(fields['kk']), n=hex(fields['n']))
+
+
 class Instruction:
-    def __init__(self, assembly, func, *args):
-        self.assembly = assembly
+    def __init__(self, opcode, func, *args):
+        self.opcode = opcode
         self._func = func
         self._args = args
 
     def __str__(self):
         return self.assembly
 
+    @property
+    def assembly(self) -> Text:
+        return disassemble(self.opcode)
+
     def run(self) -> None:
         if self._args:
             self._func(*self._args)
@@ -15,79 +191,32 @@ class Instruction:
 
 
 class InstructionDecoder:
+    _table: List[Operation] = []
+    # opcodes decoded one by one before the whole table was needed
+    _decoded: Dict[int, Operation] = {}
+
+    @classmethod
+    def decode_table(cls) -> List[Operation]:
+        """
+        Operations for all the 65536 opcodes, built once on first use
+        """
+        if not cls._table:
+            cls._table = _build_decode_table()
+        return cls._table
+
+    @classmethod
+    def decode(cls, opcode: int) -> Operation:
+        """
+        Operation of a single opcode, without building the whole table
+        """
+        if cls._table:
+            return cls._table[opcode]
+        operation = cls._decoded.get(opcode)
+        if operation is None:
+            operation = cls._decoded[opcode] = decode_operation(opcode)
+        return operation
+
     @staticmethod
     def decode_from(chip8, opcode) -> Instruction:
-        nnn = opcode & 0x0FFF  # addr
-        kk = opcode & 0x00FF  # byte
-        n = opcode & 0x000F  # nibble
-        x = (opcode & 0x0F00) >> 8  # register x
-        y = (opcode & 0x00F0) >> 4  # register y
-
-        # NOP
-        if opcode == 0x0000:
-            return Instruction('NOP', chip8.do_nothing)
-
-        # SINGLE CASES
-        opcode_single = opcode & 0xF000
-        single_opcodes = {
-            0x1000: Instruction(f'JP ${hex(nnn)}', chip8.jump_to_1nnn, nnn),
-            0x2000: Instruction(f'CALL ${hex(nnn)}', chip8.call_subroutine_2nnn, nnn),
-            0x3000: Instruction(f'SE V{x}, {hex(kk)}', chip8.skip_if_equal_value_3xkk, x, kk),
-            0x4000: Instruction(f'SNE V{x}, {hex(kk)}', chip8.skip_if_not_equal_value_4xkk, x, kk),
-            0x5000: Instruction(f'SE V{x}, V{y}', chip8.skip_if_equal_reg_5xy0, x, y),
-            0x6000: Instruction(f'LD V{x}, {hex(kk)}', chip8.set_reg_value_6xkk, x, kk),
-            0x7000: Instruction(f'ADD V{x}, {hex(kk)} ', chip8.add_value_7xkk, x, kk),
-            0x9000: Instruction(f'SNE V{x}, V{y}', chip8.skip_if_not_equal_reg_9xy0, x, y),
-            0xA000: Instruction(f'LD I, ${hex(nnn)}', chip8.set_index_value_annn, nnn),
-            0xB000: Instruction(f'JP V0,${hex(nnn)}', chip8.jump_value_offset_bnnn, nnn),
-            0xC000: Instruction(f'RND V{x}, {hex(kk)}', chip8.set_random_and_value_cxkk, x, kk),
-            0xD000: Instruction(f'DRW V{x}, V{y}, {hex(n)}', chip8.display_sprite_dxyn, x, y, n),
-        }
-        if opcode_single in single_opcodes:
-            return single_opcodes[opcode_single]
-
-        # 0 CASES
-        opcode_0 = opcode & 0xFFFF
-        multiple_opcodes_0 = {
-            # 0X0000: Instruction(),
-            0X00E0: Instruction('CLS', chip8.clear_display_00e0),
-            0X00EE: Instruction('RET', chip8.return_subroutine_00ee),
-        }
-        if opcode_0 in multiple_opcodes_0:
-            return multiple_opcodes_0[opcode_0]
-
-        # 8 CASES
-        opcode_8 = opcode & 0xF00F
-        multiple_opcodes_8 = {
-            0x8000: Instruction(f'LD V{x}, V{y}', chip8.set_reg_reg_8xy0, x, y),
-            0x8001: Instruction(f'OR V{x}, V{y}', chip8.or_reg_reg_8xy1, x, y),
-            0x8002: Instruction(f'AND V{x}, V{y}', chip8.and_reg_reg_8xy2, x, y),
-            0x8003: Instruction(f'XOR V{x}, V{y}', chip8.xor_reg_reg_8xy3, x, y),
-            0x8004: Instruction(f'ADD V{x}, V{y}', chip8.add_reg_carry_8xy4, x, y),
-            0x8005: Instruction(f'SUB V{x}, V{y}', chip8.sub_reg_reg_8xy5, x, y),
-            0x8006: Instruction(f'SHR V{x}, V{y}', chip8.shr_reg_8xy6, x, y),
-            0x8007: Instruction(f'SUBN V{x}, V{y}', chip8.subn_reg_reg_8xy7, x, y),
-            0x800E: Instruction(f'SHL V{x}, V{y}', chip8.shl_reg_8xye, x, y),
-        }
-        if opcode_8 in multiple_opcodes_8:
-            return multiple_opcodes_8[opcode_8]
-
-        # E and F CASES
-        opcode_ef = opcode & 0xF0FF
-        multiple_opcodes_ef = {
-            0xE09E: Instruction(f'SKP V{x}', chip8.skip_if_pressed_ex9e, x),
-            0xE0A1: Instruction(f'SKNP V{x}', chip8.skip_if_not_pressed_exa1, x),
-            0xF007: Instruction(f'LD V{x}, DT', chip8.save_delay_fx07, x),
-            0xF00A: Instruction(f'LD V{x}*', chip8.wait_for_keypress_fx0a, x),
-            0xF015: Instruction(f'LD DT, V{x}', chip8.set_delay_fx15, x),
-            0xF018: Instruction(f'LD ST, V{x}', chip8.set_sound_fx18, x),
-            0xF01E: Instruction(f'ADD I, V{x}', chip8.add_index_fx1e, x),
-            0xF029: Instruction(f'LD F, V{x}', chip8.set_sprite_loc_fx29, x),
-            0xF033: Instruction(f'LD B, V{x}', chip8.bcd_repr_fx33, x),
-            0xF055: Instruction(f'LD [I], V{x}', chip8.store_regs_fx55, x),
-            0xF065: Instruction(f'LD V{x}, [I]', chip8.read_regs_fx65, x),
-        }
-        if opcode_ef in multiple_opcodes_ef:
-            return multiple_opcodes_ef[opcode_ef]
-
-        return Instruction(f"Invalid opcode {hex(opcode)}", chip8.do_nothing)
+        handler, args = InstructionDecoder.decode_table()[opcode]
+        return Instruction(opcode, getattr(chip8, handler), *args)
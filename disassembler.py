@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Text
+)
+
+from chip8 import MIN_PROGRAM_ADDR, PROFILES
+from decoder import InstructionDecoder, disassemble
+
+PROGRAM_START = MIN_PROGRAM_ADDR
+CACHE_VERSION = 2
+CACHE_DIR = Path(os.environ.get('CHIP8_CACHE_DIR', Path.home() / '.cache' / 'chip8-py-emulator'))
+
+SKIPS = {
+    'skip_if_equal_value_3xkk', 'skip_if_not_equal_value_4xkk', 'skip_if_equal_reg_5xy0',
+    'skip_if_not_equal_reg_9xy0', 'skip_if_pressed_ex9e', 'skip_if_not_pressed_exa1',
+}
+
+
+class BasicBlock(NamedTuple):
+    start: int
+    # address after the last instruction
+    end: int
+    successors: List[int]
+
+
+class Disassembly:
+    """
+    Code reachable from the program start, following jumps, calls and skips
+    """
+
+    def __init__(self, rom_sha1: Text, load_address: int = PROGRAM_START):
+        self.rom_sha1 = rom_sha1
+        self.load_address = load_address
+        self.instructions: Dict[int, int] = {}
+        self.blocks: Dict[int, BasicBlock] = {}
+        # function entry -> functions it calls
+        self.call_graph: Dict[int, List[int]] = {}
+        # BNNN sites, their targets are only known at run time
+        self.indirect_jumps: List[int] = []
+
+    def listing(self) -> List[Text]:
+        lines = []
+        for addr in sorted(self.instructions):
+            if addr in self.call_graph:
+                lines.append(f'sub_{addr:03x}:')
+            elif addr in self.blocks:
+                lines.append(f'loc_{addr:03x}:')
+            opcode = self.instructions[addr]
+            lines.append(f'    {addr:#05x}  {opcode:04x}  {disassemble(opcode)}')
+        return lines
+
+    def to_json(self) -> Dict:
+        return {
+            'version': CACHE_VERSION,
+            'rom_sha1': self.rom_sha1,
+            'load_address': self.load_address,
+            'instructions': {str(addr): opcode for addr, opcode in self.instructions.items()},
+            'blocks': [list(block[:2]) + [block.successors] for block in self.blocks.values()],
+            'call_graph': {str(entry): callees for entry, callees in self.call_graph.items()},
+            'indirect_jumps': self.indirect_jumps,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Disassembly':
+        disassembly = cls(data['rom_sha1'], data['load_address'])
+        disassembly.instructions = {int(addr): opcode for addr, opcode in data['instructions'].items()}
+        disassembly.blocks = {start: BasicBlock(start, end, successors) for start, end, successors in data['blocks']}
+        disassembly.call_graph = {int(entry): callees for entry, callees in data['call_graph'].items()}
+        disassembly.indirect_jumps = data['indirect_jumps']
+        return disassembly
+
+
+def _successors(handler: Text, args, addr: int) -> List[int]:
+    if handler == 'jump_to_1nnn':
+        return [args[0]]
+    if handler == 'call_subroutine_2nnn':
+        return [addr + 2]
+    if handler in SKIPS:
+        return [addr + 2, addr + 4]
+    if handler in ('return_subroutine_00ee', 'jump_value_offset_bnnn', 'exit_00fd'):
+        return []
+    return [addr + 2]
+
+
+def _ends_block(handler: Text) -> bool:
+    return handler in SKIPS or handler in ('jump_to_1nnn', 'call_subroutine_2nnn', 'return_subroutine_00ee',
+                                           'jump_value_offset_bnnn', 'exit_00fd')
+
+
+def disassemble_rom(rom: bytes, load_address: int = PROGRAM_START) -> Disassembly:
+    """
+    Recursive descent disassembly of a rom loaded at the program start
+    :param load_address: Where the rom is loaded and starts, 0x600 on the ETI 660
+    """
+    decode = InstructionDecoder.decode
+    disassembly = Disassembly(hashlib.sha1(rom).hexdigest(), load_address)
+    rom_end = load_address + len(rom)
+    instructions = disassembly.instructions
+    leaders: Set[int] = {load_address}
+    entries: Set[int] = {load_address}
+
+    pending = [load_address]
+    while pending:
+        addr = pending.pop()
+        while load_address <= addr < rom_end - 1 and addr not in instructions:
+            offset = addr - load_address
+            opcode = rom[offset] << 8 | rom[offset + 1]
+            instructions[addr] = opcode
+            handler, args = decode(opcode)
+
+            if handler == 'call_subroutine_2nnn':
+                entries.add(args[0])
+                leaders.add(args[0])
+                pending.append(args[0])
+            elif handler == 'jump_value_offset_bnnn':
+                disassembly.indirect_jumps.append(addr)
+
+            successors = _successors(handler, args, addr)
+            if not _ends_block(handler):
+                addr = successors[0]
+                continue
+
+            leaders.update(successors)
+            pending.extend(successors)
+            break
+
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        addr = start
+        while True:
+            handler, args = decode(instructions[addr])
+            successors = _successors(handler, args, addr)
+            if _ends_block(handler) or successors[0] in leaders or successors[0] not in instructions:
+                break
+            addr = successors[0]
+        disassembly.blocks[start] = BasicBlock(start, addr + 2, successors)
+
+    for entry in sorted(entries):
+        if entry in instructions:
+            disassembly.call_graph[entry] = _callees(disassembly, entry)
+
+    return disassembly
+
+
+def _callees(disassembly: Disassembly, entry: int) -> List[int]:
+    """
+    Functions called from the blocks reachable from entry without following calls
+    """
+    decode = InstructionDecoder.decode
+    callees = set()
+    seen = set()
+    pending = [entry]
+    while pending:
+        block = disassembly.blocks.get(pending.pop())
+        if block is None or block.start in seen:
+            continue
+        seen.add(block.start)
+        handler, args = decode(disassembly.instructions[block.end - 2])
+        if handler == 'call_subroutine_2nnn':
+            callees.add(args[0])
+        pending.extend(block.successors)
+    return sorted(callees)
+
+
+def load_disassembly(rom: bytes, cache_dir: Optional[Path] = CACHE_DIR,
+                     load_address: int = PROGRAM_START) -> Disassembly:
+    """
+    Disassembly of a rom, cached on disk by rom SHA-1 and load address
+    :param cache_dir: None to skip the cache
+    :param load_address: Where the rom is loaded and starts
+    """
+    if cache_dir is None:
+        return disassemble_rom(rom, load_address)
+
+    cache_file = Path(cache_dir) / f'{hashlib.sha1(rom).hexdigest()}-{load_address:03x}.json'
+    if cache_file.exists():
+        data = json.loads(cache_file.read_text())
+        if data.get('version') == CACHE_VERSION:
+            return Disassembly.from_json(data)
+
+    disassembly = disassemble_rom(rom, load_address)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(disassembly.to_json()))
+    except OSError:
+        pass
+    return disassembly
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Disassemble the code reachable in a rom')
+    parser.add_argument('rom')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8', help='profile giving the load address')
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    disassembly = load_disassembly(Path(args.rom).read_bytes(), None if args.no_cache else CACHE_DIR,
+                                   PROFILES[args.quirks].load_address)
+    print('\n'.join(disassembly.listing()))
+    print()
+    for entry, callees in disassembly.call_graph.items():
+        print(f'sub_{entry:03x} -> {", ".join(f"sub_{callee:03x}" for callee in callees) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
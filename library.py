@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import json
+import mmap
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Text
+)
+
+from chip8 import Chip8, CHIP8, PROFILES, QuirkProfile, profile_for
+from decoder import InstructionDecoder
+from disassembler import CACHE_DIR, Disassembly, disassemble_rom
+
+ROMS_DIR = Path('ROMs')
+METADATA_FILE = 'roms.json'
+INDEX_VERSION = 3
+INDEX_FILE = CACHE_DIR / 'library.json'
+
+# handlers whose behaviour differs between interpreters, by roms.json quirk name
+QUIRK_HANDLERS = {
+    'shift': {'shr_reg_8xy6', 'shl_reg_8xye'},
+    'loadStore': {'store_regs_fx55', 'read_regs_fx65'},
+    'jump': {'jump_value_offset_bnnn'},
+    'wrap': {'display_sprite_dxyn'},
+}
+
+
+class RomEntry(NamedTuple):
+    sha1: Text
+    file: Text
+    size: int
+    title: Text
+    description: Text
+    # quirks declared in roms.json
+    quirks: Dict[Text, bool]
+    # quirks the reachable code is sensitive to
+    detected_quirks: List[Text]
+    # basic block starts of the static disassembly
+    entry_blocks: List[int]
+    # modification time of the file when it was indexed
+    mtime: float
+
+
+def read_metadata(roms_dir: Path) -> Dict[Text, Dict]:
+    """
+    :return: roms.json entries of a rom directory by file name
+    """
+    metadata_path = Path(roms_dir) / METADATA_FILE
+    if not metadata_path.exists():
+        return {}
+    return {rom['file']: rom for rom in json.loads(metadata_path.read_text())}
+
+
+def rom_profile(path: Path, base: QuirkProfile = CHIP8) -> QuirkProfile:
+    """
+    Quirk profile of a rom file, base with the quirks the roms.json next to it declares
+    :param base: Profile the rom quirks apply to
+    """
+    path = Path(path)
+    return profile_for(read_metadata(path.parent).get(path.name, {}).get('quirks', {}), base)
+
+
+def detect_quirks(disassembly: Disassembly) -> List[Text]:
+    """
+    :return: Names of the quirks whose handlers the reachable code uses
+    """
+    handlers = {InstructionDecoder.decode(opcode)[0] for opcode in disassembly.instructions.values()}
+    return sorted(quirk for quirk, quirk_handlers in QUIRK_HANDLERS.items() if handlers & quirk_handlers)
+
+
+class RomLibrary:
+    """
+    Index of a rom directory keyed by file name, persisted between runs and only
+    refreshed for the files that changed. Rom images are memory mapped once per
+    content and shared by every machine loading them.
+    """
+
+    def __init__(self, roms_dir: Path = ROMS_DIR, index_path: Optional[Path] = INDEX_FILE,
+                 base: QuirkProfile = CHIP8):
+        """
+        :param roms_dir: Directory of .ch8 files and their roms.json metadata
+        :param index_path: Persistent index, None to keep it in memory only
+        :param base: Profile the rom quirks apply to, its load address is where roms are disassembled from
+        """
+        self.roms_dir = Path(roms_dir)
+        self.index_path = index_path
+        self.base = base
+        # file name -> entry, files with the same content each keep their own
+        self.entries: Dict[Text, RomEntry] = {}
+        # SHA-1 -> first file name with that content
+        self._by_sha1: Dict[Text, Text] = {}
+        self._images: Dict[Text, memoryview] = {}
+        self._maps: List[mmap.mmap] = []
+        self._read_index()
+        self.refresh()
+
+    def refresh(self) -> NoReturn:
+        """
+        Index the new and modified roms, forget the deleted ones
+        """
+        metadata = read_metadata(self.roms_dir)
+        indexed = {entry.file: entry for entry in self.entries.values()}
+        entries = {}
+        by_sha1 = {}
+        for path in sorted(self.roms_dir.glob('*.ch8')):
+            stat = path.stat()
+            entry = indexed.get(path.name)
+            if entry is None or entry.mtime != stat.st_mtime or entry.size != stat.st_size:
+                entry = self._index(path, stat.st_mtime, metadata.get(path.name, {}))
+            entries[path.name] = entry
+            by_sha1.setdefault(entry.sha1, path.name)
+
+        changed = entries != self.entries
+        self.entries = entries
+        self._by_sha1 = by_sha1
+        if changed:
+            self._write_index()
+
+    def find(self, name: Text) -> RomEntry:
+        """
+        :param name: File name or SHA-1 of a rom, the first file with that content
+        """
+        file = name if name in self.entries else self._by_sha1.get(name)
+        if file is None:
+            raise KeyError(f"No rom {name!r} in {self.roms_dir}")
+        return self.entries[file]
+
+    def image(self, name: Text) -> memoryview:
+        """
+        Read only, memory mapped rom image, mapped once per content. Valid until close,
+        views sliced from it keep their mapping open until they are released.
+        :param name: File name or SHA-1 of a rom
+        """
+        entry = self.find(name)
+        image = self._images.get(entry.sha1)
+        if image is None:
+            with open(self.roms_dir / entry.file, 'rb') as rom_file:
+                if entry.size:
+                    mapped = mmap.mmap(rom_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._maps.append(mapped)
+                    image = memoryview(mapped)
+                else:
+                    image = memoryview(b'')
+            self._images[entry.sha1] = image
+        return image
+
+    def profile(self, name: Text, base: Optional[QuirkProfile] = None) -> QuirkProfile:
+        """
+        Quirk profile of a rom, base with the quirks roms.json declares for it
+        :param base: Profile the rom quirks apply to, the library one by default
+        """
+        return profile_for(self.find(name).quirks, base or self.base)
+
+    def load(self, chip8: Chip8, name: Text, base: Optional[QuirkProfile] = None) -> RomEntry:
+        """
+        Switch an initialized machine to the quirk profile of a rom and copy the rom in
+        :param name: File name or SHA-1 of a rom
+        :param base: Profile the rom quirks apply to, the library one by default
+        """
+        entry = self.find(name)
+        chip8.set_quirks(profile_for(entry.quirks, base or self.base))
+        chip8.pc = chip8.quirks.load_address
+        chip8.load_rom(self.image(entry.sha1))
+        return entry
+
+    def close(self) -> NoReturn:
+        """
+        Release the images and unmap them, a mapping a slice still holds is unmapped
+        once the slice is released
+        """
+        for image in self._images.values():
+            image.release()
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._images.clear()
+        self._maps.clear()
+
+    def _index(self, path: Path, mtime: float, metadata: Dict) -> RomEntry:
+        rom = path.read_bytes()
+        quirks = metadata.get('quirks', {})
+        disassembly = disassemble_rom(rom, profile_for(quirks, self.base).load_address)
+        return RomEntry(sha1=hashlib.sha1(rom).hexdigest(), file=path.name, size=len(rom),
+                        title=metadata.get('title', path.stem), description=metadata.get('description', ''),
+                        quirks=quirks, detected_quirks=detect_quirks(disassembly),
+                        entry_blocks=sorted(disassembly.blocks), mtime=mtime)
+
+    def _read_index(self) -> NoReturn:
+        if self.index_path is None or not self.index_path.exists():
+            return
+        data = json.loads(self.index_path.read_text())
+        if (data.get('version') != INDEX_VERSION or data.get('roms_dir') != str(self.roms_dir.resolve())
+                or data.get('load_address') != self.base.load_address):
+            return
+        self.entries = {entry['file']: RomEntry(**entry) for entry in data['roms']}
+
+    def _write_index(self) -> NoReturn:
+        if self.index_path is None:
+            return
+        data = {'version': INDEX_VERSION, 'roms_dir': str(self.roms_dir.resolve()),
+                'load_address': self.base.load_address,
+                'roms': [entry._asdict() for entry in self.entries.values()]}
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            self.index_path.write_text(json.dumps(data))
+        except OSError:
+            pass
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Index a rom directory')
+    parser.add_argument('--roms-dir', default=str(ROMS_DIR))
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8', help='profile the rom quirks apply to')
+    args = parser.parse_args(argv)
+
+    library = RomLibrary(Path(args.roms_dir), base=PROFILES[args.quirks])
+    for entry in sorted(library.entries.values(), key=lambda entry: entry.title):
+        quirks = ', '.join(entry.detected_quirks) or '-'
+        print(f'{entry.sha1[:10]}  {entry.size:5}  {entry.title:40}  {quirks}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import json
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Text
+)
+
+from chip8 import Chip8, CHIP8, QuirkProfile, key_mask, key_names
+from runner import ENGINES
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME, UNLIMITED
+
+MOVIE_VERSION = 1
+EVENT_KEY = 'K'
+EVENT_CHECKSUM = 'C'
+# key event of a released key
+RELEASED = '-'
+
+
+def frame_checksum(chip8: Chip8) -> int:
+    """
+    crc32 of the framebuffer, continued over the registers, I and pc so a divergence
+    shows up before it reaches the screen
+    """
+    crc = zlib.crc32(chip8.frame_bytes())
+    return zlib.crc32(bytes(chip8.v) + chip8.index_reg.to_bytes(2, 'big') + chip8.pc.to_bytes(2, 'big'), crc)
+
+
+class InputMovie:
+    """
+    Frame indexed input log: the keys held from each frame on, plus checksums of the
+    machine after every checksum_interval frames. Stored as a json header line
+    followed by '<frame> K <key names>' and '<frame> C <crc32>' lines.
+    """
+
+    def __init__(self, rom_sha1: Text, seed: int, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME,
+                 checksum_interval: int = 1, quirks: QuirkProfile = CHIP8):
+        self.rom_sha1 = rom_sha1
+        self.quirks = quirks
+        self.seed = seed
+        self.cycles_per_frame = cycles_per_frame
+        self.checksum_interval = checksum_interval
+        self.frames = 0
+        self.inputs: Dict[int, Text] = {}
+        self.checksums: Dict[int, int] = {}
+
+    def save(self, path: Path) -> NoReturn:
+        header = dict(version=MOVIE_VERSION, rom_sha1=self.rom_sha1, seed=self.seed,
+                      cycles_per_frame=self.cycles_per_frame, checksum_interval=self.checksum_interval,
+                      frames=self.frames, quirks=self.quirks._asdict())
+        lines = [json.dumps(header)]
+        for frame in range(self.frames):
+            if frame in self.inputs:
+                lines.append(f'{frame} {EVENT_KEY} {self.inputs[frame] or RELEASED}')
+            if frame in self.checksums:
+                lines.append(f'{frame} {EVENT_CHECKSUM} {self.checksums[frame]:08x}')
+        path.write_text('\n'.join(lines) + '\n')
+
+    @classmethod
+    def load(cls, path: Path) -> 'InputMovie':
+        header, *lines = path.read_text().splitlines()
+        header = json.loads(header)
+        if header['version'] != MOVIE_VERSION:
+            raise ValueError(f"Unsupported movie version {header['version']}")
+
+        # movies recorded before quirk profiles ran the default one
+        quirks = QuirkProfile(**header['quirks']) if 'quirks' in header else CHIP8
+        movie = cls(header['rom_sha1'], header['seed'], header['cycles_per_frame'], header['checksum_interval'],
+                    quirks)
+        movie.frames = header['frames']
+        for line in lines:
+            frame, event, value = line.split()
+            if event == EVENT_KEY:
+                movie.inputs[int(frame)] = '' if value == RELEASED else value
+            elif event == EVENT_CHECKSUM:
+                movie.checksums[int(frame)] = int(value, 16)
+        return movie
+
+
+class MovieRecorder:
+    """
+    Records the keypad states set through it and the checksums of the frames run by the
+    scheduler. The machine must be freshly loaded and seeded with the movie seed.
+    """
+
+    def __init__(self, scheduler: FrameScheduler, rom: bytes, seed: int, checksum_interval: int = 1):
+        if scheduler.cycles_per_frame is UNLIMITED:
+            raise ValueError("Movies need a fixed number of cycles per frame")
+
+        self.scheduler = scheduler
+        self.movie = InputMovie(hashlib.sha1(rom).hexdigest(), seed, scheduler.cycles_per_frame, checksum_interval,
+                                scheduler.chip8.quirks)
+        scheduler.frame_listeners.append(self._on_frame)
+
+    def set_keys(self, mask: int) -> NoReturn:
+        self.scheduler.chip8.set_keys(mask)
+        # takes effect from the next frame the scheduler runs
+        self.movie.inputs[self.scheduler.frame_count] = key_names(mask)
+
+    def key_press(self, keys: Text) -> NoReturn:
+        self.set_keys(key_mask(keys))
+
+    def _on_frame(self, chip8: Chip8, frame: int) -> NoReturn:
+        self.movie.frames = frame + 1
+        if frame % self.movie.checksum_interval == 0:
+            self.movie.checksums[frame] = frame_checksum(chip8)
+
+
+class ReplayResult(NamedTuple):
+    frames: int
+    cycles: int
+    elapsed: float
+    # first frame whose checksum differs from the recorded one
+    diverged_frame: Optional[int] = None
+    expected_checksum: Optional[int] = None
+    actual_checksum: Optional[int] = None
+
+
+def replay(movie: InputMovie, rom: bytes, engine: Text = 'translator') -> ReplayResult:
+    """
+    Replay a movie headless as fast as possible, stopping at the first divergence
+    """
+    if hashlib.sha1(rom).hexdigest() != movie.rom_sha1:
+        raise ValueError("The rom does not match the one the movie was recorded with")
+
+    chip8 = Chip8(movie.seed, movie.quirks)
+    chip8.initialize()
+    chip8.load_rom(rom)
+    scheduler = FrameScheduler(chip8, ENGINES[engine](chip8), movie.cycles_per_frame)
+    inputs = movie.inputs
+    checksums = movie.checksums
+
+    start = time.perf_counter()
+    for frame in range(movie.frames):
+        if frame in inputs:
+            chip8.key_press(inputs[frame])
+        scheduler.run_frame()
+
+        expected = checksums.get(frame)
+        if expected is not None:
+            actual = frame_checksum(chip8)
+            if actual != expected:
+                return ReplayResult(scheduler.frame_count, scheduler.cycle_count, time.perf_counter() - start,
+                                    frame, expected, actual)
+
+    return ReplayResult(scheduler.frame_count, scheduler.cycle_count, time.perf_counter() - start)
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay an input movie headless')
+    parser.add_argument('movie')
+    parser.add_argument('rom')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='translator')
+    args = parser.parse_args(argv)
+
+    result = replay(InputMovie.load(Path(args.movie)), Path(args.rom).read_bytes(), args.engine)
+    print(f'{result.frames} frames, {result.cycles} cycles in {result.elapsed * 1000:.1f} ms')
+    if result.diverged_frame is not None:
+        print(f'Diverged at frame {result.diverged_frame}: '
+              f'expected {result.expected_checksum:08x}, got {result.actual_checksum:08x}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import argparse
+import json
+from collections import Counter
+from pathlib import Path
+from time import perf_counter_ns
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Text,
+    Tuple
+)
+
+from chip8 import Chip8, CHIP8, PROFILES, QuirkProfile, SYSTEM_MEMORY
+from library import rom_profile
+from runner import load_inputs
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME
+
+
+def _frame_name(addr: int) -> Text:
+    return f'sub_{addr:03x}'
+
+
+class Profiler:
+    """
+    Execution engine counting where the cycles go: per handler family, per pc
+    address and per subroutine call stack, plus the time spent in each handler.
+    It runs its own instrumented loop, so Chip8.run pays nothing for it.
+    """
+
+    def __init__(self, chip8: Chip8, clock: Callable[[], int] = perf_counter_ns):
+        self.chip8 = chip8
+        self.clock = clock
+        self.reset()
+
+    def reset(self) -> NoReturn:
+        self.cycles = 0
+        self.family_counts: Counter = Counter()
+        # nanoseconds spent in each handler
+        self.family_time: Counter = Counter()
+        self.pc_counts = [0] * SYSTEM_MEMORY
+        # subroutine entries, outermost first -> cycles run with that call stack
+        self.stacks: Counter = Counter()
+        self._stack: Tuple[int, ...] = (self.chip8.quirks.load_address,)
+
+    def run(self, cycles: int) -> int:
+        """
+        Execute cycles through the interpreter handlers, recording every one
+        :param cycles: Number of instructions to execute
+        :return: Number of instructions executed
+        """
+        chip8 = self.chip8
+        memory = chip8.memory
+        dispatch = chip8._dispatch
+        decode_miss = Chip8._decode_miss
+        clock = self.clock
+        family_counts = self.family_counts
+        family_time = self.family_time
+        pc_counts = self.pc_counts
+        stacks = self.stacks
+        stack = self._stack
+
+        for _ in range(cycles):
+            pc = chip8.pc
+            opcode = memory[pc] << 8 | memory[pc + 1]
+            handler, args = dispatch[opcode]
+            if handler is decode_miss:
+                # resolved here rather than on its first run, so the family is the handler of the profile
+                handler, args = dispatch[opcode] = chip8.resolve(opcode)
+            name = handler.__name__
+            if chip8.trace is not None:
+                chip8.trace(pc, opcode)
+
+            start = clock()
+            handler(chip8, *args)
+            family_time[name] += clock() - start
+
+            family_counts[name] += 1
+            pc_counts[pc] += 1
+            stacks[stack] += 1
+            if name == 'call_subroutine_2nnn':
+                stack += (args[0],)
+            elif name == 'return_subroutine_00ee' and len(stack) > 1:
+                stack = stack[:-1]
+
+            if not chip8.halt_execution and chip8.pc + 2 < SYSTEM_MEMORY:
+                chip8.pc += 2
+
+        self._stack = stack
+        self.cycles += cycles
+        return cycles
+
+    def hot_addresses(self, top: int = 20) -> List[Tuple[int, int]]:
+        """
+        :return: (pc, count) of the most executed addresses
+        """
+        counts = [(pc, count) for pc, count in enumerate(self.pc_counts) if count]
+        return sorted(counts, key=lambda item: item[1], reverse=True)[:top]
+
+    def collapsed_stacks(self) -> List[Text]:
+        """
+        Call stacks in the collapsed format read by flamegraph.pl and speedscope,
+        weighted by cycles
+        """
+        return [f'{";".join(map(_frame_name, stack))} {count}' for stack, count in sorted(self.stacks.items())]
+
+    def summary(self, top: int = 20) -> Dict:
+        families = {}
+        for name, count in self.family_counts.most_common():
+            elapsed = self.family_time[name]
+            families[name] = {'count': count, 'share': count / self.cycles, 'time_ns': elapsed,
+                              'ns_per_op': elapsed / count}
+        return {
+            'cycles': self.cycles,
+            'families': families,
+            'hot_addresses': [{'pc': hex(pc), 'count': count} for pc, count in self.hot_addresses(top)],
+        }
+
+    def write(self, stem: Path) -> NoReturn:
+        """
+        Write <stem>.folded flamegraph input and a <stem>.json summary
+        """
+        stem.with_name(stem.name + '.folded').write_text('\n'.join(self.collapsed_stacks()) + '\n')
+        with open(stem.with_name(stem.name + '.json'), 'w') as output:
+            json.dump(self.summary(), output, indent=2)
+
+
+def profile_rom(rom: bytes, frames: int, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME,
+                inputs: Optional[Dict[int, Text]] = None, seed: Optional[int] = None,
+                quirks: QuirkProfile = CHIP8) -> Profiler:
+    chip8 = Chip8(seed, quirks)
+    chip8.initialize()
+    chip8.load_rom(rom)
+    profiler = Profiler(chip8)
+    scheduler = FrameScheduler(chip8, profiler, cycles_per_frame)
+    inputs = inputs or {}
+
+    for frame in range(frames):
+        if frame in inputs:
+            chip8.key_press(inputs[frame])
+        scheduler.run_frame()
+
+    return profiler
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Profile where roms spend their cycles')
+    parser.add_argument('roms', nargs='*', help='roms to profile, every .ch8 in --roms-dir by default')
+    parser.add_argument('--roms-dir', default='ROMs')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--inputs', default=None, help='json input script of [frame, keys] events')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8')
+    parser.add_argument('--output-dir', default='profiles')
+    parser.add_argument('--top', type=int, default=5, help='families printed per rom')
+    args = parser.parse_args(argv)
+
+    roms = [Path(rom) for rom in args.roms] or sorted(Path(args.roms_dir).glob('*.ch8'))
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    inputs = load_inputs(args.inputs)
+
+    for rom in roms:
+        profiler = profile_rom(rom.read_bytes(), args.frames, args.cycles_per_frame, inputs, args.seed,
+                               rom_profile(rom, PROFILES[args.quirks]))
+        profiler.write(output_dir / rom.stem)
+        families = ', '.join(f'{name} {count / profiler.cycles:.0%}'
+                             for name, count in profiler.family_counts.most_common(args.top))
+        print(f'{rom.stem}: {families}')
+
+
+if __name__ == '__main__':
+    main()
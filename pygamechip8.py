@@ -1,6 +1,8 @@
 import pygame as pg
 from pygame import Surface
 from pathlib import Path
+from random import randrange
+from typing import TYPE_CHECKING, Optional
 
 from chip8 import (
     Chip8,
@@ -19,20 +21,56 @@ from chip8 import (
     KEY_C,
     KEY_D,
     KEY_E,
-    KEY_F
+    KEY_F,
+    KEY_BITS
 )
+from library import RomLibrary
+from renderer import DirtyRectRenderer, BACKGROUND_COLOR
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME
 from utils import center_pygame_windows
 
+if TYPE_CHECKING:
+    # imported when recording or threaded, movie brings the headless runner along
+    from movie import MovieRecorder
+    from threaded import EmulationThread
+
+# host key -> keypad bit, laid out like the original 4x4 keypad
+KEY_TABLE = {
+    pg.K_1: KEY_BITS[KEY_1], pg.K_2: KEY_BITS[KEY_2], pg.K_3: KEY_BITS[KEY_3], pg.K_4: KEY_BITS[KEY_C],
+    pg.K_q: KEY_BITS[KEY_4], pg.K_w: KEY_BITS[KEY_5], pg.K_e: KEY_BITS[KEY_6], pg.K_r: KEY_BITS[KEY_D],
+    pg.K_a: KEY_BITS[KEY_7], pg.K_s: KEY_BITS[KEY_8], pg.K_d: KEY_BITS[KEY_9], pg.K_f: KEY_BITS[KEY_E],
+    pg.K_z: KEY_BITS[KEY_A], pg.K_x: KEY_BITS[KEY_0], pg.K_c: KEY_BITS[KEY_B], pg.K_v: KEY_BITS[KEY_F],
+}
+
 
 class PyGameChip8:
-    def __init__(self):
-        self._chip8: Chip8 = Chip8()
+    def __init__(self, cycles_per_frame: Optional[int] = DEFAULT_CYCLES_PER_FRAME, seed: Optional[int] = None,
+                 record: Optional[str] = None, threaded: bool = False):
+        """
+        :param cycles_per_frame: Cpu cycles per 60 Hz frame
+        :param seed: Seed of the machine random generator
+        :param record: Path to save an input movie of the session to
+        :param threaded: Emulate on a worker thread, this one only handles input and drawing
+        """
+        if seed is None and record is not None:
+            seed = randrange(1 << 32)
+        self._seed = seed
+        self._record = record
+        self._recorder: Optional['MovieRecorder'] = None
+        self._threaded = threaded
+        self._worker: Optional['EmulationThread'] = None
+        # keypad state of the held host keys
+        self._keys_held = 0
+        self._chip8: Chip8 = Chip8(seed)
+        # idle loops end the frame early, so the host sleeps instead of spinning on them
+        self._scheduler: FrameScheduler = FrameScheduler(self._chip8, cycles_per_frame=cycles_per_frame,
+                                                         skip_idle=True)
         self._width: int = 64
         self._height: int = 32
         self._pixel_size: int = 10
         self._border_size: int = 1
         self._screen: Surface
-        self.instruction_count = 0
+        self._renderer: DirtyRectRenderer
         self.beep_sound = None
         self.sound_playing = False
 
@@ -44,7 +82,10 @@ class PyGameChip8:
         self.__initialize(game)
 
     def run(self):
-        main_clock = pg.time.Clock()
+        if self._threaded:
+            from threaded import EmulationThread
+            self._worker = EmulationThread(self._scheduler, self.__apply_keys)
+            self._worker.start()
 
         try:
             running = True
@@ -55,56 +96,78 @@ class PyGameChip8:
                         running = False
                         break
                     if event.type == pg.KEYDOWN:
-                        self.__handle_input(event.key)
+                        self.__handle_input(event.key, True)
                     if event.type == pg.KEYUP:
-                        self._chip8.key_pressed = ''
-
-                self.__tick()
-                if self.instruction_count == 8:
-                    pg.time.wait(3)
-                    self.__update_timers()
-                    self.instruction_count = 0
+                        self.__handle_input(event.key, False)
 
-                main_clock.tick(500)
+                if running:
+                    self.__tick()
 
         except KeyboardInterrupt:
             pass
 
+        if self._worker is not None:
+            self._worker.stop()
+        if self._recorder is not None:
+            self._recorder.movie.save(Path(self._record))
+
     def __tick(self):
-        self._chip8.emulate_cycle()
-        self.instruction_count += 1
-
-        if self._chip8.draw_flag:
-            self.__draw(self._chip8.gfx)
-            pg.display.flip()
-            self._chip8.draw_flag = False
-
-    def __draw(self, frame):
-        for row, pixels in enumerate(frame, 0):
-            for col, pixel in enumerate(pixels, 0):
-                rect = self.__get_rect_pos(col, row)
-
-                if pixel:
-                    pg.draw.rect(self._screen, pg.Color('white'), pg.Rect(*rect))
-                else:
-                    pg.draw.rect(self._screen, pg.Color('black'), pg.Rect(*rect))
-
-    def __handle_input(self, key_id: int):
-        if self._chip8.key_pressed == '':
-            keymap = {
-                pg.K_1: KEY_1, pg.K_2: KEY_2, pg.K_3: KEY_3, pg.K_4: KEY_C,
-                pg.K_q: KEY_4, pg.K_w: KEY_5, pg.K_e: KEY_6, pg.K_r: KEY_D,
-                pg.K_a: KEY_7, pg.K_s: KEY_8, pg.K_d: KEY_9, pg.K_f: KEY_E,
-                pg.K_z: KEY_A, pg.K_x: KEY_0, pg.K_c: KEY_B, pg.K_v: KEY_F,
-            }
-
-            key = keymap.get(key_id)
-            if id:
-                self._chip8.key_press(key)
-
-    def __update_timers(self):
-        if self._chip8.sound_reg > 0:
-            self._chip8.sound_reg -= 1
+        if self._worker is not None:
+            self.__present()
+            return
+
+        if self._scheduler.advance():
+            self.__update_sound()
+
+            # draw at most once per advance, however many frames were emulated
+            if self._chip8.draw_flag:
+                dirty_rects = self.__draw()
+                if dirty_rects:
+                    pg.display.update(dirty_rects)
+                self._chip8.draw_flag = False
+
+        wait = self._scheduler.time_until_next_frame()
+        if wait > 0:
+            pg.time.wait(int(wait * 1000))
+
+    def __present(self):
+        # the worker paces the frames, waiting for one keeps input polling responsive
+        frame = self._worker.latest_frame(timeout=self._scheduler.frame_period)
+        if frame is None:
+            return
+
+        self.__set_sound(frame.sound)
+        dirty_rects = self._renderer.render(frame)
+        if dirty_rects:
+            pg.display.update(dirty_rects)
+
+    def __draw(self):
+        return self._renderer.render(self._chip8)
+
+    def __handle_input(self, key_id: int, down: bool):
+        bit = KEY_TABLE.get(key_id)
+        if bit is None:
+            return
+
+        keys = self._keys_held | bit if down else self._keys_held & ~bit
+        if keys != self._keys_held:
+            self._keys_held = keys
+            if self._worker is not None:
+                self._worker.set_keys(keys)
+            else:
+                self.__apply_keys(keys)
+
+    def __apply_keys(self, keys: int):
+        if self._recorder is not None:
+            self._recorder.set_keys(keys)
+        else:
+            self._chip8.set_keys(keys)
+
+    def __update_sound(self):
+        self.__set_sound(self._chip8.sound_reg > 0)
+
+    def __set_sound(self, sound: bool):
+        if sound:
             if not self.sound_playing:
                 self.sound_playing = True
                 self.beep_sound.play()
@@ -113,39 +176,33 @@ class PyGameChip8:
                 self.beep_sound.stop()
                 self.sound_playing = False
 
-        if self._chip8.delay_reg > 0:
-            self._chip8.delay_reg -= 1
-
     def __initialize(self, game: str):
         self._chip8.initialize()
-        rom = Path('ROMs', game)
-        self._chip8.load_game(rom)
+        library = RomLibrary()
+        rom = library.load(self._chip8, game)
+        print(f"{rom.title}: {rom.size} bytes")
+        if self._record is not None:
+            from movie import MovieRecorder
+            self._recorder = MovieRecorder(self._scheduler, library.image(rom.sha1), self._seed)
 
     def __init_screen(self):
         # background
-        self._screen.fill((35, 35, 35))
+        self._screen.fill(BACKGROUND_COLOR)
 
-        # tiles
-        for row in range(self._height):
-            for col in range(self._width):
-                rect = self.__get_rect_pos(col, row)
-                pg.draw.rect(self._screen, pg.Color('black'), pg.Rect(*rect))
+        # tiles, the framebuffer starts fully dirty
+        self._renderer = DirtyRectRenderer(self._screen, self._width, self._height,
+                                           self._pixel_size, self._border_size)
+        self.__draw()
+        pg.display.flip()
 
     def __create_windows(self):
         screen_width = self._width * self._pixel_size + (self._width - self._border_size)
         screen_height = self._height * self._pixel_size + (self._height - self._border_size)
+        pg.init()
         # workaround to get pygame window at center of main display
         center_pygame_windows(screen_width, screen_height)
-        pg.init()
         self._screen = pg.display.set_mode((screen_width, screen_height))
 
-    def __get_rect_pos(self, col, row):
-        x1 = col * self._pixel_size + col
-        y1 = row * self._pixel_size + row
-        w = self._pixel_size - self._border_size
-        h = w
-        return x1, y1, w, h
-
 
 if __name__ == '__main__':
     pyg_chip8 = PyGameChip8()
@@ -0,0 +1,115 @@
+from typing import (
+    List,
+    Tuple
+)
+
+import pygame as pg
+from pygame import Surface
+
+from chip8 import Chip8
+
+BACKGROUND_COLOR = (35, 35, 35)
+# color of the transparent cells in the grid overlay
+CELL_KEY_COLOR = (255, 0, 255)
+
+
+class DirtyRectRenderer:
+    """
+    Draws only the framebuffer rows and columns changed since the last call.
+    Pixels are kept in a 1:1 surface and the dirty region is scaled up to the
+    screen, then the grid overlay separates the cells again. A SUPER-CHIP high
+    resolution framebuffer is drawn at half the cell size, without the grid.
+    """
+
+    def __init__(self, screen: Surface, width: int, height: int, pixel_size: int, border_size: int):
+        self._screen = screen
+        self._base_height = height
+        self._base_stride = pixel_size + 1
+        self._on = pg.Color('white')
+        self._off = pg.Color('black')
+        self._base_grid = self.__create_grid(width, height, pixel_size - border_size)
+        self.__set_resolution(width, height)
+
+    def __set_resolution(self, width: int, height: int):
+        self._width = width
+        self._height = height
+        self._frame = Surface((width, height))
+        # cells are scaled to this many screen pixels, fractional in high resolution
+        self._stride = self._base_stride * self._base_height / height
+        self._grid = self._base_grid if height == self._base_height else None
+
+    def render(self, chip8: Chip8) -> List[pg.Rect]:
+        """
+        Draw the dirty region of the framebuffer and clear the dirty masks
+        :return: Screen rects to pass to pg.display.update
+        """
+        dirty_rows = chip8.dirty_rows
+        dirty_cols = chip8.dirty_cols
+        chip8.dirty_rows = 0
+        chip8.dirty_cols = 0
+        if not dirty_rows or not dirty_cols:
+            return []
+
+        # the width always is twice the number of rows
+        height = len(chip8.gfx)
+        if height != self._height:
+            self.__set_resolution(2 * height, height)
+            self._screen.fill(BACKGROUND_COLOR)
+
+        # column span, bit (width - 1 - col) belongs to col
+        first_col = self._width - dirty_cols.bit_length()
+        last_col = self._width - 1 - ((dirty_cols & -dirty_cols).bit_length() - 1)
+
+        rects = []
+        for first_row, last_row in self.__row_runs(dirty_rows):
+            for row in range(first_row, last_row + 1):
+                self.__draw_row(chip8.gfx[row], row, first_col, last_col)
+            rects.append(self.__blit((first_col, first_row,
+                                      last_col - first_col + 1, last_row - first_row + 1)))
+
+        return rects
+
+    def __draw_row(self, pixels: int, row: int, first_col: int, last_col: int):
+        frame = self._frame
+        frame.fill(self._off, (first_col, row, last_col - first_col + 1, 1))
+        for col in range(first_col, last_col + 1):
+            if pixels >> (self._width - 1 - col) & 1:
+                frame.set_at((col, row), self._on)
+
+    def __blit(self, area: Tuple[int, int, int, int]) -> pg.Rect:
+        col, row, w, h = area
+        stride = self._stride
+        left = round(col * stride)
+        top = round(row * stride)
+        dest = pg.Rect(left, top, round((col + w) * stride) - left, round((row + h) * stride) - top)
+        scaled = pg.transform.scale(self._frame.subsurface(area), dest.size)
+        self._screen.blit(scaled, dest)
+        if self._grid is not None:
+            self._screen.blit(self._grid, dest, dest)
+        return dest
+
+    def __create_grid(self, width: int, height: int, cell_size: int) -> Surface:
+        grid = Surface(self._screen.get_size())
+        grid.fill(BACKGROUND_COLOR)
+        stride = self._base_stride
+        for row in range(height):
+            for col in range(width):
+                grid.fill(CELL_KEY_COLOR, (col * stride, row * stride, cell_size, cell_size))
+        grid.set_colorkey(CELL_KEY_COLOR)
+        return grid
+
+    @staticmethod
+    def __row_runs(dirty_rows: int) -> List[Tuple[int, int]]:
+        runs = []
+        row = 0
+        while dirty_rows:
+            if dirty_rows & 1:
+                first = row
+                while dirty_rows & 1:
+                    dirty_rows >>= 1
+                    row += 1
+                runs.append((first, row - 1))
+            else:
+                dirty_rows >>= 1
+                row += 1
+        return runs
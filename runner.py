@@ -0,0 +1,145 @@
+import argparse
+import csv
+import hashlib
+import json
+import sys
+import time
+from itertools import product
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Text
+)
+
+from chip8 import Chip8, PROFILES
+from library import rom_profile
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME
+from translator import BlockTranslator
+
+ENGINES = {
+    'interpreter': lambda chip8: chip8,
+    'translator': BlockTranslator,
+}
+
+REPORT_FIELDS = ['rom', 'seed', 'inputs', 'engine', 'frames', 'cycles', 'idle_cycles', 'frame_hash',
+                 'elapsed', 'instructions_per_second', 'error']
+
+
+class Job(NamedTuple):
+    rom: Text
+    seed: Optional[int] = None
+    # json list of [frame, keys] events holding exactly the named keys from that frame on,
+    # '15' holds 1 and 5 together and '' releases every key
+    inputs: Optional[Text] = None
+    frames: int = 600
+    cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME
+    # short jobs never amortise the translator's compile cost
+    engine: Text = 'interpreter'
+    # fast-forward idle loops, the results are the same
+    skip_idle: bool = False
+    # name of the quirk profile the roms.json quirks of the rom apply to
+    quirks: Text = 'chip8'
+
+
+def load_inputs(path: Optional[Text]) -> Dict[int, Text]:
+    if path is None:
+        return {}
+    with open(path) as inputs_file:
+        return {int(frame): keys for frame, keys in json.load(inputs_file)}
+
+
+def run_job(job: Job) -> Dict:
+    """
+    Run a rom headless for a fixed number of frames
+    :return: Report row for the job
+    """
+    result = dict(rom=Path(job.rom).name, seed=job.seed, inputs=job.inputs, engine=job.engine,
+                  frames=0, cycles=0, idle_cycles=0, frame_hash=None, elapsed=0.0, instructions_per_second=0.0, error=None)
+    try:
+        inputs = load_inputs(job.inputs)
+        chip8 = Chip8(job.seed, rom_profile(Path(job.rom), PROFILES[job.quirks]))
+        chip8.initialize()
+        chip8.load_rom(Path(job.rom).read_bytes())
+        scheduler = FrameScheduler(chip8, ENGINES[job.engine](chip8), job.cycles_per_frame,
+                                   skip_idle=job.skip_idle)
+
+        start = time.perf_counter()
+        for frame in range(job.frames):
+            if frame in inputs:
+                chip8.key_press(inputs[frame])
+            scheduler.run_frame()
+        elapsed = time.perf_counter() - start
+
+        result.update(frames=scheduler.frame_count, cycles=scheduler.cycle_count, idle_cycles=scheduler.idle_cycles,
+                      frame_hash=hashlib.sha1(chip8.frame_bytes()).hexdigest(), elapsed=elapsed,
+                      instructions_per_second=scheduler.cycle_count / elapsed if elapsed else 0.0)
+    except Exception as error:
+        result['error'] = f'{type(error).__name__}: {error}'
+
+    return result
+
+
+def run_all(jobs: Iterable[Job], workers: Optional[int] = None) -> List[Dict]:
+    """
+    Fan the jobs out across a process pool, results keep the jobs order
+    :param workers: Number of processes, all the cores by default
+    """
+    # multiprocessing is a third of the import time of this module, single jobs never need it
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def write_report(results: List[Dict], output: Optional[Text]) -> None:
+    """
+    Write results as csv when the output ends with .csv, json otherwise
+    :param output: Report path, stdout when None
+    """
+    out = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        if output and output.endswith('.csv'):
+            writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, out, indent=2)
+            out.write('\n')
+    finally:
+        if output:
+            out.close()
+
+
+def find_roms(paths: List[Text], roms_dir: Text) -> List[Text]:
+    if paths:
+        return paths
+    return [str(rom) for rom in sorted(Path(roms_dir).glob('*.ch8'))]
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Run roms headless across a process pool')
+    parser.add_argument('roms', nargs='*', help='roms to run, every .ch8 in --roms-dir by default')
+    parser.add_argument('--roms-dir', default='ROMs')
+    parser.add_argument('--frames', type=int, default=600, help='60 Hz frames to run each rom for')
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    parser.add_argument('--seeds', type=int, nargs='*', default=[None])
+    parser.add_argument('--inputs', nargs='*', default=[None], help='json input scripts of [frame, keys] events')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='interpreter')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8')
+    parser.add_argument('--skip-idle', action='store_true', help='fast-forward key waits and timer polls')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', '-o', default=None, help='report path, .csv or .json')
+    args = parser.parse_args(argv)
+
+    jobs = [Job(rom, seed, inputs, args.frames, args.cycles_per_frame, args.engine, args.skip_idle,
+                args.quirks)
+            for rom, seed, inputs in product(find_roms(args.roms, args.roms_dir), args.seeds, args.inputs)]
+    write_report(run_all(jobs, args.workers), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+from time import perf_counter
+from typing import (
+    Callable,
+    List,
+    NoReturn,
+    Optional
+)
+
+from chip8 import Chip8
+
+FRAME_RATE = 60
+DEFAULT_CYCLES_PER_FRAME = 8
+# run as many cycles as the host allows within each frame
+UNLIMITED = None
+# cycles executed between clock checks when the cpu rate is unlimited
+UNLIMITED_CHUNK = 256
+DEFAULT_MAX_CATCH_UP = 4
+
+# called with the machine and the index of the frame that just finished
+FrameListener = Callable[[Chip8, int], None]
+
+
+class FrameScheduler:
+    """
+    Runs a fixed number of cpu cycles per 60 Hz frame, ticks the timers exactly
+    once per frame and leaves drawing to the front end, at most once per advance.
+    When the host falls behind, up to max_catch_up frames are emulated back to back
+    and any frame beyond that is skipped.
+    """
+
+    def __init__(self, chip8: Chip8, engine=None, cycles_per_frame: Optional[int] = DEFAULT_CYCLES_PER_FRAME,
+                 frame_rate: int = FRAME_RATE, max_catch_up: int = DEFAULT_MAX_CATCH_UP,
+                 clock: Callable[[], float] = perf_counter, skip_idle: bool = False):
+        """
+        :param chip8: Machine whose timers are ticked
+        :param engine: Anything with run(cycles), the chip8 interpreter by default
+        :param cycles_per_frame: Cpu cycles per frame, UNLIMITED to use the whole frame time
+        :param frame_rate: Frames per second
+        :param max_catch_up: Most frames emulated in a single advance
+        :param clock: Monotonic clock in seconds
+        :param skip_idle: Fast-forward the idle loops (key waits, timer polls) to the end of the frame
+        """
+        self.chip8 = chip8
+        self.engine = engine if engine is not None else chip8
+        self.cycles_per_frame = cycles_per_frame
+        self.frame_period = 1 / frame_rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.frame_count = 0
+        self.cycle_count = 0
+        self.skipped_frames = 0
+        self.skip_idle = skip_idle
+        # cycles fast-forwarded through idle loops, included in cycle_count
+        self.idle_cycles = 0
+        # whether the last frame ended in an idle loop
+        self.idle = False
+        self.frame_listeners: List[FrameListener] = []
+        self._next_frame: Optional[float] = None
+
+    def run_frame(self, deadline: Optional[float] = None) -> NoReturn:
+        """
+        Emulate a single frame: the cpu cycles followed by a timers tick
+        :param deadline: Clock time to stop at when the cpu rate is unlimited
+        """
+        if self.cycles_per_frame is UNLIMITED:
+            if deadline is None:
+                raise ValueError("An unlimited cpu rate needs a frame deadline")
+            # at least one chunk, so frames caught up late still make progress
+            self.run_cycles(UNLIMITED_CHUNK)
+            # an idle machine has nothing left to do until the timers tick
+            while not self.idle and self.clock() < deadline:
+                self.run_cycles(UNLIMITED_CHUNK)
+        else:
+            self.run_cycles(self.cycles_per_frame)
+
+        self.chip8.tick_timers()
+        for listener in self.frame_listeners:
+            listener(self.chip8, self.frame_count)
+        self.frame_count += 1
+
+    def run_cycles(self, cycles: int) -> int:
+        """
+        Emulate cpu cycles without ticking the timers, idle loops are skipped when enabled
+        :return: Number of cpu cycles executed
+        """
+        executed = self._execute(cycles)
+        self.cycle_count += executed
+        return executed
+
+    def _execute(self, cycles: int) -> int:
+        if not self.skip_idle:
+            return self.engine.run(cycles)
+
+        chip8 = self.chip8
+        executed = 0
+        to_head, length = chip8.idle_loop()
+        if length and to_head:
+            executed = self.engine.run(min(to_head, cycles))
+        skipped = chip8.skip_idle(cycles - executed)
+        self.idle_cycles += skipped
+        self.idle = skipped > 0
+        executed += skipped
+        if executed < cycles:
+            executed += self.engine.run(cycles - executed)
+        return executed
+
+    def run_frames(self, frames: int) -> int:
+        """
+        Emulate frames as fast as possible, independent of the clock
+        :param frames: Number of frames to emulate
+        :return: Number of cpu cycles executed
+        """
+        if self.cycles_per_frame is UNLIMITED:
+            raise ValueError("Headless frames need a fixed number of cycles per frame")
+
+        start = self.cycle_count
+        for _ in range(frames):
+            self.run_frame()
+        return self.cycle_count - start
+
+    def advance(self) -> int:
+        """
+        Emulate every frame due by the clock
+        :return: Number of frames emulated
+        """
+        now = self.clock()
+        if self._next_frame is None:
+            self._next_frame = now
+        if now < self._next_frame:
+            return 0
+
+        due = int((now - self._next_frame) / self.frame_period) + 1
+        frames = min(due, self.max_catch_up)
+        for frame in range(frames):
+            self.run_frame(self._next_frame + (frame + 1) * self.frame_period)
+
+        # frame skip: drop whatever could not be caught up
+        self.skipped_frames += due - frames
+        self._next_frame += due * self.frame_period
+        return frames
+
+    def time_until_next_frame(self) -> float:
+        if self._next_frame is None:
+            return 0.0
+        return max(0.0, self._next_frame - self.clock())
@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import struct
+import zlib
+from typing import (
+    List,
+    NoReturn,
+    Optional,
+    Set,
+    Text,
+    Tuple
+)
+
+from chip8 import (
+    Chip8,
+    BLANK_FRAME,
+    CHIP8,
+    ETI660,
+    KEYPAD,
+    MIN_PROGRAM_ADDR,
+    SCHIP,
+    SYSTEM_MEMORY,
+    XOCHIP,
+    QuirkProfile
+)
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME, FRAME_RATE
+
+# every message is a big endian payload length and a message type, then the payload
+MESSAGE_HEADER = struct.Struct('>IB')
+# client -> server: flags byte, quirk profile byte indexing LOAD_PROFILES, then the rom image
+MSG_LOAD = 0x01
+# client -> server: ascii names of the held keys, empty to release them all
+MSG_KEY = 0x02
+# server -> client: frame index, screen rows, changed rows bitmask, then each changed row XOR
+# the previous one. The screen is twice as wide as high and starts blank on a resolution change.
+MSG_FRAME = 0x81
+# server -> client: MSG_FRAME payload, zlib compressed
+MSG_FRAME_ZLIB = 0x82
+# server -> client: utf-8 error description
+MSG_ERROR = 0xFF
+
+FLAG_ZLIB = 0x01
+# part of the protocol, new profiles only go at the end
+LOAD_PROFILES = (CHIP8, SCHIP, XOCHIP, ETI660)
+FRAME_HEADER = struct.Struct('>IBQ')
+MAX_PAYLOAD = 2 + SYSTEM_MEMORY - MIN_PROGRAM_ADDR
+# frames are not sent to clients with more than this many bytes waiting,
+# the next frame sent covers every change since the last one they got
+MAX_BUFFERED = 64 * 1024
+
+
+def encode_message(kind: int, payload: bytes = b'') -> bytes:
+    return MESSAGE_HEADER.pack(len(payload), kind) + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    length, kind = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ValueError(f"Message of {length} bytes is too large")
+    return kind, await reader.readexactly(length)
+
+
+def encode_frame(index: int, previous: List[int], current: List[int]) -> Optional[bytes]:
+    """
+    :return: MSG_FRAME payload turning previous into current, None when nothing changed
+    """
+    height = len(current)
+    if len(previous) != height:
+        previous = [0] * height
+    row_size = height // 4
+    rows = 0
+    deltas = []
+    for row, (old, new) in enumerate(zip(previous, current)):
+        if old != new:
+            rows |= 1 << row
+            deltas.append((old ^ new).to_bytes(row_size, 'big'))
+    if not rows:
+        return None
+    return FRAME_HEADER.pack(index, height, rows) + b''.join(deltas)
+
+
+def apply_frame(gfx: List[int], payload: bytes) -> int:
+    """
+    Client side of encode_frame, updates gfx in place
+    :return: Frame index
+    """
+    index, height, rows = FRAME_HEADER.unpack_from(payload)
+    if len(gfx) != height:
+        gfx[:] = [0] * height
+    row_size = height // 4
+    offset = FRAME_HEADER.size
+    row = 0
+    while rows:
+        if rows & 1:
+            gfx[row] ^= int.from_bytes(payload[offset: offset + row_size], 'big')
+            offset += row_size
+        rows >>= 1
+        row += 1
+    return index
+
+
+class Session:
+    """
+    A client connection and the machine it drives
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.chip8: Optional[Chip8] = None
+        self.scheduler: Optional[FrameScheduler] = None
+        self.compress = False
+        # framebuffer as last sent to the client
+        self.sent: List[int] = BLANK_FRAME.copy()
+
+    def load(self, rom: bytes, compress: bool, cycles_per_frame: int, quirks: QuirkProfile = CHIP8) -> NoReturn:
+        chip8 = Chip8(quirks=quirks)
+        chip8.initialize()
+        chip8.load_rom(rom)
+        self.chip8 = chip8
+        self.scheduler = FrameScheduler(chip8, chip8, cycles_per_frame, skip_idle=True)
+        self.compress = compress
+        self.sent = BLANK_FRAME.copy()
+
+    def send_error(self, message: Text) -> NoReturn:
+        self.writer.write(encode_message(MSG_ERROR, message.encode()))
+
+    def step(self) -> NoReturn:
+        """
+        Emulate one frame and send what changed on screen
+        """
+        self.scheduler.run_frame()
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            return
+
+        gfx = self.chip8.gfx
+        payload = encode_frame(self.scheduler.frame_count, self.sent, gfx)
+        if payload is None:
+            return
+        self.sent[:] = gfx
+        if self.compress:
+            self.writer.write(encode_message(MSG_FRAME_ZLIB, zlib.compress(payload)))
+        else:
+            self.writer.write(encode_message(MSG_FRAME, payload))
+
+
+class EmulationServer:
+    """
+    Hosts one machine per TCP connection, all stepped by a single 60 Hz task
+    """
+
+    def __init__(self, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME, frame_rate: int = FRAME_RATE):
+        self.cycles_per_frame = cycles_per_frame
+        self.frame_period = 1 / frame_rate
+        self.sessions: Set[Session] = set()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> NoReturn:
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_LOAD and len(payload) >= 2:
+                    try:
+                        if payload[1] >= len(LOAD_PROFILES):
+                            raise ValueError(f"Unknown quirk profile {payload[1]}")
+                        session.load(payload[2:], bool(payload[0] & FLAG_ZLIB), self.cycles_per_frame,
+                                     LOAD_PROFILES[payload[1]])
+                    except ValueError as error:
+                        session.send_error(str(error))
+                elif kind == MSG_KEY:
+                    keys = payload.decode('ascii', 'replace')
+                    unknown = ''.join(key for key in keys if key not in KEYPAD)
+                    if session.chip8 is None:
+                        session.send_error("No rom loaded")
+                    elif unknown:
+                        session.send_error(f"Unknown key {unknown!r}")
+                    else:
+                        session.chip8.key_press(keys)
+                else:
+                    session.send_error(f"Unknown message type {kind:#x}")
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def tick(self) -> NoReturn:
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            for session in list(self.sessions):
+                if session.scheduler is None:
+                    continue
+                try:
+                    session.step()
+                except Exception as error:
+                    # one crashing rom must not stop the other sessions
+                    session.scheduler = None
+                    session.send_error(f'{type(error).__name__}: {error}')
+
+            # fixed cadence, a late frame does not push the following ones back
+            next_frame += self.frame_period
+            delay = next_frame - loop.time()
+            if delay < 0:
+                next_frame = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def serve(self, host: Text, port: int) -> NoReturn:
+        server = await asyncio.start_server(self.handle, host, port)
+        ticker = asyncio.ensure_future(self.tick())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticker.cancel()
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Serve Chip8 sessions over TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(EmulationServer(args.cycles_per_frame).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
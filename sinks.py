@@ -0,0 +1,417 @@
+import argparse
+import hashlib
+from abc import ABC, abstractmethod
+import struct
+import threading
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from queue import SimpleQueue
+from typing import (
+    BinaryIO,
+    List,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Text,
+    TextIO
+)
+
+from chip8 import Chip8, PROFILES, SCREEN_HEIGHT, SCREEN_WIDTH
+from library import rom_profile
+from runner import ENGINES, load_inputs
+from scheduler import FrameScheduler, DEFAULT_CYCLES_PER_FRAME, FRAME_RATE
+
+# frame index, width, height, then the frame packed one bit per pixel
+RAW_RECORD = struct.Struct('>IHH')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# (red, green, blue) of the off and on pixels, as the pygame window draws them
+PALETTE = bytes([0, 0, 0, 255, 255, 255])
+GIF_CODE_SIZE = 2
+GIF_MAX_CODES = 4096
+
+
+class Frame(NamedTuple):
+    index: int
+    width: int
+    height: int
+    # Chip8.frame_bytes, rows of width // 8 bytes
+    pixels: bytes
+
+
+class FrameSink(ABC):
+    """
+    Consumer of the emulated frames, called on the pipeline writer thread
+    """
+
+    @abstractmethod
+    def write(self, frame: Frame) -> NoReturn:
+        pass
+
+    def close(self) -> NoReturn:
+        pass
+
+
+class SinkPipeline:
+    """
+    Feeds every frame a scheduler runs to a list of sinks on a background thread.
+    The emulation thread only packs the framebuffer and queues it, so it never
+    waits on encoding or disk; the queue grows while the sinks are behind.
+    """
+
+    def __init__(self, sinks: List[FrameSink]):
+        self.sinks = sinks
+        self._frames: SimpleQueue = SimpleQueue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_frames, name='chip8-sinks', daemon=True)
+        self._thread.start()
+
+    def attach(self, scheduler: FrameScheduler) -> 'SinkPipeline':
+        scheduler.frame_listeners.append(self.on_frame)
+        return self
+
+    def on_frame(self, chip8: Chip8, index: int) -> NoReturn:
+        self._frames.put(Frame(index, chip8.screen_width, chip8.screen_height, chip8.frame_bytes()))
+
+    def close(self) -> NoReturn:
+        """
+        Write the queued frames, close the sinks and raise the first error one of them hit
+        """
+        self._frames.put(None)
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> 'SinkPipeline':
+        return self
+
+    def __exit__(self, *exc_info) -> NoReturn:
+        try:
+            self.close()
+        except Exception:
+            # a sink error must not replace the one leaving the with block
+            if exc_info[0] is None:
+                raise
+
+    def _write_frames(self) -> NoReturn:
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                return
+            if self._error is not None:
+                # keep draining, so close does not wait on a queue nobody reads
+                continue
+            try:
+                for sink in self.sinks:
+                    sink.write(frame)
+            except Exception as error:
+                self._error = error
+
+
+class RawSink(FrameSink):
+    """
+    Every frame as a RAW_RECORD header and its packed pixels
+    """
+
+    def __init__(self, path: Path):
+        self._output: BinaryIO = open(path, 'wb')
+
+    def write(self, frame: Frame) -> NoReturn:
+        self._output.write(RAW_RECORD.pack(frame.index, frame.width, frame.height) + frame.pixels)
+
+    def close(self) -> NoReturn:
+        self._output.close()
+
+
+def read_raw(path: Path) -> List[Frame]:
+    """
+    Frames written by RawSink
+    """
+    data = path.read_bytes()
+    frames = []
+    offset = 0
+    while offset < len(data):
+        index, width, height = RAW_RECORD.unpack_from(data, offset)
+        offset += RAW_RECORD.size
+        size = width * height // 8
+        frames.append(Frame(index, width, height, data[offset: offset + size]))
+        offset += size
+    return frames
+
+
+class HashSink(FrameSink):
+    """
+    Rolling hash of the frame stream: each frame hash is the SHA-1 of the previous
+    one followed by the frame, so the last one covers the whole run
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        :param path: Text file to write a '<frame> <hash>' line per frame to
+        """
+        self.digest = b''
+        self.frames = 0
+        self._output: Optional[TextIO] = open(path, 'w') if path is not None else None
+
+    @property
+    def hexdigest(self) -> Text:
+        return self.digest.hex()
+
+    def write(self, frame: Frame) -> NoReturn:
+        self.digest = hashlib.sha1(self.digest + frame.pixels).digest()
+        self.frames += 1
+        if self._output is not None:
+            self._output.write(f'{frame.index} {self.digest.hex()}\n')
+
+    def close(self) -> NoReturn:
+        if self._output is not None:
+            self._output.close()
+
+
+@lru_cache(maxsize=None)
+def _bit_table(scale: int) -> List[bytes]:
+    """
+    Packed byte -> the same 8 pixels each repeated scale times, packed
+    """
+    table = []
+    for byte in range(256):
+        bits = 0
+        for bit in range(7, -1, -1):
+            pixel = byte >> bit & 1
+            bits = bits << scale | (((1 << scale) - 1) if pixel else 0)
+        table.append(bits.to_bytes(scale, 'big'))
+    return table
+
+
+@lru_cache(maxsize=None)
+def _index_table(scale: int) -> List[bytes]:
+    """
+    Packed byte -> the same 8 pixels each repeated scale times, one palette index per byte
+    """
+    return [bytes(byte >> bit & 1 for bit in range(7, -1, -1) for _ in range(scale)) for byte in range(256)]
+
+
+def _frame_scale(frame: Frame, scale: int) -> int:
+    """
+    Output pixels per frame pixel, high resolution frames get half of scale so
+    every frame has the size of a low resolution one
+    """
+    return max(1, scale * SCREEN_WIDTH // frame.width)
+
+
+def _rows(frame: Frame) -> List[bytes]:
+    row_size = frame.width // 8
+    return [frame.pixels[start: start + row_size] for start in range(0, len(frame.pixels), row_size)]
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(frame: Frame, scale: int = 1) -> bytes:
+    """
+    1 bit grayscale PNG of a frame, whose packed rows already are PNG scanlines
+    """
+    pixel_scale = _frame_scale(frame, scale)
+    table = _bit_table(pixel_scale)
+    scanlines = []
+    for row in _rows(frame):
+        line = b'\0' + b''.join(table[byte] for byte in row)
+        scanlines.extend([line] * pixel_scale)
+
+    header = struct.pack('>IIBBBBB', frame.width * pixel_scale, frame.height * pixel_scale, 1, 0, 0, 0, 0)
+    return (PNG_SIGNATURE + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', zlib.compress(b''.join(scanlines)))
+            + _png_chunk(b'IEND', b''))
+
+
+class PngSequenceSink(FrameSink):
+    """
+    One PNG per frame, <directory>/<stem>_<frame>.png
+    """
+
+    def __init__(self, directory: Path, stem: Text = 'frame', scale: int = 4, skip_repeats: bool = False):
+        """
+        :param scale: Output pixels per low resolution pixel
+        :param skip_repeats: Only write the frames that differ from the one before
+        """
+        self.directory = directory
+        self.stem = stem
+        self.scale = scale
+        self.skip_repeats = skip_repeats
+        self._last: Optional[bytes] = None
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, frame: Frame) -> NoReturn:
+        if self.skip_repeats and frame.pixels == self._last:
+            return
+        self._last = frame.pixels
+        (self.directory / f'{self.stem}_{frame.index:06d}.png').write_bytes(encode_png(frame, self.scale))
+
+
+def _lzw(indices: bytes) -> bytes:
+    """
+    GIF flavoured LZW of palette indices, variable code size from GIF_CODE_SIZE + 1
+    bits, a clear code whenever the table is full
+    """
+    clear = 1 << GIF_CODE_SIZE
+    end = clear + 1
+    singles = [bytes([index]) for index in range(256)]
+    output = bytearray()
+    acc = 0
+    acc_bits = 0
+
+    codes = {singles[index]: index for index in range(clear)}
+    next_code = end + 1
+    code_size = GIF_CODE_SIZE + 1
+    acc |= clear << acc_bits
+    acc_bits += code_size
+
+    word = b''
+    for index in indices:
+        char = singles[index]
+        extended = word + char
+        if extended in codes:
+            word = extended
+            continue
+
+        acc |= codes[word] << acc_bits
+        acc_bits += code_size
+        while acc_bits >= 8:
+            output.append(acc & 0xFF)
+            acc >>= 8
+            acc_bits -= 8
+
+        if next_code < GIF_MAX_CODES:
+            codes[extended] = next_code
+            next_code += 1
+            if next_code > 1 << code_size and code_size < 12:
+                code_size += 1
+        else:
+            acc |= clear << acc_bits
+            acc_bits += code_size
+            codes = {singles[index]: index for index in range(clear)}
+            next_code = end + 1
+            code_size = GIF_CODE_SIZE + 1
+        word = char
+
+    if word:
+        acc |= codes[word] << acc_bits
+        acc_bits += code_size
+    acc |= end << acc_bits
+    acc_bits += code_size
+    while acc_bits > 0:
+        output.append(acc & 0xFF)
+        acc >>= 8
+        acc_bits -= 8
+    return bytes(output)
+
+
+def _sub_blocks(data: bytes) -> bytes:
+    blocks = [bytes([len(data[start: start + 255])]) + data[start: start + 255] for start in range(0, len(data), 255)]
+    return b''.join(blocks) + b'\0'
+
+
+class GifSink(FrameSink):
+    """
+    Lossless animated GIF, repeated frames are merged into a longer delay. The LZW
+    encoding is pure Python: cheap for mostly static screens, it competes with the
+    emulation for the interpreter on busy ones.
+    """
+
+    def __init__(self, path: Path, scale: int = 4, frame_rate: int = FRAME_RATE):
+        """
+        :param scale: Output pixels per low resolution pixel, at least 2 for high
+            resolution frames to fit the screen
+        """
+        if scale < 2:
+            raise ValueError("GIF recordings need a scale of at least 2")
+        self.scale = scale
+        self.frame_rate = frame_rate
+        self._output: BinaryIO = open(path, 'wb')
+        self._pending: Optional[Frame] = None
+        self._last_index = 0
+
+        # logical screen of a low resolution frame, global 2 color table, loop forever
+        header = b'GIF89a' + struct.pack('<HHBBB', SCREEN_WIDTH * scale, SCREEN_HEIGHT * scale, 0x80, 0, 0)
+        loop = b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\0'
+        self._output.write(header + PALETTE + loop)
+
+    def write(self, frame: Frame) -> NoReturn:
+        pending = self._pending
+        if pending is not None and pending.pixels == frame.pixels:
+            self._last_index = frame.index
+            return
+        if pending is not None:
+            self._write_image(pending, frame.index)
+        self._pending = frame
+        self._last_index = frame.index
+
+    def close(self) -> NoReturn:
+        if self._pending is not None:
+            self._write_image(self._pending, self._last_index + 1)
+            self._pending = None
+        self._output.write(b';')
+        self._output.close()
+
+    def _centiseconds(self, index: int) -> int:
+        return round(index * 100 / self.frame_rate)
+
+    def _write_image(self, frame: Frame, end_index: int) -> NoReturn:
+        delay = self._centiseconds(end_index) - self._centiseconds(frame.index)
+        control = b'\x21\xF9\x04\x00' + struct.pack('<H', delay) + b'\0\0'
+
+        pixel_scale = _frame_scale(frame, self.scale)
+        table = _index_table(pixel_scale)
+        lines = []
+        for row in _rows(frame):
+            line = b''.join(table[byte] for byte in row)
+            lines.extend([line] * pixel_scale)
+        descriptor = b'\x2C' + struct.pack('<HHHHB', 0, 0, frame.width * pixel_scale, frame.height * pixel_scale, 0)
+        image = bytes([GIF_CODE_SIZE]) + _sub_blocks(_lzw(b''.join(lines)))
+        self._output.write(control + descriptor + image)
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Run a rom headless and record its frames')
+    parser.add_argument('rom')
+    parser.add_argument('--frames', type=int, default=600, help='60 Hz frames to run the rom for')
+    parser.add_argument('--cycles-per-frame', type=int, default=DEFAULT_CYCLES_PER_FRAME)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--inputs', default=None, help='json input script of [frame, keys] events')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='interpreter')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), default='chip8')
+    parser.add_argument('--scale', type=int, default=4, help='output pixels per low resolution pixel')
+    parser.add_argument('--gif', default=None, help='animated GIF to write')
+    parser.add_argument('--png-dir', default=None, help='directory to write a PNG per frame to')
+    parser.add_argument('--raw', default=None, help='raw 1 bit frame dump to write')
+    parser.add_argument('--hashes', default=None, help='text file of the rolling frame hashes')
+    args = parser.parse_args(argv)
+
+    hashes = HashSink(Path(args.hashes) if args.hashes else None)
+    sinks: List[FrameSink] = [hashes]
+    if args.gif:
+        sinks.append(GifSink(Path(args.gif), args.scale))
+    if args.png_dir:
+        sinks.append(PngSequenceSink(Path(args.png_dir), Path(args.rom).stem, args.scale))
+    if args.raw:
+        sinks.append(RawSink(Path(args.raw)))
+
+    chip8 = Chip8(args.seed, rom_profile(Path(args.rom), PROFILES[args.quirks]))
+    chip8.initialize()
+    chip8.load_rom(Path(args.rom).read_bytes())
+    scheduler = FrameScheduler(chip8, ENGINES[args.engine](chip8), args.cycles_per_frame)
+    inputs = load_inputs(args.inputs)
+
+    with SinkPipeline(sinks).attach(scheduler):
+        for frame in range(args.frames):
+            if frame in inputs:
+                chip8.key_press(inputs[frame])
+            scheduler.run_frame()
+
+    print(f'{hashes.frames} frames, hash {hashes.hexdigest}')
+
+
+if __name__ == '__main__':
+    main()
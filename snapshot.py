@@ -0,0 +1,294 @@
+import struct
+import zlib
+from array import array
+from collections import deque
+from typing import (
+    Deque,
+    List,
+    NoReturn,
+    Optional,
+    Tuple
+)
+
+from chip8 import (
+    Chip8,
+    HIRES_HEIGHT,
+    HIRES_WIDTH,
+    RPL_FLAGS,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    STACK_DEPTH,
+    SYSTEM_MEMORY
+)
+
+MAGIC = b'C8SN'
+VERSION = 4
+
+# magic, version, pc, I, delay, sound, sp, flags, keypad state, V0..VF, stack
+HEADER = struct.Struct(f'<4sBHHBBBBH16s{STACK_DEPTH}H')
+# Mersenne Twister state of the machine random generator
+RNG_STATE = struct.Struct('<625I')
+RNG_VERSION = 3
+# room for the largest framebuffer, a low resolution one only fills the start
+FRAME_SIZE = HIRES_HEIGHT * HIRES_WIDTH // 8
+MEMORY_START = HEADER.size + RNG_STATE.size
+RPL_START = MEMORY_START + SYSTEM_MEMORY
+FRAME_START = RPL_START + RPL_FLAGS
+SNAPSHOT_SIZE = FRAME_START + FRAME_SIZE
+
+FLAG_DRAW = 0x01
+FLAG_HALT = 0x02
+FLAG_HIRES = 0x04
+
+# changed state is recorded in chunks of this many bytes between two frames
+DELTA_CHUNK = 32
+
+
+def capture(chip8: Chip8) -> bytes:
+    """
+    Serialize the whole machine state into a fixed size snapshot
+    """
+    flags = ((FLAG_DRAW if chip8.draw_flag else 0) | (FLAG_HALT if chip8.halt_execution else 0)
+             | (FLAG_HIRES if chip8.screen_width == HIRES_WIDTH else 0))
+    header = HEADER.pack(MAGIC, VERSION, chip8.pc, chip8.index_reg, chip8.delay_reg, chip8.sound_reg,
+                         chip8.sp, flags, chip8.keys, bytes(chip8.v), *chip8.stack)
+    rng_state = RNG_STATE.pack(*chip8.rng.getstate()[1])
+    return header + rng_state + chip8.memory + chip8.rpl + chip8.frame_bytes().ljust(FRAME_SIZE, b'\0')
+
+
+def restore(chip8: Chip8, snapshot: bytes) -> NoReturn:
+    """
+    Load a snapshot taken by capture into a machine
+    """
+    if len(snapshot) != SNAPSHOT_SIZE or snapshot[:4] != MAGIC:
+        raise ValueError("Not a Chip8 snapshot")
+
+    magic, version, pc, index_reg, delay, sound, sp, flags, keys, v, *stack = HEADER.unpack_from(snapshot)
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+
+    chip8.pc = pc
+    chip8.index_reg = index_reg
+    chip8.delay_reg = delay
+    chip8.sound_reg = sound
+    chip8.sp = sp
+    chip8.halt_execution = bool(flags & FLAG_HALT)
+    chip8.keys = keys
+    chip8.v[:] = v
+    chip8.stack[:] = array('H', stack)
+    chip8.rng.setstate((RNG_VERSION, RNG_STATE.unpack_from(snapshot, HEADER.size), None))
+
+    chip8.memory[:] = snapshot[MEMORY_START: RPL_START]
+    chip8.rpl[:] = snapshot[RPL_START: FRAME_START]
+
+    # marks the whole screen dirty
+    if flags & FLAG_HIRES:
+        chip8.set_resolution(HIRES_WIDTH, HIRES_HEIGHT)
+    else:
+        chip8.set_resolution(SCREEN_WIDTH, SCREEN_HEIGHT)
+    chip8.draw_flag = bool(flags & FLAG_DRAW)
+    row_size = chip8.screen_width // 8
+    frame_end = FRAME_START + row_size * chip8.screen_height
+    chip8.gfx[:] = [int.from_bytes(snapshot[start: start + row_size], 'big')
+                    for start in range(FRAME_START, frame_end, row_size)]
+
+
+def fork(chip8: Chip8) -> Chip8:
+    """
+    New machine in the same state, e.g. to branch a search from a warmed up game
+    """
+    child = Chip8(quirks=chip8.quirks)
+    child.initialize()
+    restore(child, capture(chip8))
+    child.trace = chip8.trace
+    return child
+
+
+def diff(previous: bytes, current: bytes) -> bytes:
+    """
+    Chunks of current that differ from previous, as (chunk index, chunk) records
+    """
+    records = []
+    for start in range(0, len(current), DELTA_CHUNK):
+        end = start + DELTA_CHUNK
+        if current[start:end] != previous[start:end]:
+            records.append(struct.pack('<H', start // DELTA_CHUNK) + current[start:end])
+    return b''.join(records)
+
+
+def patch(previous: bytes, delta: bytes) -> bytes:
+    state = bytearray(previous)
+    record_size = 2 + DELTA_CHUNK
+    for record in range(0, len(delta), record_size):
+        start = struct.unpack_from('<H', delta, record)[0] * DELTA_CHUNK
+        chunk = delta[record + 2: record + record_size]
+        state[start: start + len(chunk)] = chunk
+    return bytes(state)
+
+
+class _Segment:
+    """
+    A keyframe followed by the deltas of the next frames, compressed once full
+    """
+
+    def __init__(self, keyframe: bytes, rng_base: Optional[bytes] = None):
+        """
+        :param keyframe: Snapshot of the first frame
+        :param rng_base: Random generator state the sealed keyframe is stored against
+        """
+        self.keyframe = keyframe
+        self.last = keyframe
+        self.deltas: List[bytes] = []
+        self.compressed: Optional[bytes] = None
+        self.length = 1
+        # the generator state only moves on CXKK and zlib cannot shrink it, so a sealed
+        # keyframe keeps it apart as the changed chunks against a state shared with the
+        # neighbouring segments
+        self.rng_base = rng_base
+        self.rng_delta = b''
+
+    def __len__(self):
+        return self.length
+
+    def append(self, snapshot: bytes) -> NoReturn:
+        self.deltas.append(diff(self.last, snapshot))
+        self.last = snapshot
+        self.length += 1
+
+    def seal(self) -> NoReturn:
+        keyframe = self.keyframe
+        rng_state = keyframe[HEADER.size: MEMORY_START]
+        if self.rng_base is None:
+            self.rng_base = rng_state
+        else:
+            self.rng_delta = diff(self.rng_base, rng_state)
+            # once the generator regenerates its state a delta is no smaller than a new base
+            if len(self.rng_delta) > RNG_STATE.size // 2:
+                self.rng_base, self.rng_delta = rng_state, b''
+
+        lengths = struct.pack(f'<{len(self.deltas)}H', *map(len, self.deltas))
+        self.compressed = zlib.compress(struct.pack('<H', len(self.deltas)) + lengths + keyframe[:HEADER.size]
+                                        + keyframe[MEMORY_START:] + b''.join(self.deltas))
+        self.keyframe = self.last = b''
+        self.deltas = []
+
+    def frames(self) -> Tuple[bytes, List[bytes]]:
+        if self.compressed is None:
+            return self.keyframe, self.deltas
+
+        data = zlib.decompress(self.compressed)
+        count = struct.unpack_from('<H', data)[0]
+        lengths = struct.unpack_from(f'<{count}H', data, 2)
+        start = 2 + 2 * count
+        offset = start + SNAPSHOT_SIZE - RNG_STATE.size
+        keyframe = (data[start: start + HEADER.size] + patch(self.rng_base, self.rng_delta)
+                    + data[start + HEADER.size: offset])
+        deltas = []
+        for length in lengths:
+            deltas.append(data[offset: offset + length])
+            offset += length
+        return keyframe, deltas
+
+    def snapshot(self, frame: int) -> bytes:
+        if self.compressed is None and frame == len(self) - 1:
+            return self.last
+
+        state, deltas = self.frames()
+        for delta in deltas[:frame]:
+            state = patch(state, delta)
+        return state
+
+    def truncate(self, frames: int) -> NoReturn:
+        """
+        Keep only the first frames of the segment
+        """
+        keyframe, deltas = self.frames()
+        self.compressed = None
+        self.keyframe = keyframe
+        self.deltas = deltas[:frames - 1]
+        self.length = frames
+        self.last = keyframe
+        for delta in self.deltas:
+            self.last = patch(self.last, delta)
+
+
+class RewindBuffer:
+    """
+    Bounded history of per-frame snapshots. Every keyframe_interval frames a full
+    snapshot starts a segment, the frames in between only keep the chunks that
+    changed, and finished segments are zlib compressed as a whole.
+    """
+
+    def __init__(self, capacity: int = 60 * 60 * 60, keyframe_interval: int = 60):
+        """
+        :param capacity: Frames kept, the oldest segments are dropped beyond it
+        :param keyframe_interval: Frames per segment
+        """
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self._segments: Deque[_Segment] = deque()
+        self._frames = 0
+
+    def __len__(self):
+        return self._frames
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the recorded frames
+        """
+        total = 0
+        # random generator states shared between segments count once
+        rng_bases = {}
+        for segment in self._segments:
+            if segment.compressed is not None:
+                total += len(segment.compressed) + len(segment.rng_delta)
+                rng_bases[id(segment.rng_base)] = len(segment.rng_base)
+            else:
+                total += len(segment.keyframe) + sum(map(len, segment.deltas))
+        return total + sum(rng_bases.values())
+
+    def push(self, snapshot: bytes) -> NoReturn:
+        segments = self._segments
+        if not segments or len(segments[-1]) >= self.keyframe_interval:
+            rng_base = None
+            if segments:
+                segments[-1].seal()
+                rng_base = segments[-1].rng_base
+            segments.append(_Segment(snapshot, rng_base))
+        else:
+            segments[-1].append(snapshot)
+        self._frames += 1
+
+        while self._frames - len(segments[0]) >= self.capacity:
+            self._frames -= len(segments.popleft())
+
+    def record(self, chip8: Chip8) -> NoReturn:
+        self.push(capture(chip8))
+
+    def get(self, frames_back: int = 0) -> bytes:
+        """
+        :param frames_back: 0 for the latest frame
+        """
+        segment, frame = self._locate(frames_back)
+        return segment.snapshot(frame)
+
+    def rewind(self, chip8: Chip8, frames_back: int) -> NoReturn:
+        """
+        Restore the machine to an earlier frame and forget the frames after it
+        """
+        segment, frame = self._locate(frames_back)
+        restore(chip8, segment.snapshot(frame))
+
+        while self._segments[-1] is not segment:
+            self._frames -= len(self._segments.pop())
+        self._frames -= len(segment) - (frame + 1)
+        segment.truncate(frame + 1)
+
+    def _locate(self, frames_back: int) -> Tuple[_Segment, int]:
+        if not 0 <= frames_back < self._frames:
+            raise IndexError(f"Only {self._frames} frames recorded")
+
+        for segment in reversed(self._segments):
+            if frames_back < len(segment):
+                return segment, len(segment) - 1 - frames_back
+            frames_back -= len(segment)
@@ -0,0 +1,162 @@
+import threading
+from queue import Empty, SimpleQueue
+from typing import (
+    Callable,
+    Generic,
+    List,
+    NoReturn,
+    Optional,
+    TypeVar
+)
+
+from chip8 import Chip8
+from scheduler import FrameScheduler
+
+T = TypeVar('T')
+
+
+class TripleBuffer(Generic[T]):
+    """
+    Hands the latest value from one producer thread to one consumer thread.
+    The producer fills its back slot and swaps it with the middle one, the
+    consumer swaps the middle slot with its front one when a new value is there,
+    so neither side ever waits for the other to finish with a slot.
+    """
+
+    def __init__(self, front: T, middle: T, back: T):
+        self._front = front
+        self._middle = middle
+        self._back = back
+        self._fresh = False
+        # only guards the pointer swaps, never held while a slot is used
+        self._swap = threading.Lock()
+        self._published = threading.Event()
+
+    @property
+    def back(self) -> T:
+        """
+        Slot owned by the producer
+        """
+        return self._back
+
+    def publish(self) -> NoReturn:
+        with self._swap:
+            self._back, self._middle = self._middle, self._back
+            self._fresh = True
+            # set under the lock so a consume in between cannot clear it after the swap
+            self._published.set()
+
+    def consume(self, timeout: Optional[float] = None) -> Optional[T]:
+        """
+        :param timeout: Seconds to wait for a new value, 0 to only poll
+        :return: The newest published value, None when nothing new was published
+        """
+        if timeout and not self._fresh:
+            self._published.wait(timeout)
+        with self._swap:
+            if not self._fresh:
+                return None
+            self._front, self._middle = self._middle, self._front
+            self._fresh = False
+            self._published.clear()
+        return self._front
+
+
+class Frame:
+    """
+    Published copy of the framebuffer, drawable by DirtyRectRenderer
+    """
+
+    __slots__ = ('gfx', 'dirty_rows', 'dirty_cols', 'sound', 'index')
+
+    def __init__(self, rows: int):
+        self.gfx: List[int] = [0] * rows
+        self.dirty_rows: int = 0
+        self.dirty_cols: int = 0
+        self.sound: bool = False
+        self.index: int = -1
+
+
+class EmulationThread(threading.Thread):
+    """
+    Runs the frame scheduler on its own thread. Keys reach the machine through a
+    queue drained before every frame, finished frames go out through a triple
+    buffer, so a slow display flip never stalls the cpu and the reverse.
+    """
+
+    def __init__(self, scheduler: FrameScheduler, key_handler: Optional[Callable[[int], None]] = None):
+        """
+        :param scheduler: Scheduler of the machine, only touched from this thread once started
+        :param key_handler: Applies a keypad state on this thread, chip8.set_keys by default
+        """
+        super().__init__(name='chip8-emulation', daemon=True)
+        self.scheduler = scheduler
+        self.key_handler = key_handler or scheduler.chip8.set_keys
+        rows = len(scheduler.chip8.gfx)
+        self.frames: TripleBuffer[Frame] = TripleBuffer(Frame(rows), Frame(rows), Frame(rows))
+        self._keys: SimpleQueue = SimpleQueue()
+        self._stopped = threading.Event()
+        # framebuffer the consumer last drew, to diff the next frame against
+        self._shown: List[int] = []
+
+    def set_keys(self, mask: int) -> NoReturn:
+        """
+        Queue a keypad state for the machine, callable from any thread
+        """
+        self._keys.put(mask)
+
+    def stop(self, timeout: Optional[float] = None) -> NoReturn:
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self) -> NoReturn:
+        scheduler = self.scheduler
+        keys = self._keys
+        while not self._stopped.is_set():
+            try:
+                while True:
+                    self.key_handler(keys.get_nowait())
+            except Empty:
+                pass
+
+            if scheduler.advance():
+                self.__publish(scheduler.chip8)
+
+            wait = scheduler.time_until_next_frame()
+            if wait > 0:
+                self._stopped.wait(wait)
+
+    def latest_frame(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        Newest frame with its dirty masks set against the frame returned before
+        :param timeout: Seconds to wait for a new frame
+        :return: None when no new frame was published
+        """
+        frame = self.frames.consume(timeout)
+        if frame is None:
+            return None
+
+        shown = self._shown
+        if len(shown) != len(frame.gfx):
+            # first frame or resolution switch, the width is twice the height
+            frame.dirty_rows = (1 << len(frame.gfx)) - 1
+            frame.dirty_cols = (1 << 2 * len(frame.gfx)) - 1
+        else:
+            dirty_rows = 0
+            dirty_cols = 0
+            for row, (old, new) in enumerate(zip(shown, frame.gfx)):
+                if old != new:
+                    dirty_rows |= 1 << row
+                    dirty_cols |= old ^ new
+            frame.dirty_rows = dirty_rows
+            frame.dirty_cols = dirty_cols
+        self._shown = frame.gfx.copy()
+        return frame
+
+    def __publish(self, chip8: Chip8) -> NoReturn:
+        frame = self.frames.back
+        frame.gfx[:] = chip8.gfx
+        frame.sound = chip8.sound_reg > 0
+        frame.index = self.scheduler.frame_count
+        self.frames.publish()
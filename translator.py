@@ -0,0 +1,591 @@
+import re
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Text,
+    Tuple
+)
+
+from chip8 import Chip8, LARGE_FONT_ADDR, STACK_DEPTH, SYSTEM_MEMORY
+from decoder import InstructionDecoder
+
+# most instructions a block executes
+MAX_BLOCK_LENGTH = 64
+# last address a block may reach, so pc never needs the end of memory check
+MAX_BLOCK_ADDR = SYSTEM_MEMORY - 8
+
+# compiled function of the machine, the most instructions it may execute and the
+# translator invalidate method, returning the instructions it executed
+Block = Callable[[Chip8, int, Callable[[int, int], None]], int]
+
+_REGISTER = re.compile(r'\bv(\d+)\b')
+# registers a line assigns, the only ones a block stores back
+_ASSIGNED = re.compile(r'^\s*((?:v\d+, )*v\d+) [-+|&^]?= ')
+
+
+# straight-line instructions, registers live in locals v0..v15 and I in i
+
+def _nop() -> List[Text]:
+    return ['pass']
+
+
+def _clear_display_00e0() -> List[Text]:
+    return ['chip8.clear_display_00e0()']
+
+
+def _set_reg_value_6xkk(x, byte) -> List[Text]:
+    return [f'v{x} = {byte}']
+
+
+def _add_value_7xkk(x, byte) -> List[Text]:
+    return [f'r = v{x} + {byte}',
+            'v15 = 1 if r > 0xFF else 0',
+            f'v{x} = r & 0xFF']
+
+
+def _set_reg_reg_8xy0(x, y) -> List[Text]:
+    return [f'v{x} = v{y}']
+
+
+def _or_reg_reg_8xy1(x, y) -> List[Text]:
+    return [f'v{x} |= v{y}']
+
+
+def _and_reg_reg_8xy2(x, y) -> List[Text]:
+    return [f'v{x} &= v{y}']
+
+
+def _xor_reg_reg_8xy3(x, y) -> List[Text]:
+    return [f'v{x} ^= v{y}']
+
+
+def _add_reg_carry_8xy4(x, y) -> List[Text]:
+    return [f'r = v{x} + v{y}',
+            'v15 = 1 if r > 0xFF else 0',
+            f'v{x} = r & 0xFF']
+
+
+def _sub_reg_reg_8xy5(x, y) -> List[Text]:
+    return [f'v15 = 1 if v{x} >= v{y} else 0',
+            f'v{x} = (v{x} - v{y}) & 0xFF']
+
+
+def _shr_reg_8xy6(x, y) -> List[Text]:
+    return [f'v15 = v{y} & 0x1',
+            f'v{x} = v{y} >> 0x1']
+
+
+def _shr_reg_8xy6_vx(x, y) -> List[Text]:
+    return [f'v15 = v{x} & 0x1',
+            f'v{x} = v{x} >> 0x1']
+
+
+def _subn_reg_reg_8xy7(x, y) -> List[Text]:
+    return [f'v15 = 1 if v{y} >= v{x} else 0',
+            f'v{x} = (v{y} - v{x}) & 0xFF']
+
+
+def _shl_reg_8xye(x, y) -> List[Text]:
+    return [f'v15 = (v{y} >> 7) & 0x01',
+            f'v{x} = (v{y} << 1) & 0xFF']
+
+
+def _shl_reg_8xye_vx(x, y) -> List[Text]:
+    return [f'v15 = (v{x} >> 7) & 0x01',
+            f'v{x} = (v{x} << 1) & 0xFF']
+
+
+def _set_index_value_annn(addr) -> List[Text]:
+    return [f'i = {addr}']
+
+
+def _set_random_and_value_cxkk(x, byte) -> List[Text]:
+    return [f'v{x} = chip8.rng.randint(0, 255) & {byte}']
+
+
+def _save_delay_fx07(x) -> List[Text]:
+    return [f'v{x} = chip8.delay_reg']
+
+
+def _set_delay_fx15(x) -> List[Text]:
+    return [f'chip8.delay_reg = v{x}']
+
+
+def _set_sound_fx18(x) -> List[Text]:
+    return [f'chip8.sound_reg = v{x}']
+
+
+def _add_index_fx1e(x) -> List[Text]:
+    return [f'i = (i + v{x}) & 0xFFFF']
+
+
+def _set_sprite_loc_fx29(x) -> List[Text]:
+    return [f'i = v{x} * 5']
+
+
+def _set_large_sprite_loc_fx30(x) -> List[Text]:
+    return [f'i = {LARGE_FONT_ADDR} + (v{x} & 0xF) * 10']
+
+
+def _in_memory(length: int) -> List[Text]:
+    """
+    Raise as the interpreter does when length bytes at I run past the memory, a slice
+    would be cut short instead
+    """
+    return [f'if i > {SYSTEM_MEMORY - length}:',
+            "    raise IndexError('bytearray index out of range')"]
+
+
+def _read_regs_fx65_keep_index(x) -> List[Text]:
+    if not x:
+        return ['v0 = memory[i]']
+    return _in_memory(x + 1) + [f'{", ".join(f"v{reg}" for reg in range(x + 1))} = memory[i:i + {x + 1}]']
+
+
+def _read_regs_fx65(x) -> List[Text]:
+    return _read_regs_fx65_keep_index(x) + [f'i += {x + 1}']
+
+
+STRAIGHT_LINE = {
+    'do_nothing': _nop,
+    'clear_display_00e0': _clear_display_00e0,
+    'set_reg_value_6xkk': _set_reg_value_6xkk,
+    'add_value_7xkk': _add_value_7xkk,
+    'set_reg_reg_8xy0': _set_reg_reg_8xy0,
+    'or_reg_reg_8xy1': _or_reg_reg_8xy1,
+    'and_reg_reg_8xy2': _and_reg_reg_8xy2,
+    'xor_reg_reg_8xy3': _xor_reg_reg_8xy3,
+    'add_reg_carry_8xy4': _add_reg_carry_8xy4,
+    'sub_reg_reg_8xy5': _sub_reg_reg_8xy5,
+    'shr_reg_8xy6': _shr_reg_8xy6,
+    'shr_reg_8xy6_vx': _shr_reg_8xy6_vx,
+    'subn_reg_reg_8xy7': _subn_reg_reg_8xy7,
+    'shl_reg_8xye': _shl_reg_8xye,
+    'shl_reg_8xye_vx': _shl_reg_8xye_vx,
+    'set_index_value_annn': _set_index_value_annn,
+    'set_random_and_value_cxkk': _set_random_and_value_cxkk,
+    'save_delay_fx07': _save_delay_fx07,
+    'set_delay_fx15': _set_delay_fx15,
+    'set_sound_fx18': _set_sound_fx18,
+    'add_index_fx1e': _add_index_fx1e,
+    'set_sprite_loc_fx29': _set_sprite_loc_fx29,
+    'set_large_sprite_loc_fx30': _set_large_sprite_loc_fx30,
+    'read_regs_fx65': _read_regs_fx65,
+    'read_regs_fx65_keep_index': _read_regs_fx65_keep_index,
+}
+
+
+# memory writes, the block ends after one so that it invalidates the blocks translated
+# from the written range once, and never runs on over code it overwrote
+
+def _bcd_repr_fx33(x) -> List[Text]:
+    return _in_memory(3) + [f'memory[i:i + 3] = (v{x} // 100, v{x} // 10 % 10, v{x} % 10)',
+                            'invalidate(i, i + 3)']
+
+
+def _store_regs_fx55_keep_index(x) -> List[Text]:
+    # a one register tuple keeps its comma
+    registers = ', '.join(f'v{reg}' for reg in range(x + 1)) if x else 'v0,'
+    return _in_memory(x + 1) + [f'memory[i:i + {x + 1}] = ({registers})',
+                                f'invalidate(i, i + {x + 1})']
+
+
+def _store_regs_fx55(x) -> List[Text]:
+    return _store_regs_fx55_keep_index(x) + [f'i += {x + 1}']
+
+
+MEMORY_STORES = {
+    'bcd_repr_fx33': _bcd_repr_fx33,
+    'store_regs_fx55': _store_regs_fx55,
+    'store_regs_fx55_keep_index': _store_regs_fx55_keep_index,
+}
+
+
+# handlers run on the machine from inside a block, with the registers stored before
+# and loaded again after the call. They never touch pc.
+CALL_OUT = {
+    'display_sprite_dxyn',
+    'display_sprite_dxyn_wrap',
+    'display_large_sprite_dxy0',
+    'scroll_down_00cn',
+    'scroll_right_00fb',
+    'scroll_left_00fc',
+    'low_res_00fe',
+    'high_res_00ff',
+    'save_flags_fx75',
+    'load_flags_fx85',
+}
+# placeholder lines, expanded once the registers a block holds in locals are known
+STORE_REGISTERS = '#store'
+LOAD_REGISTERS = '#load'
+
+
+# conditions of the skip instructions
+
+def _equal_value_3xkk(x, byte) -> Text:
+    return f'v{x} == {byte}'
+
+
+def _not_equal_value_4xkk(x, byte) -> Text:
+    return f'v{x} != {byte}'
+
+
+def _equal_reg_5xy0(x, y) -> Text:
+    return f'v{x} == v{y}'
+
+
+def _not_equal_reg_9xy0(x, y) -> Text:
+    return f'v{x} != v{y}'
+
+
+def _pressed_ex9e(x) -> Text:
+    return f'chip8.keys >> v{x} & 1'
+
+
+def _not_pressed_exa1(x) -> Text:
+    return f'not chip8.keys >> v{x} & 1'
+
+
+SKIP_CONDITIONS = {
+    'skip_if_equal_value_3xkk': _equal_value_3xkk,
+    'skip_if_not_equal_value_4xkk': _not_equal_value_4xkk,
+    'skip_if_equal_reg_5xy0': _equal_reg_5xy0,
+    'skip_if_not_equal_reg_9xy0': _not_equal_reg_9xy0,
+    'skip_if_pressed_ex9e': _pressed_ex9e,
+    'skip_if_not_pressed_exa1': _not_pressed_exa1,
+}
+
+
+# control flow, addr is the address of the instruction. A block follows jumps, calls
+# and the returns of the calls it followed, the others leave the block.
+
+def _call_subroutine_2nnn(addr) -> List[Text]:
+    return ['sp = chip8.sp',
+            f'chip8.stack[sp] = {addr}',
+            f'chip8.sp = (sp + 1) & {STACK_DEPTH - 1}']
+
+
+def _return_subroutine_00ee() -> List[Text]:
+    return [f'sp = (chip8.sp - 1) & {STACK_DEPTH - 1}',
+            'chip8.sp = sp']
+
+
+def _exit(pc: Text, executed: int, branches: bool) -> List[Text]:
+    """
+    Leave the block through the code after its loop, which stores the registers. One
+    line, blocks have plenty of exits and compiling them is most of the translation.
+    :param pc: Expression of the next pc
+    :param executed: Instructions executed when no skip was taken
+    :param branches: Whether skips taken so far are counted in k
+    """
+    return [f'pc = {pc}; n = {executed} - k; break' if branches else f'pc = {pc}; n = {executed}; break']
+
+
+def _out_of_budget(addr: int, executed: int, needed: int, branches: bool) -> List[Text]:
+    """
+    Leave the block before an instruction when the cycles left in the run do not cover it
+    :param needed: Instructions the next step may execute, 2 for a skip and the instruction after it
+    """
+    exit_line = _exit(str(addr), executed, branches)[0]
+    if branches:
+        return [f'if {executed + needed} - k > budget: {exit_line}']
+    return [f'if {executed + needed} > budget: {exit_line}']
+
+
+def _leave(handler: Text, addr: int, args: Tuple[int, ...], executed: int, branches: bool) -> List[Text]:
+    """
+    Lines of a jump, call or return leaving the block
+    """
+    if handler == 'jump_to_1nnn':
+        return _exit(str(args[0]), executed, branches)
+    if handler == 'call_subroutine_2nnn':
+        return _call_subroutine_2nnn(addr) + _exit(str(args[0]), executed, branches)
+    return _return_subroutine_00ee() + _exit('chip8.stack[sp] + 2', executed, branches)
+
+
+CONTROL_FLOW = {'jump_to_1nnn', 'call_subroutine_2nnn', 'return_subroutine_00ee'}
+
+# instructions writing memory, the written range invalidates cached blocks
+MEMORY_WRITES = {0xF033, 0xF055}
+# times a block start is reached before it is translated, code running once stays interpreted
+HOT_THRESHOLD = 16
+
+
+def _indented(lines: List[Text]) -> List[Text]:
+    return [f'    {line}' for line in lines]
+
+
+def _untranslated(chip8: Chip8, budget: int, invalidate: Callable[[int, int], None]) -> int:
+    """
+    Block of a start whose first instruction does not translate, it is interpreted
+    """
+    return 0
+
+
+class BlockTranslator:
+    """
+    Execution engine compiling runs of opcodes into Python functions. A block follows
+    jumps and calls, and returns into the calls it followed, unrolling the loops it
+    runs into up to MAX_BLOCK_LENGTH instructions. A skip whose next instruction
+    translates becomes a branch of the block, leaving it when that instruction is a
+    forward jump, call or return; a skip over a backward jump leaves the loop.
+    Draws and the other CALL_OUT handlers are called from the block, memory writes
+    end it; key waits and whatever else touches pc end a block and run through the
+    Chip8 interpreter. Blocks follow the quirk profile of the machine when they are
+    translated, flush them after changing it.
+
+    There is one block per start address. It is translated no longer than the runs
+    asking for it and leaves early when the cycles left in a run do not cover the
+    next instruction, so frames ending mid-block stay compiled. Compiled code is
+    shared by every translator of the process, keyed by its source.
+    """
+
+    # block source -> compiled function
+    _compiled: Dict[Text, Block] = {}
+
+    def __init__(self, chip8: Chip8):
+        self.chip8 = chip8
+        # start address -> block
+        self._blocks: Dict[int, Block] = {}
+        # memory address -> starts of the blocks translated from it
+        self._owners: Dict[int, List[int]] = {}
+        # 1 at the addresses in _owners, so writes to data skip the lookups
+        self._owned = bytearray(SYSTEM_MEMORY)
+        # start address -> times reached before turning hot
+        self._visits: Dict[int, int] = {}
+
+    def run(self, cycles: int) -> int:
+        """
+        Execute cycles through the compiled blocks
+        :param cycles: Number of instructions to execute
+        :return: Number of instructions executed
+        """
+        chip8 = self.chip8
+        if chip8.trace is not None or chip8.halt_execution:
+            # a key wait spins on its instruction, nothing to compile
+            return chip8.run(cycles)
+
+        blocks = self._blocks
+        invalidate = self.invalidate
+        remaining = cycles
+        while remaining > 0:
+            block = blocks.get(chip8.pc)
+            if block is None:
+                block = self._visit(chip8.pc, cycles)
+            if block is not None:
+                executed = block(chip8, remaining, invalidate)
+                if executed:
+                    remaining -= executed
+                    continue
+
+            self._interpret()
+            remaining -= 1
+            if chip8.halt_execution:
+                # waiting for a key, nothing changes until the host presses one
+                remaining -= chip8.run(remaining)
+
+        return cycles
+
+    def invalidate(self, start: int, end: int) -> NoReturn:
+        """
+        Drop the blocks translated from a memory range
+        :param start: First address written
+        :param end: Address after the last one written
+        """
+        owned = self._owned
+        if owned.find(1, start, end) < 0:
+            return
+        owners = self._owners
+        for addr in range(start, end):
+            for owner in owners.pop(addr, ()):
+                self._blocks.pop(owner, None)
+        owned[start:end] = bytes(len(owned[start:end]))
+
+    def flush(self) -> NoReturn:
+        """
+        Drop every block, e.g. after loading a new game
+        """
+        self._blocks.clear()
+        self._owners.clear()
+        self._owned[:] = bytes(SYSTEM_MEMORY)
+        self._visits.clear()
+
+    def _visit(self, start: int, cycles: int) -> Optional[Block]:
+        """
+        :param cycles: Cycles of the run reaching the start, the most the block is translated for
+        :return: The block once the start is hot, None before
+        """
+        visits = self._visits.get(start, 0) + 1
+        if visits < HOT_THRESHOLD:
+            self._visits[start] = visits
+            return None
+        self._visits.pop(start, None)
+        return self._translate(start, min(cycles, MAX_BLOCK_LENGTH))
+
+    def _interpret(self) -> NoReturn:
+        chip8 = self.chip8
+        memory = chip8.memory
+        pc = chip8.pc
+        opcode = memory[pc] << 8 | memory[pc + 1]
+        family = opcode & 0xF0FF
+
+        if family in MEMORY_WRITES:
+            start = chip8.index_reg
+            end = start + (3 if family == 0xF033 else ((opcode & 0x0F00) >> 8) + 1)
+            chip8.emulate_cycle()
+            self.invalidate(start, end)
+        else:
+            chip8.emulate_cycle()
+
+    def _decode(self, addr: int) -> Tuple[Text, Tuple[int, ...]]:
+        memory = self.chip8.memory
+        handler, args = InstructionDecoder.decode(memory[addr] << 8 | memory[addr + 1])
+        return self.chip8.quirks.handlers().get(handler, handler), args
+
+    @staticmethod
+    def _straight_line(handler: Text, args: Tuple[int, ...]) -> Optional[List[Text]]:
+        """
+        :return: Lines of an instruction continuing the block, None when it cannot
+        """
+        if handler in STRAIGHT_LINE:
+            return STRAIGHT_LINE[handler](*args)
+        if handler in CALL_OUT:
+            return [STORE_REGISTERS, f'chip8.{handler}({", ".join(map(str, args))})', LOAD_REGISTERS]
+        return None
+
+    def _translate(self, start: int, limit: int) -> Block:
+        """
+        :param limit: Most instructions the block may execute
+        """
+        lines = []
+        # instructions on the longest path through the block
+        length = 0
+        # whether a skip may shorten the path, the skips taken are counted in k
+        branches = False
+        translated = set()
+        # return addresses of the calls followed into
+        calls = []
+        addr = start
+
+        while True:
+            if length == limit or addr > MAX_BLOCK_ADDR:
+                lines += _exit(str(addr), length, branches)
+                break
+
+            handler, args = self._decode(addr)
+            if handler in SKIP_CONDITIONS:
+                if length + 2 > limit:
+                    lines += _exit(str(addr), length, branches)
+                    break
+                lines += _out_of_budget(addr, length, 2, branches)
+            elif length:
+                lines += _out_of_budget(addr, length, 1, branches)
+
+            body = self._straight_line(handler, args)
+            if body is not None:
+                lines += body
+                translated.add(addr)
+                length += 1
+                addr += 2
+            elif handler in MEMORY_STORES:
+                translated.add(addr)
+                lines += MEMORY_STORES[handler](*args) + _exit(str(addr + 2), length + 1, branches)
+                length += 1
+                break
+            elif handler == 'jump_to_1nnn':
+                translated.add(addr)
+                length += 1
+                addr = args[0]
+            elif handler == 'call_subroutine_2nnn' and len(calls) < STACK_DEPTH - 1:
+                # fewer calls in flight than stack entries, so the followed returns find their address
+                lines += _call_subroutine_2nnn(addr)
+                calls.append(addr)
+                translated.add(addr)
+                length += 1
+                addr = args[0]
+            elif handler == 'return_subroutine_00ee' and calls:
+                lines += _return_subroutine_00ee()
+                translated.add(addr)
+                length += 1
+                addr = calls.pop() + 2
+            elif handler in CONTROL_FLOW:
+                translated.add(addr)
+                lines += _leave(handler, addr, args, length + 1, branches)
+                length += 1
+                break
+            elif handler in SKIP_CONDITIONS:
+                # the skip and the instruction it may skip, one cycle less when it does
+                condition = SKIP_CONDITIONS[handler](*args)
+                translated.add(addr)
+                next_handler, next_args = self._decode(addr + 2) if addr + 2 <= MAX_BLOCK_ADDR else ('', ())
+                body = self._straight_line(next_handler, next_args)
+                if body is None and next_handler not in CONTROL_FLOW:
+                    lines += _exit(f'{addr + 4} if {condition} else {addr + 2}', length + 1, branches)
+                    length += 1
+                    break
+
+                translated.add(addr + 2)
+                if next_handler == 'jump_to_1nnn' and next_args[0] <= addr:
+                    # a loop back edge, the block goes around the loop and leaves when the skip ends it
+                    lines += [f'if {condition}:'] + _indented(_exit(str(addr + 4), length + 1, branches))
+                    length += 2
+                    addr = next_args[0]
+                    continue
+
+                if body is None:
+                    body = _leave(next_handler, addr + 2, next_args, length + 2, branches)
+                branches = True
+                lines += [f'if {condition}:', '    k += 1', 'else:'] + _indented(body)
+                length += 2
+                addr += 4
+            else:
+                lines += _exit(str(addr), length, branches)
+                break
+
+        if not length:
+            block = _untranslated
+        else:
+            block = self._compile(start, lines, branches)
+            for translated_addr in translated:
+                for owned in (translated_addr, translated_addr + 1):
+                    self._owners.setdefault(owned, []).append(start)
+                    self._owned[owned] = 1
+
+        self._blocks[start] = block
+        return block
+
+    @classmethod
+    def _compile(cls, start: int, body: List[Text], branches: bool) -> Block:
+        registers = sorted({int(reg) for line in body for reg in _REGISTER.findall(line)})
+        assigned = sorted({int(reg) for line in body for match in [_ASSIGNED.match(line)] if match
+                           for reg in _REGISTER.findall(match.group(1))})
+        uses_index = any(re.search(r'\bi\b', line) for line in body)
+        stores = [f'v[{reg}] = v{reg}' for reg in assigned] + (['chip8.index_reg = i'] if uses_index else [])
+        loads = [f'v{reg} = v[{reg}]' for reg in registers] + (['i = chip8.index_reg'] if uses_index else [])
+
+        lines = ['v = chip8.v', 'memory = chip8.memory'] + loads
+        if branches:
+            lines.append('k = 0')
+        # every exit breaks out of the loop to the one copy of the register stores
+        lines.append('while True:')
+        for line in body:
+            stripped = line.lstrip()
+            indent = '    ' + line[:len(line) - len(stripped)]
+            if stripped == STORE_REGISTERS:
+                lines += [indent + store for store in stores]
+            elif stripped == LOAD_REGISTERS:
+                lines += [indent + load for load in loads]
+            else:
+                lines.append('    ' + line)
+        lines += stores + ['chip8.pc = pc', 'return n']
+
+        source = '\n'.join(['def block(chip8, budget, invalidate):'] + _indented(lines))
+        func = cls._compiled.get(source)
+        if func is None:
+            namespace = {}
+            exec(compile(source, f'<block {hex(start)}>', 'exec'), namespace)
+            func = cls._compiled[source] = namespace['block']
+        return func
@@ -1,31 +1,53 @@
 import platform
 from random import randint
+from typing import List, Tuple
 
 
 def center_pygame_windows(width: int, height: int):
-    import screeninfo
+    """
+    Center the next pygame window on the main display, call it after pg.init and
+    before pg.display.set_mode
+    """
     import os
 
     if platform.system() == 'Windows':
         import ctypes
         ctypes.windll.user32.SetProcessDPIAware()
-        monitors = screeninfo.get_monitors(screeninfo.Enumerator.Cygwin)
-    else:
-        monitors = screeninfo.get_monitors()
 
+    monitors = _monitor_sizes()
     if len(monitors) < 1:
         print("Cannot get display info, using default windows position")
         return
 
-    current_monitor = monitors[-1]
-
-    screen_width = current_monitor.width
-    screen_height = current_monitor.height
+    screen_width, screen_height = monitors[0]
     x = (screen_width // 2) - (width // 2)
     y = (screen_height // 2) - (height // 2)
     os.environ['SDL_VIDEO_WINDOW_POS'] = f'{x},{y}'
 
 
+def _monitor_sizes() -> List[Tuple[int, int]]:
+    """
+    Sizes of the monitors, main display first. pygame 2 gets them from SDL, which
+    needs the display initialized, screeninfo and its monitor enumeration are only
+    loaded for older versions.
+    """
+    import pygame as pg
+
+    if hasattr(pg.display, 'get_desktop_sizes'):
+        if not pg.display.get_init():
+            return []
+        return pg.display.get_desktop_sizes()
+
+    import screeninfo
+    if platform.system() == 'Windows':
+        monitors = screeninfo.get_monitors(screeninfo.Enumerator.Cygwin)
+    else:
+        monitors = screeninfo.get_monitors()
+    # SDL lists the primary display first, is_primary is missing from older screeninfo
+    monitors = sorted(monitors, key=lambda monitor: not getattr(monitor, 'is_primary', False))
+    return [(monitor.width, monitor.height) for monitor in monitors]
+
+
 def generate_random_frame(w, h, pix):
     result = []
     pixel_count = 0
@@ -81,15 +103,15 @@ def print_sprite(sprite_bitmap):
         print()
 
 
-def snapshot_frame(gfx):
-    horizontal_margin = '#' * (len(gfx[0]) + 2)
+def snapshot_frame(gfx, width=64):
+    horizontal_margin = '#' * (width + 2)
 
     print(horizontal_margin)
 
     for row in gfx:
         print('#', end='')
-        for sprite_bit in row:
-            pixel = '*' if sprite_bit else ' '
+        for sprite_bit in format(row, f'0{width}b'):
+            pixel = '*' if sprite_bit == '1' else ' '
             print(pixel, end='')
         print('#')
 